@@ -1,29 +1,384 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import base64
+import binascii
+import struct
+from itertools import islice
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import ValidationError
-from src.schemas import Product
-from src.crud import (
-    write_product,
-    read_products,
-    uptodate_product,
-    delete_product,
+from src.schemas import BulkResult, PriceBucket, Product, ProductUpdate, SnapshotInfo
+from src.async_crud import (
+    Overloaded,
+    RequestScope,
+    run,
+    warm_up,
+    catalog_version,
+    product_version,
+    last_change,
+    read_changes,
+    write_unique_products,
+    read_rows,
+    read_rows_page,
+    iter_rows,
+    iter_rows_by_price,
+    uptodate_products,
+    delete_products,
     get_product_by_id,
-    sort_products_by_price,
+    sort_rows_by_price,
+    sort_rows_page,
+    search_products,
+    range_products_by_price,
+    top_products_by_price,
+    price_histogram,
+    catalog_stats,
+    verify_catalog_stats,
+    create_snapshot,
+    list_snapshots,
+    restore_snapshot,
+    delete_snapshot,
     truncate_db
 )
-from src.product_validator import validate
+from src.product_validator import validate, validate_update
+from src import config, executors, metrics
+from src.http_cache import BodyCache, not_modified, render_json, validators
+from src.indexes import same_stats
+from src.rows import ProductRow, rows_json
 
 app = FastAPI()
+app.add_middleware(RequestScope)
+app.add_middleware(metrics.RequestMetrics)
+
+# Serialized bodies of the read endpoints, each tagged with the version it was built from.
+body_cache = BodyCache(config.RESPONSE_CACHE_SIZE)
+
+
+# Background load of the catalog started with the app when config.WARMUP is set, and the error of its last attempt.
+warm_up_task: Optional[asyncio.Task] = None
+warm_up_error: Optional[str] = None
+
+
+async def warm_up_catalog() -> None:
+    """
+    Load the catalog and build its indexes, trying again every second until it succeeds.
+    Args:
+        Nothing
+    Returns:
+        Nothing
+    """
+    global warm_up_error
+    while True:
+        try:
+            await warm_up()
+        except Exception as e:
+            warm_up_error = f"{type(e).__name__}: {e}"
+            await asyncio.sleep(1)
+        else:
+            warm_up_error = None
+            return
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Requests are served meanwhile: the ones reading the catalog wait for the load in progress.
+    global warm_up_task
+    if config.WARMUP:
+        warm_up_task = asyncio.create_task(warm_up_catalog())
+
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    executors.shutdown()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # Shed load right away instead of letting requests queue up behind the crud executor.
+    return JSONResponse(status_code=503, content={"detail": "Server is busy, retry later."},
+                        headers={"Retry-After": "1"})
+
+# Media types of the streaming modes of the list endpoints.
+STREAM_MEDIA_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+# Products serialized per chunk of a streamed response.
+STREAM_BATCH_SIZE = 1000
+
+
+async def stream_products(rows: Iterator[ProductRow], mode: str) -> StreamingResponse:
+    """
+    Build a response that serializes rows in batches as they are produced.
+    Args:
+        rows (Iterator[ProductRow]): The rows of the products to send.
+        mode (str): "json" for a chunked JSON array, "ndjson" for one JSON object per line.
+    Returns:
+        StreamingResponse: The streaming response.
+    Raises:
+        HTTPException: If there are no products available.
+    """
+    # Producing the rows may read the database file, so each batch is produced and
+    # serialized off the event loop, in one hop to the crud executor.
+    first = await run(encode_batch, rows, mode, True)
+    if not first:
+        raise HTTPException(status_code=404, detail="No products available.")
+
+    async def body():
+        chunk = first
+        while chunk:
+            yield chunk
+            chunk = await run(encode_batch, rows, mode, False)
+        if mode == "json":
+            yield b"]"
+    return StreamingResponse(body(), media_type=STREAM_MEDIA_TYPES[mode])
+
+
+def encode_batch(rows: Iterator[ProductRow], mode: str, first: bool) -> bytes:
+    # Serialize the next STREAM_BATCH_SIZE rows of a streamed response, or b"" once there are none left.
+    with metrics.stage("encode_response"):
+        items = [row.json() for row in islice(rows, STREAM_BATCH_SIZE)]
+    if not items:
+        return b""
+    if mode == "ndjson":
+        return b"\n".join(items) + b"\n"
+    return (b"[" if first else b",") + b",".join(items)
+
+
+async def versioned_response(request: Request, version: Callable[[], Awaitable[Optional[Tuple[str, float]]]],
+                             build: Callable[[], Awaitable[Tuple[object, Dict[str, str]]]],
+                             encode: Callable[[object], bytes] = render_json) -> Response:
+    """
+    Answer a read request with ETag and Last-Modified headers, from the body cache when the version
+    it was built from is still current, or with 304 Not Modified when the client holds that version.
+    Args:
+        request (Request): The request. Its path and query string key the body cache.
+        version (Callable): Returns the (tag, time) version of what the request reads, or None if it does not exist.
+        build (Callable): Returns the content of the response and its extra headers. Called on a cache miss only.
+        encode (Callable, optional): Serializes the content, render_json by default.
+    Returns:
+        Response: The response.
+    Raises:
+        HTTPException: As raised by build.
+    """
+    current = await version()
+    key = (request.url.path, request.url.query)
+    if current is not None:
+        tag, modified = current
+        headers = validators(tag, modified)
+        if not_modified(request.headers, tag, modified):
+            return Response(status_code=304, headers=headers)
+        cached = body_cache.get(key, tag)
+        if cached is not None:
+            body, extra = cached
+            return Response(body, media_type="application/json", headers={**headers, **extra})
+    content, extra = await build()
+    body = await run(encode_json, content, encode)
+    # The body belongs to the version only if nothing changed while it was built.
+    if current is not None and await version() == current:
+        body_cache.put(key, tag, (body, extra))
+        extra = {**headers, **extra}
+    return Response(body, media_type="application/json", headers=extra)
+
+
+def encode_json(content, encode: Callable[[object], bytes] = render_json) -> bytes:
+    # Serialize a response body, timed as the encode_response stage.
+    with metrics.stage("encode_response"):
+        return encode(content)
+
+
+# Layout of the (price, id) pair encoded in the cursors of the price-ordered endpoints.
+PRICE_CURSOR = struct.Struct("<dq")
+
+
+def format_price_cursor(after: Tuple[float, int]) -> str:
+    """
+    Encode the position of a page of the price-ordered endpoints as an opaque, URL-safe cursor.
+    Args:
+        after (Tuple[float, int]): The price and ID of the last product of the page.
+    Returns:
+        str: The cursor, which can be pasted into a query string as is.
+    """
+    return base64.urlsafe_b64encode(PRICE_CURSOR.pack(*after)).rstrip(b"=").decode("ascii")
+
+
+def parse_price_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    Decode a cursor made by format_price_cursor.
+    Args:
+        cursor (str): The cursor returned with the previous page.
+    Returns:
+        Tuple[float, int]: The price and ID of the last product of the previous page.
+    Raises:
+        HTTPException: If the cursor is malformed.
+    """
+    try:
+        price, id = PRICE_CURSOR.unpack(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return price, id
+    except (ValueError, binascii.Error, struct.error):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
 
 @app.get("/")
-def home():
+async def home():
     return {"message": "Welcome to Emperia."}
 
 
+@app.get("/ready")
+async def ready():
+    """GET endpoint telling a load balancer whether to route traffic to this server process,
+    i.e. whether its catalog and indexes are loaded, so that requests do not wait for the load.
+    Returns:
+        dict: {"ready": true}, or {"ready": false} with status 503 while the catalog loads, with
+        the error of the last attempt if it failed, and for good if the load was cancelled or crashed.
+    """
+    if warm_up_task is None:
+        return {"ready": True}
+    if warm_up_task.cancelled():
+        detail = "The catalog load was cancelled."
+    elif warm_up_task.done():
+        error = warm_up_task.exception()
+        if error is None:
+            return {"ready": True}
+        detail = f"{type(error).__name__}: {error}"
+    else:
+        detail = warm_up_error
+    content = {"ready": False}
+    if detail is not None:
+        content["detail"] = detail
+    return JSONResponse(status_code=503, content=content, headers={"Retry-After": "1"})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """GET endpoint exposing the timings and counters in the Prometheus text format.
+    Returns:
+        str: The metrics.
+    Raises:
+        HTTPException: If metrics are disabled.
+    """
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled, set EMPERIA_METRICS=1.")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/product/search")
+async def search(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=1000)):
+    """GET endpoint to search the names and descriptions of the products.
+    Declared before /product/{product_id} so that "search" is not taken for a product ID.
+    Args:
+        q (str): The words to look for. Each word also matches the words it is a prefix of.
+        limit (int, optional): The maximum number of results, 20 by default.
+    Returns:
+        List[Product]: The products matching every word, best matches first.
+    Raises:
+        HTTPException: If no product matches.
+    """
+    products = await search_products(q, limit)
+    if products:
+        return products
+    else:
+        raise HTTPException(status_code=404, detail="No products found.")
+
+
+@app.get("/product/stats")
+async def product_stats(request: Request, verify: bool = False):
+    """GET endpoint to retrieve the size and price statistics of the catalog without reading it.
+    Answers 304 when the If-None-Match or If-Modified-Since header matches the catalog version.
+    Args:
+        verify (bool, optional): Whether to also recompute the statistics from the store and compare them
+            with the running ones. This reads the whole catalog, and the response is never cached.
+    Returns:
+        dict: The CatalogStats, or {"consistent": ..., "stats": ..., "recomputed": ...} when verifying.
+    """
+    if verify:
+        stats, expected = await verify_catalog_stats()
+        return {"consistent": same_stats(stats, expected), "stats": stats, "recomputed": expected}
+
+    async def build():
+        return await catalog_stats(), {}
+
+    return await versioned_response(request, catalog_version, build)
+
+
+@app.get("/product/changes")
+async def product_changes(request: Request, after: Optional[int] = Query(None, ge=0),
+                          limit: int = Query(100, ge=1, le=1000), wait: float = Query(0, ge=0, le=3600),
+                          stream: Optional[str] = Query(None, regex="^sse$")):
+    """GET endpoint to follow the changes of the catalog instead of polling the full list.
+    Every add, update, delete and flush is an event {"seq", "op", "id", "product"} with
+    sequence numbers increasing by one; a client keeps the last sequence number it applied
+    and resumes from it. Declared before /product/{product_id}.
+    Args:
+        after (int, optional): The sequence number to resume after, or the Last-Event-ID header
+            of a reconnecting event stream. By default, only the changes from now on are sent.
+        limit (int, optional): The maximum number of events per response, or per read of the stream.
+        wait (float, optional): Long-polling: seconds to wait for a change when there is none yet.
+            With stream=sse: seconds to keep the stream open, 0 (the default) until the client leaves.
+        stream (str, optional): "sse" to receive the events as a text/event-stream.
+    Returns:
+        dict: {"last_seq": ..., "events": [...]}, or the event stream.
+    Raises:
+        HTTPException: 410 if events after `after` were already dropped, so the client must read the
+            whole catalog again and resume from the returned last_seq.
+    """
+    if after is None:
+        after = request.headers.get("last-event-id")
+        after = int(after) if after is not None and after.isdigit() else await last_change()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+
+    async def poll(after: int) -> List[Tuple[int, bytes]]:
+        changes, first = await read_changes(after, limit)
+        if after < first - 1:
+            raise HTTPException(status_code=410, detail="Changes were dropped, read the catalog again.")
+        return changes
+
+    if stream is None:
+        changes = await poll(after)
+        while not changes and loop.time() < deadline:
+            await asyncio.sleep(config.CHANGE_FEED_POLL)
+            changes = await poll(after)
+        last_seq = changes[-1][0] if changes else after
+        body = b'{"last_seq":%d,"events":[' % last_seq + b",".join(event for _, event in changes) + b"]}"
+        return Response(body, media_type="application/json")
+
+    changes = await poll(after)
+
+    async def events():
+        nonlocal after, changes
+        heartbeat = loop.time()
+        while True:
+            for seq, event in changes:
+                yield b"id: %d\ndata: %s\n\n" % (seq, event)
+                after = seq
+            if changes:
+                heartbeat = loop.time()
+            elif loop.time() - heartbeat > 15:
+                # Keeps proxies from closing an idle stream.
+                yield b": keep-alive\n\n"
+                heartbeat = loop.time()
+            if (wait and loop.time() >= deadline) or await request.is_disconnected():
+                return
+            if len(changes) < limit:
+                await asyncio.sleep(config.CHANGE_FEED_POLL)
+            try:
+                changes = await poll(after)
+            except HTTPException:
+                yield b"event: reset\ndata: {}\n\n"
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @app.get("/product/{product_id}")
-def get_product(product_id):
+async def get_product(request: Request, product_id):
     """
     The get_product endpoint retrieves a product by its ID.
+    Answers 304 when the If-None-Match or If-Modified-Since header matches the version of the product.
     Args:
         product_id (int): The ID of the product to retrieve.
     Returns:
@@ -31,31 +386,52 @@ def get_product(product_id):
     Raises:
         HTTPException: If the product is not found.
     """
-    product = get_product_by_id(product_id) if get_product_by_id(product_id) else None
-    if product:
-        return product
-    else:
-        raise HTTPException(status_code=404, detail="Product not found.")
+    async def build():
+        product = await get_product_by_id(product_id)
+        if product:
+            return product, {}
+        else:
+            raise HTTPException(status_code=404, detail="Product not found.")
+
+    return await versioned_response(request, lambda: product_version(product_id), build)
 
 
 @app.post("/product/all")
-def get_products():
+async def get_products(request: Request, stream: Optional[str] = Query(None, regex="^(json|ndjson)$"),
+                 limit: Optional[int] = Query(None, ge=1), cursor: Optional[int] = None):
     """
-    The get_products endpoint retrieves all the products.
+    The get_products endpoint retrieves all the products, or one page of them in ID order.
+    Unless streamed, answers 304 when the If-None-Match or If-Modified-Since header matches the catalog version.
+    Args:
+        stream (str, optional): "json" or "ndjson" to stream the products instead of building the whole list.
+        limit (int, optional): The page size. When given, the X-Next-Cursor header holds the cursor of the next page.
+        cursor (int, optional): The X-Next-Cursor value returned with the previous page.
     Returns:
         list: A list of dictionaries containing the product information.
     Raises:
         HTTPException: If there are no products available.
     """
-    products = read_products()
-    if products:
-        return products
-    else:
-        raise HTTPException(status_code=404, detail="No products available.")
+    async def build():
+        # Rows are serialized directly, no Product model is built for them.
+        if limit:
+            rows, next_cursor = await read_rows_page(limit, cursor)
+            headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else {}
+            if rows or cursor is not None:
+                return rows, headers
+            raise HTTPException(status_code=404, detail="No products available.")
+        rows = await read_rows()
+        if rows:
+            return rows, {}
+        else:
+            raise HTTPException(status_code=404, detail="No products available.")
+
+    if stream and not limit:
+        return await stream_products(await iter_rows(), stream)
+    return await versioned_response(request, catalog_version, build, rows_json)
 
 
 @app.post("/product/add")
-def add_product(product: Product):
+async def add_product(product: Product):
     """
     The add_product endpoint adds a new product to the database.
     Args:
@@ -70,16 +446,15 @@ def add_product(product: Product):
     except ValidationError as e:
         raise HTTPException(status_code=422, detail=str(e))
 
-    products = read_products()
-    if product in products:
+    # The duplicate check uses the content index and is made by the writer together with the insert.
+    new_ids = await write_unique_products([product])
+    if new_ids[0] is None:
         raise HTTPException(status_code=409, detail="The product already exists.")
-
-    write_product(product)
     return {"message": "Product added successfully."}
 
 
 @app.put("/product/update/{product_id}")
-def update_product(product: Product, product_id):
+async def update_product(product: Product, product_id):
     """
     The update_product endpoint updates an existing product in the database.
     Args:
@@ -88,33 +463,128 @@ def update_product(product: Product, product_id):
     Returns:
         dict: A dictionary containing a message indicating that the product was updated successfully.
     Raises:
-        HTTPException: If the product is not found.
+        HTTPException: If the product is invalid or not found.
     """
-    product_flag = get_product_by_id(product_id) if get_product_by_id(product_id) else None
-    if product_flag:
-        uptodate_product(product_id, product.name, product.description, product.price)
+    update = ProductUpdate(id=product_id, name=product.name, description=product.description, price=product.price)
+    try:
+        validate_update(update)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # The writer reports whether the product existed, so it is not looked up beforehand.
+    found = await uptodate_products([update])
+    if found[0]:
         return {"message": "Product updated successfully."}
     else:
         raise HTTPException(status_code=404, detail="Product not found.")
 
 
 @app.get("/product/all/sorted")
-def sort_products():
-    """GET endpoint to retrieve all products sorted by price.
+async def sort_products(request: Request, stream: Optional[str] = Query(None, regex="^(json|ndjson)$"),
+                  order: str = Query("desc", regex="^(asc|desc)$"),
+                  limit: Optional[int] = Query(None, ge=1), cursor: Optional[str] = None):
+    """GET endpoint to retrieve all products sorted by price, or one page of them.
+    Unless streamed, answers 304 when the If-None-Match or If-Modified-Since header matches the catalog version.
+    Args:
+        stream (str, optional): "json" or "ndjson" to stream the products instead of building the whole list.
+        order (str, optional): "desc" (default) for the most expensive products first, "asc" for the cheapest first.
+        limit (int, optional): The page size. When given, the X-Next-Cursor header holds the cursor of the next page.
+        cursor (str, optional): The X-Next-Cursor value returned with the previous page.
     Returns:
         List[Product]: List of all products sorted by price.
     Raises:
-        HTTPException: If there are no products available in the database.
+        HTTPException: If there are no products available in the database, or if the cursor is malformed.
     """
-    products = sort_products_by_price()
+    descending = order == "desc"
+    after = parse_price_cursor(cursor) if cursor and limit else None
+
+    async def build():
+        if limit:
+            rows, next_cursor = await sort_rows_page(limit, after, descending)
+            headers = {"X-Next-Cursor": format_price_cursor(next_cursor)} if next_cursor is not None else {}
+            if rows or after is not None:
+                return rows, headers
+            raise HTTPException(status_code=404, detail="No products available.")
+        rows = await sort_rows_by_price(descending)
+        if rows:
+            return rows, {}
+        else:
+            raise HTTPException(status_code=404, detail="No products available.")
+
+    if stream and not limit:
+        return await stream_products(await iter_rows_by_price(descending), stream)
+    return await versioned_response(request, catalog_version, build, rows_json)
+
+
+@app.get("/product/price/range")
+async def products_in_price_range(response: Response, low: float = Query(0, alias="min", ge=0),
+                                  high: float = Query(float("inf"), alias="max", ge=0),
+                                  limit: int = Query(100, ge=1), cursor: Optional[str] = None):
+    """GET endpoint to retrieve the products priced between two bounds, cheapest first.
+    Args:
+        low (float, optional): The lowest price, included. Passed as "min".
+        high (float, optional): The highest price, included. Passed as "max".
+        limit (int, optional): The page size, 100 by default. The X-Next-Cursor header holds the cursor of the next page.
+        cursor (str, optional): The X-Next-Cursor value returned with the previous page.
+    Returns:
+        List[Product]: The products of the page.
+    Raises:
+        HTTPException: If the bounds or the cursor are invalid, or if no product is in the range.
+    """
+    if low > high:
+        raise HTTPException(status_code=400, detail="min must not be greater than max.")
+    after = parse_price_cursor(cursor) if cursor else None
+    products, next_cursor = await range_products_by_price(low, high, limit, after)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = format_price_cursor(next_cursor)
+    if products or after is not None:
+        return products
+    raise HTTPException(status_code=404, detail="No products found.")
+
+
+@app.get("/product/price/top")
+async def top_products(k: int = Query(10, ge=1, le=1000), order: str = Query("desc", regex="^(asc|desc)$")):
+    """GET endpoint to retrieve the most expensive or the cheapest products.
+    Args:
+        k (int, optional): The number of products, 10 by default.
+        order (str, optional): "desc" (default) for the most expensive products, "asc" for the cheapest.
+    Returns:
+        List[Product]: The products, in price order.
+    Raises:
+        HTTPException: If there are no products available.
+    """
+    products = await top_products_by_price(k, order == "desc")
     if products:
         return products
-    else:
-        raise HTTPException(status_code=404, detail="No products available.")
+    raise HTTPException(status_code=404, detail="No products available.")
+
+
+@app.get("/product/price/histogram", response_model=List[PriceBucket])
+async def products_price_histogram(buckets: int = Query(10, ge=1, le=1000), edges: Optional[str] = None):
+    """GET endpoint to count the products per price bucket.
+    Args:
+        buckets (int, optional): The number of buckets of equal width between the lowest and highest price, 10 by default.
+        edges (str, optional): Comma separated ascending bucket edges, used instead of buckets when given.
+    Returns:
+        List[PriceBucket]: The buckets, cheapest first. The last bucket includes its upper edge.
+    Raises:
+        HTTPException: If the edges are invalid, or if there are no products available.
+    """
+    bounds = None
+    if edges:
+        try:
+            bounds = [float(edge) for edge in edges.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid edges.")
+        if len(bounds) < 2 or any(a >= b for a, b in zip(bounds, bounds[1:])):
+            raise HTTPException(status_code=400, detail="Edges must be at least two ascending prices.")
+    histogram = await price_histogram(buckets, bounds)
+    if histogram:
+        return histogram
+    raise HTTPException(status_code=404, detail="No products available.")
 
 
 @app.delete("/product/remove/{product_id}")
-def remove_product(product_id: int):
+async def remove_product(product_id: int):
     """DELETE endpoint to remove a product by ID.
     Args:
         product_id (int): ID of the product to remove.
@@ -123,24 +593,152 @@ def remove_product(product_id: int):
     Raises:
         HTTPException: If the product to remove does not exist in the database.
     """
-    product = get_product_by_id(product_id) if get_product_by_id(product_id) else None
-    if product:
-        delete_product(product_id)
+    found = await delete_products([product_id])
+    if found[0]:
         return {"message": "Product removed successfully."}
     else:
         raise HTTPException(status_code=404, detail="Product not found.")
 
 
 @app.delete("/product/flush")
-def flush_db():
+async def flush_db():
     """DELETE endpoint to delete all products from the database.
     Returns:
         Dict[str, str]: Message indicating successful database truncation.
     Raises:
         HTTPException: If there are no products in the database.
     """
-    if read_products():
-        truncate_db()
+    rows, _ = await read_rows_page(1)
+    if rows:
+        await truncate_db()
         return {"message": " Database is empty"}
     else:
         raise HTTPException(status_code=404, detail="No product is found.")
+
+
+@app.post("/product/bulk", response_model=List[BulkResult])
+async def add_products(products: List[Product]):
+    """POST endpoint to add several products in a single write.
+    Args:
+        products (List[Product]): The new products.
+    Returns:
+        List[BulkResult]: For each product, in order, its status code and new ID, or the reason it was rejected.
+    """
+    results = {}
+    accepted = []
+    for index, product in enumerate(products):
+        try:
+            validate(product)
+        except ValidationError as e:
+            results[index] = BulkResult(index=index, status=422, detail=str(e))
+            continue
+        accepted.append(index)
+    # Duplicates of existing products and of earlier items of the batch are rejected through the content index.
+    new_ids = await write_unique_products([products[index] for index in accepted])
+    for index, new_id in zip(accepted, new_ids):
+        results[index] = BulkResult(index=index, status=200, id=new_id, detail="Product added successfully.") \
+            if new_id is not None else BulkResult(index=index, status=409, detail="The product already exists.")
+    return [results[index] for index in range(len(products))]
+
+
+@app.put("/product/bulk", response_model=List[BulkResult])
+async def update_products(updates: List[ProductUpdate]):
+    """PUT endpoint to update several products in a single write.
+    Args:
+        updates (List[ProductUpdate]): The updates, each with the ID of the product to update. Fields left out are not changed.
+    Returns:
+        List[BulkResult]: For each update, in order, its status code.
+    """
+    results = {}
+    accepted = []
+    for index, update in enumerate(updates):
+        try:
+            validate_update(update)
+        except ValidationError as e:
+            results[index] = BulkResult(index=index, status=422, id=update.id, detail=str(e))
+            continue
+        accepted.append(index)
+    found = await uptodate_products([updates[index] for index in accepted])
+    for index, exists in zip(accepted, found):
+        results[index] = BulkResult(index=index, status=200, id=updates[index].id, detail="Product updated successfully.") \
+            if exists else BulkResult(index=index, status=404, id=updates[index].id, detail="Product not found.")
+    return [results[index] for index in range(len(updates))]
+
+
+@app.delete("/product/bulk", response_model=List[BulkResult])
+async def remove_products(ids: List[int]):
+    """DELETE endpoint to remove several products in a single write.
+    Args:
+        ids (List[int]): The IDs of the products to remove.
+    Returns:
+        List[BulkResult]: For each ID, in order, its status code.
+    """
+    found = await delete_products(ids)
+    return [BulkResult(index=index, status=200, id=id, detail="Product removed successfully.") if exists
+            else BulkResult(index=index, status=404, id=id, detail="Product not found.")
+            for index, (id, exists) in enumerate(zip(ids, found))]
+
+
+@app.post("/admin/snapshots", response_model=SnapshotInfo, status_code=201)
+async def add_snapshot(name: Optional[str] = None):
+    """POST endpoint to save a snapshot of the catalog. Writes are not held back while it is written.
+    Args:
+        name (str, optional): The name of the snapshot, by default its creation time.
+    Returns:
+        SnapshotInfo: The name, creation time, number of products and size of the snapshot.
+    Raises:
+        HTTPException: If the name is invalid, or if a snapshot already has this name.
+    """
+    try:
+        return await create_snapshot(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileExistsError:
+        raise HTTPException(status_code=409, detail="The snapshot already exists.")
+
+
+@app.get("/admin/snapshots", response_model=List[SnapshotInfo])
+async def get_snapshots():
+    """GET endpoint to list the snapshots of the catalog.
+    Returns:
+        List[SnapshotInfo]: The snapshots, oldest first.
+    """
+    return await list_snapshots()
+
+
+@app.post("/admin/snapshots/{name}/restore", response_model=SnapshotInfo)
+async def restore_from_snapshot(name: str):
+    """POST endpoint to replace the catalog with a snapshot, swapped in atomically.
+    Args:
+        name (str): The name of the snapshot.
+    Returns:
+        SnapshotInfo: The restored snapshot.
+    Raises:
+        HTTPException: If there is no such snapshot.
+    """
+    try:
+        info = await restore_snapshot(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if info is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found.")
+    return info
+
+
+@app.delete("/admin/snapshots/{name}")
+async def remove_snapshot(name: str):
+    """DELETE endpoint to delete a snapshot.
+    Args:
+        name (str): The name of the snapshot.
+    Returns:
+        Dict[str, str]: Message indicating successful snapshot removal.
+    Raises:
+        HTTPException: If there is no such snapshot.
+    """
+    try:
+        found = await delete_snapshot(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail="Snapshot not found.")
+    return {"message": "Snapshot removed successfully."}
@@ -1,7 +1,25 @@
-from apis import app
+import argparse
+import os
 import uvicorn
+from src import config
 from src.config import check_db
+from src.storage import BACKENDS
 
 if __name__ == '__main__':
-    check_db()
-    uvicorn.run(app, host='localhost', port=8000)
+    parser = argparse.ArgumentParser(description="Run the Emperia shop API.")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=config.DB_BACKEND,
+                        help="storage engine holding the catalog")
+    parser.add_argument("--host", default=config.HOST, help="address to bind")
+    parser.add_argument("--port", type=int, default=config.PORT, help="port to bind")
+    parser.add_argument("--workers", type=int, default=config.WORKERS,
+                        help="server processes, e.g. one per core")
+    parser.add_argument("--warmup", action=argparse.BooleanOptionalAction, default=config.WARMUP,
+                        help="load the catalog in the background at startup and report readiness at /ready")
+    args = parser.parse_args()
+    config.DB_BACKEND = args.backend
+    config.WARMUP = args.warmup
+    # Worker processes import the app afresh, so the choices reach them through the environment.
+    os.environ["EMPERIA_DB_BACKEND"] = args.backend
+    os.environ["EMPERIA_WARMUP"] = "1" if args.warmup else "0"
+    check_db(args.backend)
+    uvicorn.run("apis:app", host=args.host, port=args.port, workers=args.workers)
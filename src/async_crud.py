@@ -0,0 +1,240 @@
+import asyncio
+import functools
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+from src import config, crud
+from src.executors import get_crud_executor
+
+# Crud operations running or waiting for a thread of the crud executor.
+_pending = 0
+
+# Reads started by single_flight so far, and writes completed through this module so far.
+_started = 0
+_writes = 0
+
+
+class _Flight(NamedTuple):
+    # A read running in the crud executor: the order it started in, the number of writes completed
+    # when it started, and its result.
+    number: int
+    writes: int
+    future: asyncio.Future
+
+
+# Reads running in the crud executor by event loop, function and arguments, which identical reads wait for.
+_in_flight: Dict[Hashable, _Flight] = {}
+
+
+class _Scope:
+    # What the crud calls of one request have seen: the results of its reads, kept until it writes,
+    # and the number of the first read started after its last call completed.
+    __slots__ = ("results", "horizon")
+
+    def __init__(self):
+        self.results = {}
+        self.horizon = 0
+
+
+# The scope of the request being handled, set by RequestScope.
+_scope: ContextVar[Optional[_Scope]] = ContextVar("request_scope", default=None)
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing an operation when config.CRUD_MAX_PENDING operations are already pending."""
+
+
+async def run(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function in the crud executor without blocking the event loop.
+    Parameters:
+        fn (Callable): The function to run.
+        *args, **kwargs: The arguments of the function.
+    Returns:
+        Any: The result of the function.
+    Raises:
+        Overloaded: If too many operations are pending already.
+    """
+    global _pending
+    # Only the event loop thread updates the counter, so it needs no lock.
+    if _pending >= config.CRUD_MAX_PENDING:
+        raise Overloaded()
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_crud_executor(), functools.partial(fn, *args, **kwargs))
+    finally:
+        _pending -= 1
+
+
+def _key(fn: Callable, args: tuple, kwargs: dict) -> Optional[Hashable]:
+    # What identifies a call, or None if its arguments are not hashable.
+    key = (fn, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _observed() -> None:
+    # A crud call of the current request completed: its later reads must not join a read started before.
+    scope = _scope.get()
+    if scope is not None:
+        scope.horizon = _started + 1
+
+
+def _settle(key: Hashable, flight: _Flight) -> None:
+    # Forget a finished read, unless a newer one already took its place, and mark
+    # its exception as retrieved in case every caller waiting for it went away.
+    if _in_flight.get(key) is flight:
+        del _in_flight[key]
+    if not flight.future.cancelled():
+        flight.future.exception()
+
+
+async def single_flight(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run a read in the crud executor, or wait for the identical read already running and share its result.
+    A running read is only joined if it started after the last write completed through this module, and
+    after the previous crud call of the current request, so callers never see older data than they already saw.
+    Parameters:
+        fn (Callable): The read. It must not have side effects, and its callers must not modify its result.
+        *args, **kwargs: The arguments of the read.
+    Returns:
+        Any: The result of the read.
+    Raises:
+        Overloaded: If too many operations are pending already.
+    """
+    global _started
+    key = _key(fn, args, kwargs)
+    if key is None:
+        return await run(fn, *args, **kwargs)
+    key = asyncio.get_running_loop(), key
+    scope = _scope.get()
+    flight = _in_flight.get(key)
+    if flight is None or flight.writes != _writes or (scope is not None and flight.number < scope.horizon):
+        _started += 1
+        flight = _Flight(_started, _writes, asyncio.ensure_future(run(fn, *args, **kwargs)))
+        _in_flight[key] = flight
+        flight.future.add_done_callback(lambda _: _settle(key, flight))
+    # A caller going away does not cancel the read the others are waiting for.
+    return await asyncio.shield(flight.future)
+
+
+def _offload(fn: Callable) -> Callable:
+    # The async variant of a crud function, with the same name and docstring.
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await run(fn, *args, **kwargs)
+        finally:
+            _observed()
+    return wrapper
+
+
+def _coalesced(fn: Callable) -> Callable:
+    # The async variant of a crud read whose identical concurrent calls share one run.
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await single_flight(fn, *args, **kwargs)
+        finally:
+            _observed()
+    return wrapper
+
+
+def _memoized(fn: Callable) -> Callable:
+    # The async variant of a crud read whose identical concurrent calls share one run,
+    # and whose result is reused by the rest of the request until the request writes.
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        scope = _scope.get()
+        key = _key(fn, args, kwargs) if scope is not None else None
+        if key is not None and key in scope.results:
+            return scope.results[key]
+        try:
+            result = await single_flight(fn, *args, **kwargs)
+        finally:
+            _observed()
+        if key is not None:
+            scope.results[key] = result
+        return result
+    return wrapper
+
+
+def _mutation(fn: Callable) -> Callable:
+    # The async variant of a crud write. Reads started before it completed are no longer joined,
+    # and the results memoized by the request are dropped, whether the write succeeded or not.
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        global _writes
+        try:
+            return await run(fn, *args, **kwargs)
+        finally:
+            _writes += 1
+            scope = _scope.get()
+            if scope is not None:
+                scope.results.clear()
+            _observed()
+    return wrapper
+
+
+class RequestScope:
+    """
+    ASGI middleware giving every HTTP request its own scope of crud calls, in which a read
+    made twice, such as the lookup of a product, runs once until the request writes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _scope.set(_Scope())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _scope.reset(token)
+
+
+# Versions are read again to tell whether the catalog changed meanwhile, the change feed is polled
+# in a loop and iterators are consumed by their caller, so none of them is memoized.
+warm_up = _offload(crud.warm_up)
+catalog_version = _coalesced(crud.catalog_version)
+product_version = _coalesced(crud.product_version)
+last_change = _offload(crud.last_change)
+read_changes = _offload(crud.read_changes)
+write_product = _mutation(crud.write_product)
+write_products = _mutation(crud.write_products)
+write_unique_products = _mutation(crud.write_unique_products)
+find_duplicate = _memoized(crud.find_duplicate)
+search_products = _memoized(crud.search_products)
+get_product_by_id = _memoized(crud.get_product_by_id)
+read_products = _memoized(crud.read_products)
+iter_products = _offload(crud.iter_products)
+delete_product = _mutation(crud.delete_product)
+delete_products = _mutation(crud.delete_products)
+truncate_db = _mutation(crud.truncate_db)
+uptodate_product = _mutation(crud.uptodate_product)
+uptodate_products = _mutation(crud.uptodate_products)
+sort_products_by_price = _memoized(crud.sort_products_by_price)
+iter_products_by_price = _offload(crud.iter_products_by_price)
+read_products_page = _memoized(crud.read_products_page)
+sort_products_page = _memoized(crud.sort_products_page)
+range_products_by_price = _memoized(crud.range_products_by_price)
+top_products_by_price = _memoized(crud.top_products_by_price)
+price_histogram = _memoized(crud.price_histogram)
+catalog_stats = _memoized(crud.catalog_stats)
+verify_catalog_stats = _offload(crud.verify_catalog_stats)
+create_snapshot = _offload(crud.create_snapshot)
+list_snapshots = _offload(crud.list_snapshots)
+restore_snapshot = _mutation(crud.restore_snapshot)
+delete_snapshot = _offload(crud.delete_snapshot)
+read_rows = _memoized(crud.read_rows)
+iter_rows = _offload(crud.iter_rows)
+iter_rows_by_price = _offload(crud.iter_rows_by_price)
+sort_rows_by_price = _memoized(crud.sort_rows_by_price)
+read_rows_page = _memoized(crud.read_rows_page)
+sort_rows_page = _memoized(crud.sort_rows_page)
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+from bisect import bisect_right
+from typing import List, Tuple
+from src import metrics
+
+# A change event: its sequence number and its JSON encoding.
+Change = Tuple[int, bytes]
+
+
+class ChangeFeed:
+    """
+    The log of the changes made to the catalog, appended to a file next to the store so that
+    every process serving the store publishes into, and reads from, the same sequence.
+
+    Each change is one JSON line, {"seq": ..., "op": "add" | "update" | "delete" | "truncate" | "restore", ...},
+    with sequence numbers increasing by one. Changes are published by the writer while it holds
+    the store's write lock, so sequence numbers are handed out once across processes. Only the
+    last `retain` changes are kept: once twice as many have accumulated, the older half is dropped.
+    """
+
+    def __init__(self, path: str, retain: int):
+        self.path = path
+        self.retain = retain
+        self._lock = threading.Lock()
+        # The lines of the file read so far, and where the next ones start.
+        self._inode = None
+        self._offset = 0
+        self._seqs: List[int] = []
+        self._lines: List[bytes] = []
+
+    def _refresh(self) -> None:
+        # Read the lines appended since the last call. Called with the lock held.
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._inode, self._offset, self._seqs, self._lines = None, 0, [], []
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # The log was trimmed, or replaced: read it again from the start.
+            self._inode, self._offset, self._seqs, self._lines = stat.st_ino, 0, [], []
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        metrics.BYTES_READ.inc(len(data))
+        # A line without its newline is still being appended and is picked up next time.
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for line in complete.splitlines():
+            self._seqs.append(json.loads(line)["seq"])
+            self._lines.append(line)
+
+    def last_seq(self) -> int:
+        """
+        Return the sequence number of the last change.
+        Parameters:
+            Nothing
+        Returns:
+            int: The sequence number, 0 if nothing was published yet.
+        """
+        with self._lock:
+            self._refresh()
+            return self._seqs[-1] if self._seqs else 0
+
+    def read(self, after: int, limit: int) -> Tuple[List[Change], int]:
+        """
+        Return the changes following a sequence number.
+        Parameters:
+            after (int): The sequence number of the last change the reader has seen.
+            limit (int): The maximum number of changes to return.
+        Returns:
+            Tuple[List[Change], int]: The changes, oldest first, and the sequence number of the oldest
+                change still kept. Changes were lost for the reader if `after` is lower than it minus one.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._seqs:
+                return [], 1
+            start = bisect_right(self._seqs, after)
+            changes = list(zip(self._seqs[start:start + limit], self._lines[start:start + limit]))
+            return changes, self._seqs[0]
+
+    def publish(self, events: List[dict]) -> None:
+        """
+        Append changes to the log, numbering them after the last one. The caller holds the store's write lock.
+        Parameters:
+            events (List[dict]): The changes, without their sequence numbers.
+        Returns:
+            Nothing
+        """
+        if not events:
+            return
+        with self._lock:
+            self._refresh()
+            seq = self._seqs[-1] if self._seqs else 0
+            data = b"".join(json.dumps({"seq": seq + i, **event}, ensure_ascii=False, separators=(",", ":"))
+                            .encode("utf-8") + b"\n" for i, event in enumerate(events, 1))
+            with metrics.stage("write_file"), open(self.path, "ab") as f:
+                f.write(data)
+            metrics.BYTES_WRITTEN.inc(len(data))
+            self._refresh()
+            if len(self._lines) > 2 * self.retain:
+                kept = b"".join(line + b"\n" for line in self._lines[-self.retain:])
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with metrics.stage("write_file"), open(tmp_path, "wb") as f:
+                    f.write(kept)
+                metrics.BYTES_WRITTEN.inc(len(kept))
+                os.replace(tmp_path, self.path)
+                self._refresh()
@@ -1,26 +1,82 @@
 import os
-from bs4 import BeautifulSoup
 
 # Path to the HTML file to be used as a database
 DB_PATH = "./index.html"
 
+# Storage engine holding the catalog: "html" (the table in DB_PATH), "html-journal"
+# (DB_PATH plus an append-only journal of changes), "html-sharded" (DB_SHARDS tables
+# next to DB_PATH) or "sqlite" (SQLITE_PATH)
+DB_BACKEND = os.environ.get("EMPERIA_DB_BACKEND", "html")
+
+# Number of table files the "html-sharded" backend splits a new catalog into
+DB_SHARDS = int(os.environ.get("EMPERIA_DB_SHARDS", "4"))
+
+# Threads the "html-sharded" backend reads and writes its shards in, so that they are loaded in parallel
+# whatever PARSE_EXECUTOR is (with "process", full and sorted reads run in the parsing pool instead)
+SHARD_WORKERS = int(os.environ.get("EMPERIA_SHARD_WORKERS", str(DB_SHARDS)))
+
+# Path to the SQLite database used by the "sqlite" backend
+SQLITE_PATH = os.environ.get("EMPERIA_SQLITE_PATH", "./catalog.db")
+
+# Number of journal entries after which the "html-journal" backend folds the journal into DB_PATH
+JOURNAL_COMPACT_THRESHOLD = int(os.environ.get("EMPERIA_JOURNAL_COMPACT_THRESHOLD", "1000"))
+
+# Seconds the writer waits for more mutations to commit together after the first one of a group
+WRITE_BATCH_WINDOW = float(os.environ.get("EMPERIA_WRITE_BATCH_WINDOW", "0.001"))
+
+# Threads running crud operations for the async API
+CRUD_WORKERS = int(os.environ.get("EMPERIA_CRUD_WORKERS", "8"))
+
+# Crud operations allowed to run or wait for a thread before the API answers 503
+CRUD_MAX_PENDING = int(os.environ.get("EMPERIA_CRUD_MAX_PENDING", "256"))
+
+# Where HTML database files are parsed: "thread" (the calling thread) or "process" (a process pool)
+PARSE_EXECUTOR = os.environ.get("EMPERIA_PARSE_EXECUTOR", "thread")
+
+# Processes in the parsing pool when PARSE_EXECUTOR is "process"
+PARSE_WORKERS = int(os.environ.get("EMPERIA_PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+# Whether the "html" backends keep a binary columnar copy of DB_PATH next to it (DB_PATH + ".cols"),
+# rebuilt whenever DB_PATH changes, so that loads and ID lookups skip the HTML parser ("0" to disable)
+COLUMNAR_SNAPSHOT = os.environ.get("EMPERIA_COLUMNAR_SNAPSHOT", "1") == "1"
+
+# Share of DB_PATH that may be padding, left by in-place deletes and updates, before the file is compacted
+HTML_PADDING_RATIO = float(os.environ.get("EMPERIA_HTML_PADDING_RATIO", "0.5"))
+
+# Serialized API responses kept for clients polling an unchanged catalog
+RESPONSE_CACHE_SIZE = int(os.environ.get("EMPERIA_RESPONSE_CACHE_SIZE", "128"))
+
+# Changes kept by the change feed served at /product/changes (up to twice as many before the oldest are dropped)
+CHANGE_FEED_RETAIN = int(os.environ.get("EMPERIA_CHANGE_FEED_RETAIN", "10000"))
+
+# Seconds between two checks of the change feed while a client waits for changes
+CHANGE_FEED_POLL = float(os.environ.get("EMPERIA_CHANGE_FEED_POLL", "0.1"))
+
+# Ascending price edges of the buckets counted by /product/stats: below the first edge, between
+# consecutive edges, and from the last edge up
+STATS_PRICE_EDGES = [float(edge) for edge in os.environ.get("EMPERIA_STATS_PRICE_EDGES",
+                                                             "10,25,50,100,250,500,1000").split(",")]
+
+# Whether each server process loads the catalog and builds its indexes in the background as soon as it starts,
+# reporting ready at /ready once done; check_db then leaves the columnar copy to it ("0" to load on first use)
+WARMUP = os.environ.get("EMPERIA_WARMUP", "1") == "1"
+
+# Whether timings and counters are recorded and exposed at /metrics ("1" to enable)
+METRICS = os.environ.get("EMPERIA_METRICS", "0") == "1"
+
+# Address the API is served on by run.py
+HOST = os.environ.get("EMPERIA_HOST", "localhost")
+PORT = int(os.environ.get("EMPERIA_PORT", "8000"))
+
+# Server processes started by run.py, each with its own catalog cache kept coherent through the change signal
+WORKERS = int(os.environ.get("EMPERIA_WORKERS", "1"))
+
+
+# Function to check if the database exists and create it if it does not
+def check_db(backend: str = None) -> None:
+    from src.storage import create_backend
+    create_backend(backend or DB_BACKEND).check()
 
-# Function to check if the database file exists and create it if it does not
-def check_db() -> None:
-    # Check if the database file exists
-    if os.path.exists(DB_PATH):
-        print(f"db '{DB_PATH}' already exists")
-        with open(DB_PATH, "r") as f:
-            content = f.read()
-        if BeautifulSoup(content, "html.parser").find("table") == None:
-            # If the file does not contain a table element, add one to the file
-            with open(DB_PATH, "w") as f:
-                f.write("<table><tr><th>ID</th><th>Name</th><th>Description</th><th>Price</th></tr></table>")
-    else:
-        # If the file does not exist, create it and add a table element to it
-        with open(DB_PATH, "w") as f:
-            f.write("<table><tr><th>ID</th><th>Name</th><th>Description</th><th>Price</th></tr></table>")
-        print(f"db '{DB_PATH}' created")
 
 if __name__ == '__main__':
-    check_db()
\ No newline at end of file
+    check_db()
@@ -1,9 +1,142 @@
-from typing import List
-from bs4 import BeautifulSoup
-from src.schemas import Product
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+from src import config, metrics
+from src.changes import Change, ChangeFeed
+from src.rows import ProductRow
+from src.schemas import CatalogStats, PriceBucket, Product, ProductUpdate, SnapshotInfo
 from src.config import DB_PATH
+from src.storage import CachedBackend, StorageBackend, create_backend
+from src.storage.html_table import read_html, write_html
+from src.storage.snapshots import SnapshotStore
+from src.write_queue import WriteQueue
 
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
 
+# The storage backend all functions below forward to, created on first use.
+_backend = None
+
+# The single writer all mutations go through, created with the backend.
+_write_queue = None
+
+# The log of the changes committed by the writer, next to the store.
+_change_feed = None
+
+# The snapshots of the catalog, in a directory next to the store.
+_snapshots = None
+
+
+def get_backend() -> StorageBackend:
+    """
+    Return the storage backend selected by config.DB_BACKEND, wrapped in the in-process cache.
+    Parameters:
+        Nothing
+    Returns:
+        StorageBackend: The active storage backend.
+    """
+    global _backend
+    if _backend is None:
+        set_backend(create_backend(config.DB_BACKEND))
+    return _backend
+
+
+def set_backend(backend: StorageBackend) -> None:
+    """
+    Replace the active storage backend.
+    Parameters:
+        backend (StorageBackend): The backend to use from now on. It is wrapped in the in-process cache.
+    Returns:
+        Nothing
+    """
+    global _backend, _write_queue, _change_feed, _snapshots
+    if _write_queue is not None:
+        _write_queue.close()
+    _backend = backend if isinstance(backend, CachedBackend) else CachedBackend(backend)
+    _change_feed = ChangeFeed(_backend.path + ".changes", config.CHANGE_FEED_RETAIN)
+    _snapshots = SnapshotStore(_backend.path + ".snapshots")
+    _write_queue = WriteQueue(_backend, config.WRITE_BATCH_WINDOW, _change_feed)
+
+
+@metrics.timed
+def warm_up() -> int:
+    """
+    Load the catalog and build its indexes ahead of the first request, so that it does not wait for them.
+    Parameters:
+        Nothing
+    Returns:
+        int: The number of products loaded.
+    """
+    return len(get_backend().load_catalog())
+
+
+def _mutate(kind: str, items: list = None):
+    """
+    Run a mutation through the single writer and wait for it to be committed.
+    Parameters:
+        kind (str): "add", "add_unique", "update", "delete" or "truncate".
+        items (list, optional): The products, updates or IDs of the mutation.
+    Returns:
+        The backend's results for the mutation.
+    """
+    if kind != "truncate" and not items:
+        return []
+    get_backend()
+    return _write_queue.submit(kind, items).result()
+
+
+@metrics.timed
+def catalog_version() -> Tuple[str, float]:
+    """
+    Return the version of the catalog, which changes with every write.
+    Parameters:
+        Nothing
+    Returns:
+        Tuple[str, float]: The version tag and the time of the last change.
+    """
+    return get_backend().catalog_version()
+
+
+@metrics.timed
+def product_version(id: int) -> Optional[Tuple[str, float]]:
+    """
+    Return the version of a product, which changes with every write to it.
+    Parameters:
+        id (int): The ID of the product.
+    Returns:
+        Tuple[str, float]: The version tag and the time of the last change, or None if there is no such product.
+    """
+    return get_backend().product_version(id)
+
+
+@metrics.timed
+def last_change() -> int:
+    """
+    Return the sequence number of the last change published to the change feed.
+    Parameters:
+        Nothing
+    Returns:
+        int: The sequence number, 0 if there was no change yet.
+    """
+    get_backend()
+    return _change_feed.last_seq()
+
+
+@metrics.timed
+def read_changes(after: int, limit: int = 100) -> Tuple[List[Change], int]:
+    """
+    Return the changes published to the change feed after a sequence number.
+    Parameters:
+        after (int): The sequence number of the last change the caller has seen.
+        limit (int, optional): The maximum number of changes to return.
+    Returns:
+        Tuple[List[Change], int]: The (sequence number, JSON event) of the changes, oldest first, and the
+            sequence number of the oldest change still kept. Changes were lost to the caller if `after`
+            is lower than it minus one.
+    """
+    get_backend()
+    return _change_feed.read(after, limit)
+
+
+@metrics.timed
 def read_html_db() -> str:
     """
     Read the HTML content of the database file.
@@ -12,12 +145,11 @@ def read_html_db() -> str:
     Returns:
         str: The HTML content of the database file.
     """
-    with open(DB_PATH, "r") as f:
-        content = f.read()
-    return content
+    return read_html(DB_PATH)
 
 
-def write_html_db(soup: BeautifulSoup) -> None:
+@metrics.timed
+def write_html_db(soup: "BeautifulSoup") -> None:
     """
     Write the BeautifulSoup object to the database file.
     Parameters:
@@ -25,10 +157,10 @@ def write_html_db(soup: BeautifulSoup) -> None:
     Returns:
         Nothing
     """
-    with open(DB_PATH, "w") as f:
-        f.write(str(soup))
+    write_html(DB_PATH, soup)
 
 
+@metrics.timed
 def generate_id(products: List[Product]) -> int:
     """
     Generate a unique ID for a new product.
@@ -44,27 +176,70 @@ def generate_id(products: List[Product]) -> int:
         return 1
 
 
-def write_product(product: Product) -> None:
+@metrics.timed
+def write_product(product: Product) -> int:
     """
     Add a new product to the database.
     Parameters:
         product (Product): The product to add to the database.
     Returns:
-        Nothing
+        int: The ID given to the new product.
+    """
+    return _mutate("add", [product])[0]
+
+
+@metrics.timed
+def write_products(products: List[Product]) -> List[int]:
+    """
+    Add several new products to the database in a single write.
+    Parameters:
+        products (List[Product]): The products to add to the database.
+    Returns:
+        List[int]: The IDs given to the new products, in the same order.
+    """
+    return _mutate("add", products)
+
+
+@metrics.timed
+def write_unique_products(products: List[Product]) -> List[Optional[int]]:
+    """
+    Add the products that are not duplicates, in a single write. A product is a duplicate when a product
+    with the same name, description and price is in the database or earlier in the list.
+    The check and the write are made together by the writer, so concurrent identical requests add one product.
+    Parameters:
+        products (List[Product]): The products to add to the database.
+    Returns:
+        List[Optional[int]]: For each product, the ID it was given, or None if it was a duplicate.
+    """
+    return _mutate("add_unique", products)
+
+
+@metrics.timed
+def search_products(query: str, limit: int = 20) -> List[Product]:
+    """
+    Search the names and descriptions of the products in the database.
+    Parameters:
+        query (str): The words to look for. Each word also matches the words it is a prefix of.
+        limit (int, optional): The maximum number of results.
+    Returns:
+        List[Product]: The products matching every word of the query, best matches first.
     """
-    content = read_html_db()
-    soup = BeautifulSoup(content, "html.parser")
-    table = soup.find("table")
-    row_data = [generate_id(read_products()), product.name, product.description, product.price]
-    new_row = soup.new_tag("tr")
-    for data in row_data:
-        cell = soup.new_tag("td")
-        cell.string = str(data)
-        new_row.append(cell)
-    table.append(new_row)
-    write_html_db(soup)
+    return get_backend().search_products(query, limit)
 
 
+@metrics.timed
+def find_duplicate(product: Product) -> Optional[Product]:
+    """
+    Find a product in the database with the same name, description and price as the given one.
+    Parameters:
+        product (Product): The product to look for. Its ID is ignored.
+    Returns:
+        Product: The existing product, or None if there is none.
+    """
+    return get_backend().find_duplicate(product)
+
+
+@metrics.timed
 def get_product_by_id(id: int) -> Product:
     """
     Retrieve a product from the database by ID.
@@ -73,22 +248,10 @@ def get_product_by_id(id: int) -> Product:
     Returns:
         Product: The product with the given ID, or None if not found.
     """
-    content = read_html_db()
-    soup = BeautifulSoup(content, "html.parser")
-    table = soup.find("table")
-    rows = table.find_all("tr")
-    for row in rows:
-        cells = row.find_all("td")
-        if len(cells) > 0 and int(cells[0].text) == int(id):
-            return Product(
-                id=int(cells[0].text),
-                name=cells[1].text,
-                description=cells[2].text,
-                price=float(cells[3].text)
-            )
-    return None
+    return get_backend().get_product_by_id(id)
 
 
+@metrics.timed
 def read_products() -> List[Product]:
     """
     Retrieve all products from the database.
@@ -97,21 +260,22 @@ def read_products() -> List[Product]:
     Returns:
         List[Product]: The list of all products in the database.
     """
-    content = read_html_db()
-    soup = BeautifulSoup(content, "html.parser")
-    table = soup.find("table")
-    products = []
-    for row in table.find_all("tr")[1:]:
-        cells = row.find_all("td")
-        products.append(Product(
-            id=int(cells[0].text),
-            name=cells[1].text,
-            description=cells[2].text,
-            price=float(cells[3].text)
-        ))
-    return products
+    return get_backend().read_products()
+
+
+@metrics.timed
+def iter_products() -> Iterator[Product]:
+    """
+    Iterate over all products in the database without loading the whole catalog.
+    Parameters:
+        Nothing
+    Returns:
+        Iterator[Product]: The products in the database.
+    """
+    return get_backend().iter_products()
 
 
+@metrics.timed
 def delete_product(id: int) -> None:
     """
     Delete a product from the database by ID.
@@ -119,31 +283,34 @@ def delete_product(id: int) -> None:
         id (int): The ID of the product to delete.
     Returns:
     """
-    content = read_html_db()
-    soup = BeautifulSoup(content, "html.parser")
-    table = soup.find("table")
-    for row in table.find_all("tr"):
-        cells = row.find_all("td")
-        if len(cells) > 0 and int(cells[0].text) == int(id):
-            row.decompose()
-            break
-    write_html_db(soup)
-    print("Product deleted successfully!")
+    if _mutate("delete", [int(id)])[0]:
+        print("Product deleted successfully!")
+
+
+@metrics.timed
+def delete_products(ids: List[int]) -> List[bool]:
+    """
+    Delete several products from the database in a single write.
+    Parameters:
+        ids (List[int]): The IDs of the products to delete.
+    Returns:
+        List[bool]: For each ID, True if the product was found and deleted.
+    """
+    return _mutate("delete", ids)
 
 
+@metrics.timed
 def truncate_db() -> None:
     """
-    Delete all products from the database by ID.
+    Delete all products from the database in a single write.
     Parameters:
     Returns:
     """
-    products_ids = [p.id for p in read_products()]
-    if products_ids:
-        for product_id in products_ids:
-            delete_product(product_id)
+    if _mutate("truncate"):
         print("Product deleted successfully!")
 
 
+@metrics.timed
 def uptodate_product(id: int, name: str = None, description: str = None, price: float = None) -> None:
     """
     Update an existing product in the database with new information.
@@ -155,30 +322,317 @@ def uptodate_product(id: int, name: str = None, description: str = None, price:
     Returns:
         None
     """
-    content = read_html_db()
-    soup = BeautifulSoup(content, "html.parser")
-    table = soup.find("table")
-    for row in table.find_all("tr"):
-        cells = row.find_all("td")
-        if len(cells) > 0 and int(cells[0].text) == int(id):
-            if name:
-                row.find_all("td")[1].string = name
-            if description:
-                row.find_all("td")[2].string = description
-            if price:
-                row.find_all("td")[3].string = str(price)
-            write_html_db(soup)
-            print("Product updated successfully!")
+    if _mutate("update", [ProductUpdate(id=id, name=name, description=description, price=price)])[0]:
+        print("Product updated successfully!")
+
+
+@metrics.timed
+def uptodate_products(updates: List[ProductUpdate]) -> List[bool]:
+    """
+    Update several existing products in the database in a single write.
+    Parameters:
+        updates (List[ProductUpdate]): The updates to apply. Fields left as None are not changed.
+    Returns:
+        List[bool]: For each update, True if the product was found and updated.
+    """
+    return _mutate("update", updates)
+
+
+@metrics.timed
+def sort_products_by_price(descending: bool = True) -> List[Product]:
+    """
+    Sort the products in the database by price, in descending order by default.
+    Parameters:
+        descending (bool, optional): Whether to list the most expensive products first.
+    Returns:
+        List[Product]: A list of products sorted by price.
+    """
+    return get_backend().sort_products_by_price(descending)
+
+
+@metrics.timed
+def iter_products_by_price(descending: bool = True) -> Iterator[Product]:
+    """
+    Iterate over the products in the database sorted by price, in descending order by default.
+    Parameters:
+        descending (bool, optional): Whether to list the most expensive products first.
+    Returns:
+        Iterator[Product]: The products sorted by price.
+    """
+    return get_backend().iter_products_by_price(descending)
+
+
+@metrics.timed
+def read_products_page(limit: int, after: int = None) -> Tuple[List[Product], Optional[int]]:
+    """
+    Retrieve one page of products in ID order.
+    Parameters:
+        limit (int): The maximum number of products to return.
+        after (int, optional): The cursor returned with the previous page.
+    Returns:
+        Tuple[List[Product], Optional[int]]: The products of the page and the cursor of the next page,
+        which is None when this is the last page.
+    """
+    products = get_backend().read_products_page(limit, after)
+    next_cursor = products[-1].id if len(products) == limit else None
+    return products, next_cursor
+
+
+@metrics.timed
+def read_rows() -> List[ProductRow]:
+    """
+    Retrieve all products as compact rows, without building Product models.
+    Parameters:
+        Nothing
+    Returns:
+        List[ProductRow]: The rows of all products, in ID order.
+    """
+    return get_backend().read_rows()
+
+
+@metrics.timed
+def iter_rows() -> Iterator[ProductRow]:
+    """
+    Iterate over all products as compact rows, without loading a cold catalog.
+    Parameters:
+        Nothing
+    Returns:
+        Iterator[ProductRow]: The rows of all products, in ID order.
+    """
+    return get_backend().iter_rows()
+
+
+@metrics.timed
+def iter_rows_by_price(descending: bool = True) -> Iterator[ProductRow]:
+    """
+    Iterate over all products sorted by price as compact rows, without loading a cold catalog.
+    Parameters:
+        descending (bool, optional): Whether to list the most expensive products first.
+    Returns:
+        Iterator[ProductRow]: The rows, with ties in ascending ID order.
+    """
+    return get_backend().iter_rows_by_price(descending)
+
+
+@metrics.timed
+def sort_rows_by_price(descending: bool = True) -> List[ProductRow]:
+    """
+    Retrieve all products sorted by price as compact rows, without building Product models.
+    Parameters:
+        descending (bool, optional): Whether to list the most expensive products first.
+    Returns:
+        List[ProductRow]: The rows, with ties in ascending ID order.
+    """
+    return get_backend().sort_rows_by_price(descending)
+
+
+@metrics.timed
+def read_rows_page(limit: int, after: int = None) -> Tuple[List[ProductRow], Optional[int]]:
+    """
+    Retrieve one page of products in ID order as compact rows.
+    Parameters:
+        limit (int): The maximum number of rows to return.
+        after (int, optional): The cursor returned with the previous page.
+    Returns:
+        Tuple[List[ProductRow], Optional[int]]: The rows of the page and the cursor of the next page,
+        which is None when this is the last page.
+    """
+    rows = get_backend().read_rows_page(limit, after)
+    return rows, rows[-1].id if len(rows) == limit else None
+
+
+@metrics.timed
+def sort_rows_page(limit: int, after: Tuple[float, int] = None,
+                   descending: bool = True) -> Tuple[List[ProductRow], Optional[Tuple[float, int]]]:
+    """
+    Retrieve one page of products sorted by price as compact rows.
+    Parameters:
+        limit (int): The maximum number of rows to return.
+        after (Tuple[float, int], optional): The cursor returned with the previous page.
+        descending (bool, optional): Whether to list the most expensive products first.
+    Returns:
+        Tuple[List[ProductRow], Optional[Tuple[float, int]]]: The rows of the page and the cursor of the
+        next page, which is None when this is the last page.
+    """
+    rows = get_backend().sort_rows_page(limit, after, descending)
+    return rows, (rows[-1].price, rows[-1].id) if len(rows) == limit else None
+
+
+@metrics.timed
+def sort_products_page(limit: int, after: Tuple[float, int] = None,
+                       descending: bool = True) -> Tuple[List[Product], Optional[Tuple[float, int]]]:
+    """
+    Retrieve one page of products sorted by price.
+    Parameters:
+        limit (int): The maximum number of products to return.
+        after (Tuple[float, int], optional): The cursor returned with the previous page.
+        descending (bool, optional): Whether to list the most expensive products first.
+    Returns:
+        Tuple[List[Product], Optional[Tuple[float, int]]]: The products of the page and the cursor of the
+        next page, which is None when this is the last page.
+    """
+    products = get_backend().sort_products_page(limit, after, descending)
+    next_cursor = (products[-1].price, products[-1].id) if len(products) == limit else None
+    return products, next_cursor
+
+
+@metrics.timed
+def range_products_by_price(low: float, high: float, limit: int,
+                            after: Tuple[float, int] = None) -> Tuple[List[Product], Optional[Tuple[float, int]]]:
+    """
+    Retrieve one page of the products priced between two bounds, cheapest first.
+    Parameters:
+        low (float): The lowest price, included.
+        high (float): The highest price, included.
+        limit (int): The maximum number of products to return.
+        after (Tuple[float, int], optional): The cursor returned with the previous page.
+    Returns:
+        Tuple[List[Product], Optional[Tuple[float, int]]]: The products of the page and the cursor of the
+        next page, which is None when this is the last page.
+    """
+    products = get_backend().range_products_by_price(low, high, limit, after)
+    next_cursor = (products[-1].price, products[-1].id) if len(products) == limit else None
+    return products, next_cursor
+
+
+@metrics.timed
+def top_products_by_price(k: int, descending: bool = True) -> List[Product]:
+    """
+    Retrieve the most expensive or the cheapest products.
+    Parameters:
+        k (int): The number of products to return.
+        descending (bool, optional): Whether to return the most expensive products rather than the cheapest.
+    Returns:
+        List[Product]: The k products, in price order.
+    """
+    return get_backend().sort_products_page(k, None, descending)
+
+
+@metrics.timed
+def price_histogram(buckets: int = 10, edges: List[float] = None) -> List[PriceBucket]:
+    """
+    Count the products per price bucket.
+    Parameters:
+        buckets (int, optional): The number of buckets of equal width between the lowest and highest price.
+        edges (List[float], optional): The ascending bucket edges, used instead of buckets when given.
+    Returns:
+        List[PriceBucket]: The buckets, cheapest first. Empty if the catalog is empty.
+    """
+    backend = get_backend()
+    if edges is None:
+        bounds = backend.price_bounds()
+        if bounds is None:
+            return []
+        low, high = bounds
+        width = (high - low) / buckets
+        edges = [low + i * width for i in range(buckets)] + [high]
+    counts = backend.price_histogram(edges)
+    return [PriceBucket(min=edges[i], max=edges[i + 1], count=count) for i, count in enumerate(counts)]
+
+
+@metrics.timed
+def catalog_stats() -> CatalogStats:
+    """
+    Return the aggregates of the catalog, kept up to date by every write instead of being recomputed.
+    Parameters:
+        Nothing
+    Returns:
+        CatalogStats: The number of products, the lowest, highest, average and total price, and the
+        number of products per bucket of config.STATS_PRICE_EDGES.
+    """
+    return get_backend().catalog_stats()
+
+
+@metrics.timed
+def verify_catalog_stats() -> Tuple[CatalogStats, CatalogStats]:
+    """
+    Recompute the aggregates of the catalog from the store and compare them with the running ones.
+    If they differ, the cached catalog is reloaded on its next use.
+    Parameters:
+        Nothing
+    Returns:
+        Tuple[CatalogStats, CatalogStats]: The running aggregates and the recomputed ones.
+    """
+    return get_backend().verify_stats()
+
+
+@metrics.timed
+def create_snapshot(name: str = None) -> SnapshotInfo:
+    """
+    Save a copy of the catalog as it is now. Writes go on while the copy is written.
+    Parameters:
+        name (str, optional): The name of the snapshot, by default its creation time.
+    Returns:
+        SnapshotInfo: The description of the snapshot.
+    Raises:
+        ValueError: If the name is not valid.
+        FileExistsError: If a snapshot already has this name.
+    """
+    # The cached catalog is copied at once under the cache lock, so the snapshot is consistent.
+    return _snapshot_store().create(get_backend().read_rows(), name)
+
+
+@metrics.timed
+def list_snapshots() -> List[SnapshotInfo]:
+    """
+    List the snapshots of the catalog.
+    Parameters:
+        Nothing
+    Returns:
+        List[SnapshotInfo]: The descriptions of the snapshots, oldest first.
+    """
+    return _snapshot_store().list()
+
+
+@metrics.timed
+def restore_snapshot(name: str) -> Optional[SnapshotInfo]:
+    """
+    Replace the catalog with a snapshot. The restored catalog is written next to the store first,
+    then renamed over it while writes are held back, so readers see either catalog, never a mix.
+    A "restore" event is published to the change feed.
+    Parameters:
+        name (str): The name of the snapshot.
+    Returns:
+        SnapshotInfo: The description of the restored snapshot, or None if there is no such snapshot.
+    Raises:
+        ValueError: If the name is not valid.
+    """
+    snapshots, backend = _snapshot_store(), get_backend()
+    info, rows = snapshots.get(name), snapshots.load(name)
+    if info is None or rows is None:
+        return None
+    staged = backend.stage_catalog(rows)
+    try:
+        with backend.lock():
+            backend.commit_catalog(staged)
+            _change_feed.publish([{"op": "restore", "snapshot": name, "count": len(rows)}])
+    except BaseException:
+        backend.discard_catalog(staged)
+        raise
+    return info
+
+
+@metrics.timed
+def delete_snapshot(name: str) -> bool:
+    """
+    Delete a snapshot of the catalog.
+    Parameters:
+        name (str): The name of the snapshot.
+    Returns:
+        bool: True if the snapshot existed.
+    Raises:
+        ValueError: If the name is not valid.
+    """
+    return _snapshot_store().delete(name)
 
 
-def sort_products_by_price():
+def _snapshot_store() -> SnapshotStore:
     """
-    Sort the products in the database by price, in descending order.
+    Return the snapshots of the active backend's store, creating the backend first if needed.
     Parameters:
         Nothing
     Returns:
-        List[Product]: A list of products sorted by price, in descending order.
+        SnapshotStore: The snapshots, in a directory next to the store.
     """
-    products = read_products()
-    products.sort(key=lambda product: product.price, reverse=True)
-    return products
+    get_backend()
+    return _snapshots
@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from src import config
+
+_lock = threading.Lock()
+_crud_executor = None
+_shard_executor = None
+_parse_pool = None
+
+
+def get_crud_executor() -> ThreadPoolExecutor:
+    """
+    Return the thread pool the async API runs crud operations in, sized by config.CRUD_WORKERS.
+    Parameters:
+        Nothing
+    Returns:
+        ThreadPoolExecutor: The crud thread pool.
+    """
+    global _crud_executor
+    with _lock:
+        if _crud_executor is None:
+            _crud_executor = ThreadPoolExecutor(max_workers=config.CRUD_WORKERS, thread_name_prefix="crud")
+        return _crud_executor
+
+
+def get_shard_executor() -> ThreadPoolExecutor:
+    """
+    Return the thread pool the sharded backend reads and writes its shards in, sized by config.SHARD_WORKERS.
+    Parameters:
+        Nothing
+    Returns:
+        ThreadPoolExecutor: The shard thread pool.
+    """
+    global _shard_executor
+    with _lock:
+        if _shard_executor is None:
+            _shard_executor = ThreadPoolExecutor(max_workers=config.SHARD_WORKERS, thread_name_prefix="shard")
+        return _shard_executor
+
+
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Return the process pool HTML database files are parsed in, if config.PARSE_EXECUTOR is "process".
+    Parameters:
+        Nothing
+    Returns:
+        ProcessPoolExecutor: The parsing pool, or None to parse in the calling thread.
+    """
+    global _parse_pool
+    if config.PARSE_EXECUTOR != "process":
+        return None
+    with _lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=config.PARSE_WORKERS)
+        return _parse_pool
+
+
+def shutdown() -> None:
+    """
+    Shut the pools down, waiting for running operations to finish.
+    Parameters:
+        Nothing
+    Returns:
+        Nothing
+    """
+    global _crud_executor, _shard_executor, _parse_pool
+    with _lock:
+        for pool in (_crud_executor, _shard_executor, _parse_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        _crud_executor = _shard_executor = _parse_pool = None
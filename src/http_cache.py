@@ -0,0 +1,104 @@
+import json
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Hashable, Mapping, Optional, Tuple
+from fastapi.encoders import jsonable_encoder
+
+
+def render_json(content: Any) -> bytes:
+    """
+    Serialize a response the way FastAPI's JSONResponse does.
+    Parameters:
+        content (Any): The products, models or plain values to serialize.
+    Returns:
+        bytes: The JSON body.
+    """
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def validators(tag: str, modified: float) -> Dict[str, str]:
+    """
+    Build the ETag and Last-Modified headers of a version.
+    Parameters:
+        tag (str): The version tag.
+        modified (float): The time of the version, in seconds since the epoch.
+    Returns:
+        Dict[str, str]: The headers.
+    """
+    return {"ETag": '"%s"' % tag, "Last-Modified": formatdate(modified, usegmt=True)}
+
+
+def not_modified(headers: Mapping[str, str], tag: str, modified: float) -> bool:
+    """
+    Tell whether the client already holds a version, from the conditional headers of its request.
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+    Parameters:
+        headers (Mapping[str, str]): The request headers.
+        tag (str): The current version tag.
+        modified (float): The time of the current version.
+    Returns:
+        bool: True if the request can be answered with 304 Not Modified.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = '"%s"' % tag
+        # Weak comparison: W/"x" matches "x".
+        candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have a one second resolution.
+        return int(modified) <= since
+    return False
+
+
+class BodyCache:
+    """
+    Keeps the last serialized body of each response, along with the version it was built from,
+    so that polling clients are served without the catalog being read or serialized again.
+    Only the newest version of each response is kept, and the least recently used responses
+    are evicted beyond max_entries.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[str, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, tag: str) -> Optional[Any]:
+        """
+        Return the cached body of a response, if it was built from the given version.
+        Parameters:
+            key (Hashable): The response, usually its path and query string.
+            tag (str): The current version tag.
+        Returns:
+            Any: The cached body, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != tag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, tag: str, body: Any) -> None:
+        """
+        Cache the body of a response, replacing the one built from an older version.
+        Parameters:
+            key (Hashable): The response, usually its path and query string.
+            tag (str): The version the body was built from.
+            body (Any): The body.
+        Returns:
+            Nothing
+        """
+        with self._lock:
+            self._entries[key] = (tag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
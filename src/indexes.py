@@ -0,0 +1,278 @@
+import math
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+from src.schemas import CatalogStats, Product, StatsBucket
+
+
+def content_key(product: Product) -> Hashable:
+    """
+    Return the key two products share when they are duplicates: their name, description and price.
+    Parameters:
+        product (Product): The product.
+    Returns:
+        Hashable: The content key of the product. The ID is not part of it.
+    """
+    return product.name, product.description, product.price
+
+
+class ContentIndex:
+    """The IDs of the catalog by content key, for O(1) duplicate detection."""
+
+    def __init__(self):
+        self.ids: Dict[Hashable, Set[int]] = {}
+
+    def rebuild(self, products: Iterable[Product]) -> None:
+        self.ids = {}
+        for product in products:
+            self.add(product)
+
+    def add(self, product: Product) -> None:
+        self.ids.setdefault(content_key(product), set()).add(product.id)
+
+    def remove(self, product: Product) -> None:
+        key = content_key(product)
+        ids = self.ids.get(key)
+        if ids is not None:
+            ids.discard(product.id)
+            if not ids:
+                del self.ids[key]
+
+    def clear(self) -> None:
+        self.ids.clear()
+
+    def find(self, product: Product) -> Optional[int]:
+        """
+        Find a product with the same content as the given one.
+        Parameters:
+            product (Product): The product to look for. Its ID is ignored.
+        Returns:
+            int: The smallest ID of a product with the same content, or None if there is none.
+        """
+        ids = self.ids.get(content_key(product))
+        return min(ids) if ids else None
+
+
+class IdIndex:
+    """The IDs of the catalog in ascending order, for keyset pagination by ID."""
+
+    def __init__(self):
+        self.ids = array("q")
+
+    def rebuild(self, products: Iterable[Product]) -> None:
+        self.ids = array("q", sorted(p.id for p in products))
+
+    def add(self, product: Product) -> None:
+        insort(self.ids, product.id)
+
+    def remove(self, product: Product) -> None:
+        pos = bisect_left(self.ids, product.id)
+        if pos < len(self.ids) and self.ids[pos] == product.id:
+            del self.ids[pos]
+
+    def clear(self) -> None:
+        del self.ids[:]
+
+    def page(self, limit: int, after: int = None) -> List[int]:
+        """
+        Return up to `limit` IDs greater than `after`.
+        Parameters:
+            limit (int): The maximum number of IDs to return.
+            after (int, optional): The last ID of the previous page.
+        Returns:
+            List[int]: The IDs of the page, in ascending order.
+        """
+        start = 0 if after is None else bisect_right(self.ids, after)
+        return self.ids[start:start + limit].tolist()
+
+
+class PriceIndex:
+    """
+    The catalog ordered by (price, id), kept as two parallel columns.
+    Lookups binary-search the price column, so a page of the sorted view costs
+    O(log n + page size). Products with the same price are always listed by
+    ascending ID, whichever direction the prices are read in.
+    """
+
+    def __init__(self):
+        self.prices = array("d")
+        self.ids = array("q")
+
+    def rebuild(self, products: Iterable[Product]) -> None:
+        pairs = sorted((p.price, p.id) for p in products)
+        self.prices = array("d", (price for price, _ in pairs))
+        self.ids = array("q", (id for _, id in pairs))
+
+    def _position(self, price: float, id: int) -> int:
+        lo = bisect_left(self.prices, price)
+        hi = bisect_right(self.prices, price, lo)
+        return bisect_left(self.ids, id, lo, hi)
+
+    def add(self, product: Product) -> None:
+        pos = self._position(product.price, product.id)
+        self.prices.insert(pos, product.price)
+        self.ids.insert(pos, product.id)
+
+    def remove(self, product: Product) -> None:
+        pos = self._position(product.price, product.id)
+        if pos < len(self.ids) and self.ids[pos] == product.id and self.prices[pos] == product.price:
+            del self.prices[pos]
+            del self.ids[pos]
+
+    def clear(self) -> None:
+        del self.prices[:]
+        del self.ids[:]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def iter_ids(self, after: Tuple[float, int] = None, descending: bool = True) -> Iterator[int]:
+        """
+        Iterate over the IDs in price order, starting after a (price, id) key.
+        Parameters:
+            after (Tuple[float, int], optional): The (price, id) of the last product of the previous page.
+            descending (bool, optional): Whether to read the prices from the highest down.
+        Returns:
+            Iterator[int]: The IDs in price order.
+        """
+        prices, ids = self.prices, self.ids
+        if not descending:
+            start = 0
+            if after is not None:
+                price, id = after
+                lo = bisect_left(prices, price)
+                start = bisect_right(ids, id, lo, bisect_right(prices, price, lo))
+            for pos in range(start, len(ids)):
+                yield ids[pos]
+            return
+        # Descending: walk the groups of equal price from the top, each one in ascending ID order.
+        end = len(ids)
+        if after is not None:
+            price, id = after
+            lo = bisect_left(prices, price)
+            hi = bisect_right(prices, price, lo)
+            for pos in range(bisect_right(ids, id, lo, hi), hi):
+                yield ids[pos]
+            end = lo
+        while end > 0:
+            group = bisect_left(prices, prices[end - 1], 0, end)
+            for pos in range(group, end):
+                yield ids[pos]
+            end = group
+
+    def range_ids(self, low: float, high: float, limit: int, after: Tuple[float, int] = None) -> List[int]:
+        """
+        Return the IDs of the products priced between two bounds, cheapest first.
+        Parameters:
+            low (float): The lowest price, included.
+            high (float): The highest price, included.
+            limit (int): The maximum number of IDs to return.
+            after (Tuple[float, int], optional): The (price, id) of the last product of the previous page.
+        Returns:
+            List[int]: The IDs, in ascending (price, id) order.
+        """
+        start = bisect_left(self.prices, low)
+        if after is not None:
+            price, id = after
+            lo = bisect_left(self.prices, price)
+            start = max(start, bisect_right(self.ids, id, lo, bisect_right(self.prices, price, lo)))
+        end = min(bisect_right(self.prices, high), start + limit)
+        return self.ids[start:end].tolist() if end > start else []
+
+    def histogram(self, edges: List[float]) -> List[int]:
+        """
+        Count the products in consecutive price buckets, with one binary search per edge.
+        Parameters:
+            edges (List[float]): The ascending bucket edges. Bucket i holds prices in [edges[i], edges[i + 1]),
+                the last bucket also holds prices equal to its upper edge.
+        Returns:
+            List[int]: The number of products in each of the len(edges) - 1 buckets.
+        """
+        positions = [bisect_left(self.prices, edge) for edge in edges[:-1]] + [bisect_right(self.prices, edges[-1])]
+        return [positions[i + 1] - positions[i] for i in range(len(edges) - 1)]
+
+    def bounds(self) -> Optional[Tuple[float, float]]:
+        """
+        Return the lowest and highest price of the catalog.
+        Parameters:
+            Nothing
+        Returns:
+            Tuple[float, float]: The lowest and highest price, or None if the catalog is empty.
+        """
+        return (self.prices[0], self.prices[-1]) if self.prices else None
+
+
+class PriceStats:
+    """
+    Running aggregates of the catalog's prices: the number of products, the sum of their prices and
+    the number of products in each of a fixed set of price buckets, updated in O(log buckets) per
+    change. The sum is compensated (Neumaier), so adding and removing prices does not make it drift.
+    """
+
+    def __init__(self, edges: List[float]):
+        self.edges = list(edges)
+        self.count = 0
+        self.total = 0.0
+        self._error = 0.0
+        self.counts = [0] * (len(self.edges) + 1)
+
+    def rebuild(self, products: Iterable[Product]) -> None:
+        self.clear()
+        prices = [p.price for p in products]
+        self.count = len(prices)
+        self.total = math.fsum(prices)
+        for price in prices:
+            self.counts[bisect_right(self.edges, price)] += 1
+
+    def _accumulate(self, value: float) -> None:
+        total = self.total + value
+        if abs(self.total) >= abs(value):
+            self._error += (self.total - total) + value
+        else:
+            self._error += (value - total) + self.total
+        self.total = total
+
+    def add(self, product: Product) -> None:
+        self.count += 1
+        self._accumulate(product.price)
+        self.counts[bisect_right(self.edges, product.price)] += 1
+
+    def remove(self, product: Product) -> None:
+        self.count -= 1
+        self._accumulate(-product.price)
+        self.counts[bisect_right(self.edges, product.price)] -= 1
+
+    def clear(self) -> None:
+        self.count = 0
+        self.total = self._error = 0.0
+        self.counts = [0] * (len(self.edges) + 1)
+
+    def summary(self, bounds: Optional[Tuple[float, float]]) -> CatalogStats:
+        """
+        Return the aggregates.
+        Parameters:
+            bounds (Tuple[float, float]): The lowest and highest price, kept by the price index, or None if the catalog is empty.
+        Returns:
+            CatalogStats: The number of products, the lowest, highest, average and total price, and the buckets.
+        """
+        total = self.total + self._error if self.count else 0.0
+        low, high = bounds if bounds is not None else (None, None)
+        limits = [None] + self.edges + [None]
+        return CatalogStats(count=self.count, min_price=low, max_price=high,
+                            avg_price=total / self.count if self.count else None, total_price=total,
+                            buckets=[StatsBucket(min=limits[i], max=limits[i + 1], count=count)
+                                     for i, count in enumerate(self.counts)])
+
+
+def same_stats(stats: CatalogStats, expected: CatalogStats) -> bool:
+    """
+    Tell whether two sets of aggregates describe the same catalog, allowing for rounding in the price sums.
+    Parameters:
+        stats (CatalogStats): The aggregates to check, e.g. the running ones.
+        expected (CatalogStats): The reference aggregates, e.g. recomputed from the store.
+    Returns:
+        bool: True if they match.
+    """
+    exact = ("count", "min_price", "max_price", "buckets")
+    return all(getattr(stats, field) == getattr(expected, field) for field in exact) and \
+        math.isclose(stats.total_price, expected.total_price, rel_tol=1e-9, abs_tol=1e-6)
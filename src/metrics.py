@@ -0,0 +1,289 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Tuple
+from src import config
+
+# Whether metrics are recorded. When off, every probe returns right after checking this flag.
+enabled = config.METRICS
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every metric, in the order they are exposed.
+REGISTRY: List["Metric"] = []
+
+_NULL_CONTEXT = nullcontext()
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A named metric with optional labels, registered for exposition."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        """
+        Render the metric in the Prometheus text format.
+        Parameters:
+            Nothing
+        Returns:
+            List[str]: The lines of the metric.
+        """
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A total that only goes up, per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        """
+        Add to the counter, if metrics are enabled.
+        Parameters:
+            amount (float, optional): The amount to add, 1 by default.
+            *label_values (str): The values of the labels of the counter.
+        Returns:
+            Nothing
+        """
+        if not enabled:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        return [f"{self.name}{_format_labels(self.labels, key)} {value!r}" for key, value in values]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+
+class Histogram(Metric):
+    """Counts observations, such as durations in seconds, in cumulative buckets per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # Per label values: the count of each bucket (not cumulative, the last one is +Inf), the sum and the count.
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """
+        Record an observation, if metrics are enabled.
+        Parameters:
+            value (float): The observed value.
+            *label_values (str): The values of the labels of the histogram.
+        Returns:
+            Nothing
+        """
+        if not enabled:
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series = {}
+
+
+STAGE_SECONDS = Histogram(
+    "emperia_stage_seconds",
+    "Time spent in each stage of reading and writing the catalog: read_file, parse, build_models, "
+    "serialize, write_file and encode_response.",
+    ("stage",))
+CRUD_SECONDS = Histogram("emperia_crud_seconds", "Duration of the calls of each crud function.", ("function",))
+REQUEST_SECONDS = Histogram("emperia_request_seconds", "Duration of the API requests, per route and status code.",
+                            ("method", "route", "status"))
+BYTES_READ = Counter("emperia_read_bytes_total",
+                     "Bytes read from the database files, counted in characters for the HTML files.")
+BYTES_WRITTEN = Counter("emperia_written_bytes_total",
+                        "Bytes written to the database files, counted in characters for the HTML files.")
+ROWS_SCANNED = Counter("emperia_rows_scanned_total", "Table rows turned into products.")
+
+
+class _StageTimer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.name)
+        return False
+
+
+def stage(name: str):
+    """
+    Time a stage of the hot path, as in `with stage("parse"): ...`.
+    Parameters:
+        name (str): The stage, exposed as the "stage" label of emperia_stage_seconds.
+    Returns:
+        A context manager, which does nothing when metrics are disabled.
+    """
+    return _StageTimer(name) if enabled else _NULL_CONTEXT
+
+
+def timed(fn: Callable) -> Callable:
+    """
+    Decorate a crud function so that its calls are recorded in emperia_crud_seconds.
+    Parameters:
+        fn (Callable): The function, whose name is the "function" label.
+    Returns:
+        Callable: The decorated function.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            CRUD_SECONDS.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def enable(flag: bool = True) -> None:
+    """
+    Turn the recording of metrics on or off, overriding config.METRICS.
+    Parameters:
+        flag (bool, optional): Whether metrics are recorded.
+    Returns:
+        Nothing
+    """
+    global enabled
+    enabled = flag
+
+
+def reset() -> None:
+    """
+    Clear every metric.
+    Parameters:
+        Nothing
+    Returns:
+        Nothing
+    """
+    for metric in REGISTRY:
+        metric.reset()
+
+
+def render() -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+    Parameters:
+        Nothing
+    Returns:
+        str: The exposition.
+    """
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class RequestMetrics:
+    """
+    ASGI middleware recording the latency of every HTTP request in emperia_request_seconds,
+    labelled by the path template of the matched route so that the number of series stays bounded.
+    When metrics are disabled, requests are passed through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Callable, str] = {}
+
+    def _route(self, scope) -> str:
+        # The router stores the endpoint it matched in the scope; find its path template.
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            app = scope.get("app")
+            route = next((r.path for r in getattr(app, "routes", ()) if getattr(r, "endpoint", None) is endpoint),
+                         "unmatched")
+            self._routes[endpoint] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, scope["method"], self._route(scope), str(status))
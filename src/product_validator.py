@@ -1,6 +1,12 @@
 from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
 from decimal import Decimal
-from src.schemas import Product
+from src.schemas import Product, ProductUpdate
+
+
+def _error(message: str, field: str) -> ValidationError:
+    # pydantic's ValidationError is built from wrapped errors and the model they belong to.
+    return ValidationError([ErrorWrapper(ValueError(message), loc=field)], Product)
 
 
 def validate(product: Product):
@@ -14,16 +20,33 @@ def validate(product: Product):
     try:
         name = str(product.name)
     except ValueError:
-        raise ValidationError("Product name must be a string.")
+        raise _error("Product name must be a string.", "name")
 
     try:
         description = str(product.description)
     except ValueError:
-        raise ValidationError("Product description must be a string.")
+        raise _error("Product description must be a string.", "description")
 
     try:
         price = Decimal(str(product.price))
-        if price <= 0:
+        if not price.is_finite() or price <= 0:
             raise ValueError()
-    except (ValueError, TypeError):
-        raise ValidationError("Product price must be a positive number.")
\ No newline at end of file
+    except (ValueError, TypeError, ArithmeticError):
+        raise _error("Product price must be a positive number.", "price")
+
+
+def validate_update(update: ProductUpdate):
+    """
+    this function takes a ProductUpdate object as input and validates the attributes it changes.
+    Parameters:
+        ProductUpdate object
+    Returns:
+        If any of the given attributes is invalid, it raises a ValidationError.
+    """
+    if update.price is not None:
+        try:
+            price = Decimal(str(update.price))
+            if not price.is_finite() or price <= 0:
+                raise ValueError()
+        except (ValueError, TypeError, ArithmeticError):
+            raise _error("Product price must be a positive number.", "price")
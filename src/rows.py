@@ -0,0 +1,86 @@
+import json
+from typing import Iterable
+from src.schemas import Product
+
+
+class ProductRow:
+    """
+    A compact, read-only product row as kept by the catalog cache.
+
+    Rows hold the same fields as Product in __slots__, without Pydantic's per-instance
+    bookkeeping. They are built straight from the store, which only ever holds validated
+    products, so they are not validated again: Product models are only created, unvalidated,
+    for the rows a call returns, and list responses are serialized from the rows directly.
+    """
+
+    __slots__ = ("id", "name", "description", "price", "_json")
+
+    def __init__(self, id: int, name: str, description: str, price: float):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.price = price
+        self._json = None
+
+    @classmethod
+    def from_product(cls, product: Product) -> "ProductRow":
+        """
+        Build the row of a product.
+        Parameters:
+            product (Product): The product, with its ID.
+        Returns:
+            ProductRow: The row.
+        """
+        return cls(product.id, product.name, product.description, product.price)
+
+    def to_product(self) -> Product:
+        """
+        Build the Product model of the row, without validating its fields again.
+        Parameters:
+            Nothing
+        Returns:
+            Product: The product.
+        """
+        return Product.construct(id=self.id, name=self.name, description=self.description, price=self.price)
+
+    def json(self) -> bytes:
+        """
+        Serialize the row as FastAPI serializes the Product model, computed once per row.
+        Parameters:
+            Nothing
+        Returns:
+            bytes: The JSON object.
+        """
+        if self._json is None:
+            self._json = json.dumps({"id": self.id, "name": self.name, "description": self.description,
+                                     "price": self.price}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return self._json
+
+    def _key(self) -> tuple:
+        return self.id, self.name, self.description, self.price
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ProductRow):
+            return self._key() == other._key()
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __reduce__(self):
+        # Pickled without the serialized form, for the parsing process pool.
+        return ProductRow, self._key()
+
+    def __repr__(self) -> str:
+        return f"ProductRow(id={self.id!r}, name={self.name!r}, description={self.description!r}, price={self.price!r})"
+
+
+def rows_json(rows: Iterable[ProductRow]) -> bytes:
+    """
+    Serialize rows as a JSON array, the same bytes FastAPI produces for the equivalent list of products.
+    Parameters:
+        rows (Iterable[ProductRow]): The rows.
+    Returns:
+        bytes: The JSON array.
+    """
+    return b"[" + b",".join(row.json() for row in rows) + b"]"
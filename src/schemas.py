@@ -7,3 +7,51 @@ class Product(BaseModel):
     name: str
     description: str
     price: float
+
+
+# Partial update of a product: fields left as None are not changed
+class ProductUpdate(BaseModel):
+    id: int
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+
+
+# Outcome of one item of a bulk request
+class BulkResult(BaseModel):
+    index: int
+    status: int
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+# Number of products priced within [min, max) (or [min, max] for the last bucket)
+class PriceBucket(BaseModel):
+    min: float
+    max: float
+    count: int
+
+
+# Number of products priced within [min, max), either bound being None when the bucket is open on that side
+class StatsBucket(BaseModel):
+    min: Optional[float] = None
+    max: Optional[float] = None
+    count: int
+
+
+# Aggregates of the catalog: its size, price statistics (None when it is empty) and products per price bucket
+class CatalogStats(BaseModel):
+    count: int
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    avg_price: Optional[float] = None
+    total_price: float
+    buckets: List[StatsBucket]
+
+
+# A point-in-time copy of the catalog, restorable by name
+class SnapshotInfo(BaseModel):
+    name: str
+    created: float
+    count: int
+    size: int
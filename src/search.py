@@ -0,0 +1,119 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from math import log
+from typing import Dict, Iterable, List, Tuple
+from src.schemas import Product
+
+TOKEN = re.compile(r"\w+")
+
+# A word of the name counts this many times as much as a word of the description.
+NAME_WEIGHT = 2.0
+
+# A term matched by prefix only counts this much of a whole-word match.
+PREFIX_WEIGHT = 0.5
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase words.
+    Parameters:
+        text (str): The text to split.
+    Returns:
+        List[str]: The words of the text, in order.
+    """
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex:
+    """
+    An inverted index over the words of the names and descriptions of the catalog.
+    Each query word matches the products containing it, or containing a word it is a
+    prefix of; a product must match every query word. Results are ranked by the sum of
+    the TF-IDF weights of their matches, name matches weighing more than description ones.
+    """
+
+    def __init__(self):
+        # term -> {product id: weight of the term in the product}
+        self.postings: Dict[str, Dict[int, float]] = {}
+        # The vocabulary in sorted order, so prefixes are found by binary search.
+        self.terms: List[str] = []
+        # product id -> {term: weight}, to remove a product without knowing its old text.
+        self._documents: Dict[int, Dict[str, float]] = {}
+
+    @staticmethod
+    def _weights(product: Product) -> Dict[str, float]:
+        weights = {}
+        for term in tokenize(product.name):
+            weights[term] = weights.get(term, 0.0) + NAME_WEIGHT
+        for term in tokenize(product.description):
+            weights[term] = weights.get(term, 0.0) + 1.0
+        return weights
+
+    def rebuild(self, products: Iterable[Product]) -> None:
+        self.postings, self._documents = {}, {}
+        for product in products:
+            weights = self._documents[product.id] = self._weights(product)
+            for term, weight in weights.items():
+                self.postings.setdefault(term, {})[product.id] = weight
+        self.terms = sorted(self.postings)
+
+    def add(self, product: Product) -> None:
+        weights = self._documents[product.id] = self._weights(product)
+        for term, weight in weights.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.terms, term)
+            posting[product.id] = weight
+
+    def remove(self, product: Product) -> None:
+        for term in self._documents.pop(product.id, {}):
+            posting = self.postings[term]
+            posting.pop(product.id, None)
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect_left(self.terms, term)]
+
+    def clear(self) -> None:
+        self.postings, self._documents, self.terms = {}, {}, []
+
+    def _expand(self, word: str) -> List[Tuple[str, float]]:
+        # Every term matching a query word, with the factor applied to their weight. The expansion is
+        # not capped, so that no product is left out; search() caps the number of ranked results.
+        matches = []
+        pos = bisect_left(self.terms, word)
+        while pos < len(self.terms) and self.terms[pos].startswith(word):
+            term = self.terms[pos]
+            matches.append((term, 1.0 if term == word else PREFIX_WEIGHT))
+            pos += 1
+        return matches
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """
+        Find the products matching every word of a query.
+        Parameters:
+            query (str): The words to look for. Each one also matches the words it is a prefix of.
+            limit (int): The maximum number of results.
+        Returns:
+            List[int]: The IDs of the best matching products, best first, ties in ascending ID order.
+        """
+        words = dict.fromkeys(tokenize(query))
+        if not words:
+            return []
+        count = len(self._documents)
+        scores = None
+        for word in words:
+            word_scores = {}
+            for term, factor in self._expand(word):
+                posting = self.postings[term]
+                idf = log(1 + count / len(posting))
+                for id, weight in posting.items():
+                    if scores is None or id in scores:
+                        # Several terms expanded from one word only count once, by their best match.
+                        word_scores[id] = max(word_scores.get(id, 0.0), factor * weight * idf)
+            scores = word_scores if scores is None else {id: scores[id] + score for id, score in word_scores.items()}
+            if not scores:
+                return []
+        best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [id for id, _ in best]
@@ -0,0 +1,30 @@
+from src import config
+from src.storage.base import StorageBackend
+from src.storage.cached import CachedBackend
+from src.storage.html_table import HTMLTableBackend
+from src.storage.journal import JournaledHTMLBackend
+from src.storage.sharded import ShardedHTMLBackend
+from src.storage.sqlite import SQLiteBackend
+
+# Available storage engines, by the name used in the configuration.
+BACKENDS = {backend.name: backend
+            for backend in (HTMLTableBackend, JournaledHTMLBackend, ShardedHTMLBackend, SQLiteBackend)}
+
+
+def create_backend(name: str = None, path: str = None) -> StorageBackend:
+    """
+    Create a storage backend by name.
+    Parameters:
+        name (str, optional): The backend name, defaults to config.DB_BACKEND.
+        path (str, optional): The path of the store, defaults to the configured path for the backend.
+    Returns:
+        StorageBackend: The backend. Its store is not created until check() is called.
+    Raises:
+        ValueError: If there is no backend with the given name.
+    """
+    name = name or config.DB_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{name}', expected one of: {', '.join(BACKENDS)}.")
+    if path is None:
+        path = config.SQLITE_PATH if name == SQLiteBackend.name else config.DB_PATH
+    return BACKENDS[name](path)
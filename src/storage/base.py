@@ -0,0 +1,393 @@
+import heapq
+import os
+import secrets
+from abc import ABC, abstractmethod
+from typing import Hashable, Iterator, List, NamedTuple, Optional, Tuple
+from src import config
+from src.indexes import PriceIndex, PriceStats, content_key
+from src.rows import ProductRow
+from src.schemas import CatalogStats, Product, ProductUpdate
+from src.search import SearchIndex
+from src.storage.locking import FileLock
+
+
+class StagedCatalog(NamedTuple):
+    """A complete catalog written next to a store by stage_catalog, waiting to replace it."""
+    rows: List[ProductRow]
+    # (staged path, store path) of each file to swap in.
+    files: List[Tuple[str, str]]
+
+
+def staging_path(path: str) -> str:
+    """
+    Return a new name next to a store file for the copy of it staged by stage_catalog.
+    Parameters:
+        path (str): The path of the store file.
+    Returns:
+        str: A path no other staging uses, whatever the thread or process staging it.
+    """
+    return f"{path}.{os.getpid()}-{secrets.token_hex(8)}.restore"
+
+
+class StorageBackend(ABC):
+    """
+    The interface every catalog storage engine implements.
+    The methods mirror the functions exposed by src.crud, which forwards to the configured backend.
+    """
+
+    # Name used to select the backend in the configuration.
+    name = None
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file_lock = None
+
+    def lock(self) -> FileLock:
+        """
+        Return the lock that writers of this store hold while they read, modify and write it.
+        It is a lock file next to the store, so it also serializes writers in other processes.
+        Parameters:
+            Nothing
+        Returns:
+            FileLock: The writer lock of the store.
+        """
+        if self._file_lock is None:
+            self._file_lock = FileLock(self.path + ".lock")
+        return self._file_lock
+
+    @abstractmethod
+    def check(self) -> None:
+        """
+        Create the underlying store if it does not exist yet.
+        Parameters:
+            Nothing
+        Returns:
+            Nothing
+        """
+
+    @abstractmethod
+    def stamp(self) -> Hashable:
+        """
+        Return a cheap token that changes whenever the stored catalog changes.
+        Parameters:
+            Nothing
+        Returns:
+            Hashable: The current change token.
+        """
+
+    @abstractmethod
+    def read_products(self) -> List[Product]:
+        """
+        Retrieve all products from the store, in ID order.
+        Parameters:
+            Nothing
+        Returns:
+            List[Product]: The list of all products in the store.
+        """
+
+    def iter_products(self) -> Iterator[Product]:
+        """
+        Iterate over all products in the store, in ID order.
+        Backends override this to stream products without holding the whole catalog in memory.
+        Parameters:
+            Nothing
+        Returns:
+            Iterator[Product]: The products in the store.
+        """
+        return iter(self.read_products())
+
+    def read_rows(self) -> List[ProductRow]:
+        """
+        Retrieve all products in the store as compact rows, for the catalog cache.
+        Backends override this to build the rows straight from the store, without Product models.
+        Parameters:
+            Nothing
+        Returns:
+            List[ProductRow]: The rows of all products in the store.
+        """
+        return [ProductRow.from_product(product) for product in self.read_products()]
+
+    @abstractmethod
+    def write_products(self, products: List[Product]) -> List[int]:
+        """
+        Add new products to the store under newly generated IDs, in a single write.
+        Parameters:
+            products (List[Product]): The products to add.
+        Returns:
+            List[int]: The IDs given to the new products, in the same order.
+        """
+
+    @abstractmethod
+    def uptodate_products(self, updates: List[ProductUpdate]) -> List[bool]:
+        """
+        Update existing products in a single write. Falsy fields are left unchanged.
+        Parameters:
+            updates (List[ProductUpdate]): The updates to apply, in order.
+        Returns:
+            List[bool]: For each update, True if the product was found.
+        """
+
+    @abstractmethod
+    def delete_products(self, ids: List[int]) -> List[bool]:
+        """
+        Delete products from the store by ID, in a single write.
+        Parameters:
+            ids (List[int]): The IDs of the products to delete.
+        Returns:
+            List[bool]: For each ID, True if the product was found.
+        """
+
+    def search_products(self, query: str, limit: int) -> List[Product]:
+        """
+        Find the products whose name or description contain every word of a query, best matches first.
+        Each query word also matches the words it is a prefix of.
+        Parameters:
+            query (str): The words to look for.
+            limit (int): The maximum number of results.
+        Returns:
+            List[Product]: The best matching products.
+        """
+        # Backends without an index of their own build a throwaway one.
+        products = {p.id: p for p in self.read_products()}
+        index = SearchIndex()
+        index.rebuild(products.values())
+        return [products[id] for id in index.search(query, limit)]
+
+    def write_unique_products(self, products: List[Product]) -> List[Optional[int]]:
+        """
+        Add the products that do not duplicate an existing product or an earlier one of the batch,
+        in a single write. Products are duplicates when their name, description and price are equal.
+        Parameters:
+            products (List[Product]): The products to add.
+        Returns:
+            List[Optional[int]]: For each product, the ID it was given, or None if it was a duplicate.
+        """
+        seen = {content_key(p) for p in self.read_products()}
+        unique = []
+        for index, product in enumerate(products):
+            key = content_key(product)
+            if key not in seen:
+                seen.add(key)
+                unique.append(index)
+        results = [None] * len(products)
+        for index, new_id in zip(unique, self.write_products([products[index] for index in unique])):
+            results[index] = new_id
+        return results
+
+    def write_product(self, product: Product) -> int:
+        """
+        Add a new product to the store under a newly generated ID.
+        Parameters:
+            product (Product): The product to add.
+        Returns:
+            int: The ID given to the new product.
+        """
+        return self.write_products([product])[0]
+
+    def uptodate_product(self, id: int, name: str = None, description: str = None, price: float = None) -> bool:
+        """
+        Update the given fields of an existing product. Falsy values are left unchanged.
+        Parameters:
+            id (int): The ID of the product to update.
+            name (str, optional): The new name of the product.
+            description (str, optional): The new description of the product.
+            price (float, optional): The new price of the product.
+        Returns:
+            bool: True if the product was found.
+        """
+        return self.uptodate_products([ProductUpdate(id=id, name=name, description=description, price=price)])[0]
+
+    def delete_product(self, id: int) -> bool:
+        """
+        Delete a product from the store by ID.
+        Parameters:
+            id (int): The ID of the product to delete.
+        Returns:
+            bool: True if the product was found.
+        """
+        return self.delete_products([int(id)])[0]
+
+    def get_product_by_id(self, id: int) -> Optional[Product]:
+        """
+        Retrieve a product from the store by ID.
+        Parameters:
+            id (int): The ID of the product to retrieve.
+        Returns:
+            Product: The product with the given ID, or None if not found.
+        """
+        for product in self.read_products():
+            if product.id == int(id):
+                return product
+        return None
+
+    def truncate_db(self) -> int:
+        """
+        Delete all products from the store.
+        Parameters:
+            Nothing
+        Returns:
+            int: The number of deleted products.
+        """
+        return sum(self.delete_products([p.id for p in self.read_products()]))
+
+    @abstractmethod
+    def stage_catalog(self, rows: List[ProductRow]) -> StagedCatalog:
+        """
+        Write a complete catalog next to the store, keeping the IDs of its rows, without touching the store.
+        This is the slow part of a restore, so it runs without the lock, and concurrent stagings do not collide.
+        Parameters:
+            rows (List[ProductRow]): The rows of the catalog.
+        Returns:
+            StagedCatalog: The staged files, for commit_catalog or discard_catalog.
+        """
+
+    @abstractmethod
+    def commit_catalog(self, staged: StagedCatalog) -> None:
+        """
+        Replace the store with a staged catalog, e.g. by renaming the staged files over it. Called with the lock held.
+        Parameters:
+            staged (StagedCatalog): The catalog returned by stage_catalog.
+        Returns:
+            Nothing
+        """
+
+    def discard_catalog(self, staged: StagedCatalog) -> None:
+        """
+        Remove the files of a staged catalog that was not committed.
+        Parameters:
+            staged (StagedCatalog): The catalog returned by stage_catalog.
+        Returns:
+            Nothing
+        """
+        for staged_path, _ in staged.files:
+            try:
+                os.remove(staged_path)
+            except FileNotFoundError:
+                pass
+
+    def sort_products_by_price(self, descending: bool = True) -> List[Product]:
+        """
+        Retrieve all products sorted by price. Products with the same price are listed by ascending ID.
+        Parameters:
+            descending (bool, optional): Whether to list the most expensive products first.
+        Returns:
+            List[Product]: A list of products sorted by price.
+        """
+        sign = -1 if descending else 1
+        products = self.read_products()
+        products.sort(key=lambda product: (sign * product.price, product.id))
+        return products
+
+    def iter_products_by_price(self, descending: bool = True) -> Iterator[Product]:
+        """
+        Iterate over all products sorted by price.
+        Parameters:
+            descending (bool, optional): Whether to list the most expensive products first.
+        Returns:
+            Iterator[Product]: The products sorted by price.
+        """
+        return iter(self.sort_products_by_price(descending))
+
+    def read_products_page(self, limit: int, after: int = None) -> List[Product]:
+        """
+        Retrieve one page of products in ID order, using keyset pagination.
+        Parameters:
+            limit (int): The maximum number of products to return.
+            after (int, optional): The ID of the last product of the previous page.
+        Returns:
+            List[Product]: The products of the page.
+        """
+        products = [p for p in self.read_products() if after is None or p.id > after]
+        products.sort(key=lambda product: product.id)
+        return products[:limit]
+
+    def sort_products_page(self, limit: int, after: Tuple[float, int] = None, descending: bool = True) -> List[Product]:
+        """
+        Retrieve one page of products sorted by price, using keyset pagination.
+        Products with the same price are listed by ascending ID in both directions.
+        Parameters:
+            limit (int): The maximum number of products to return.
+            after (Tuple[float, int], optional): The (price, id) of the last product of the previous page.
+            descending (bool, optional): Whether to list the most expensive products first.
+        Returns:
+            List[Product]: The products of the page.
+        """
+        sign = -1 if descending else 1
+        products = self.read_products()
+        if after is not None:
+            start = (sign * after[0], after[1])
+            products = [p for p in products if (sign * p.price, p.id) > start]
+        # Only the page is sorted: a partial selection in O(n log limit).
+        return heapq.nsmallest(limit, products, key=lambda p: (sign * p.price, p.id))
+
+    def range_products_by_price(self, low: float, high: float, limit: int,
+                                after: Tuple[float, int] = None) -> List[Product]:
+        """
+        Retrieve one page of the products priced between two bounds, cheapest first.
+        Parameters:
+            low (float): The lowest price, included.
+            high (float): The highest price, included.
+            limit (int): The maximum number of products to return.
+            after (Tuple[float, int], optional): The (price, id) of the last product of the previous page.
+        Returns:
+            List[Product]: The products of the page.
+        """
+        products = [p for p in self.read_products() if low <= p.price <= high]
+        if after is not None:
+            products = [p for p in products if (p.price, p.id) > tuple(after)]
+        return heapq.nsmallest(limit, products, key=lambda p: (p.price, p.id))
+
+    def price_histogram(self, edges: List[float]) -> List[int]:
+        """
+        Count the products in consecutive price buckets.
+        Parameters:
+            edges (List[float]): The ascending bucket edges. Bucket i holds prices in [edges[i], edges[i + 1]),
+                the last bucket also holds prices equal to its upper edge.
+        Returns:
+            List[int]: The number of products in each of the len(edges) - 1 buckets.
+        """
+        index = PriceIndex()
+        index.rebuild(self.read_products())
+        return index.histogram(edges)
+
+    def price_bounds(self) -> Optional[Tuple[float, float]]:
+        """
+        Return the lowest and highest price of the catalog.
+        Parameters:
+            Nothing
+        Returns:
+            Tuple[float, float]: The lowest and highest price, or None if the catalog is empty.
+        """
+        prices = [p.price for p in self.read_products()]
+        return (min(prices), max(prices)) if prices else None
+
+    def catalog_stats(self) -> CatalogStats:
+        """
+        Compute the aggregates of the catalog from scratch, with the buckets of config.STATS_PRICE_EDGES.
+        Parameters:
+            Nothing
+        Returns:
+            CatalogStats: The number of products, the lowest, highest, average and total price, and the buckets.
+        """
+        products = self.read_products()
+        stats = PriceStats(config.STATS_PRICE_EDGES)
+        stats.rebuild(products)
+        prices = [p.price for p in products]
+        return stats.summary((min(prices), max(prices)) if prices else None)
+
+
+def apply_update(product: Product, update: ProductUpdate) -> Product:
+    """
+    Return a copy of a product with an update applied. Falsy fields of the update are ignored.
+    Parameters:
+        product (Product): The product to update.
+        update (ProductUpdate): The update to apply.
+    Returns:
+        Product: The updated product.
+    """
+    return Product(
+        id=product.id,
+        name=update.name or product.name,
+        description=update.description or product.description,
+        price=update.price or product.price
+    )
@@ -0,0 +1,399 @@
+import secrets
+import threading
+import time
+from itertools import islice
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+from src import config
+from src.indexes import ContentIndex, IdIndex, PriceIndex, PriceStats, content_key, same_stats
+from src.rows import ProductRow
+from src.schemas import CatalogStats, Product, ProductUpdate
+from src.search import SearchIndex
+from src.storage.base import StagedCatalog, StorageBackend, apply_update
+from src.storage.signal import ChangeSignal
+
+
+class CachedBackend(StorageBackend):
+    """
+    Wraps a backend and keeps its catalog in memory as compact rows keyed by product ID, along with
+    an ID index and a price index for paginated and sorted reads.
+
+    The catalog is loaded once and then kept up to date by the writes made through
+    this wrapper, which patch the cache and the indexes instead of dropping them. It is
+    reloaded only when the wrapped backend's stamp, or the change signal bumped by the
+    other processes serving the same store, shows a change made elsewhere.
+    A content index over (name, description, price) makes duplicate checks O(1), and
+    an inverted index over the names and descriptions serves full-text search, and
+    running price aggregates serve the catalog statistics in constant time.
+
+    Every change of the cached catalog, local or external, bumps a version counter,
+    and each product remembers the version that last changed it, so that clients
+    can tell whether what they hold is current without the catalog being read.
+    """
+
+    def __init__(self, backend: StorageBackend):
+        super().__init__(backend.path)
+        self.backend = backend
+        self.name = backend.name
+        self._lock = threading.RLock()
+        # Bumped by every process writing through a cache, so that the others reload.
+        self.signal = ChangeSignal(backend.path + ".signal")
+        self._stamp = None
+        self._products: Dict[int, ProductRow] = {}
+        self._set_indexes(self._new_indexes())
+        # Random prefix of the version tags, so that tags from another process or an
+        # earlier run, whose counters started over, never match the current ones.
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self.modified = time.time()
+        # (version, time) of the last change of each cached product.
+        self._versions: Dict[int, Tuple[int, float]] = {}
+
+    def _refresh(self) -> None:
+        # Reload the catalog if the store changed since it was cached. Called with the lock held.
+        # The stamp is taken before the store is read, so a write racing with
+        # the read can only cause an extra load on the next call, never a stale cache.
+        stamp = self.stamp()
+        if stamp != self._stamp:
+            # The new catalog is built aside and swapped in whole, so a failed read leaves
+            # the previous one in place, still stale and reloaded by the next call.
+            products: Dict[int, ProductRow] = {}
+            for row in self.backend.read_rows():
+                products.setdefault(row.id, row)
+            indexes = self._new_indexes()
+            for index in indexes:
+                index.rebuild(products.values())
+            previous, versions = self._products, self._versions
+            self._products = products
+            self._set_indexes(indexes)
+            self._stamp = stamp
+            # Products that did not change keep their version.
+            self._bump()
+            self._versions = {id: versions[id] if id in versions and previous.get(id) == row
+                              else (self.version, self.modified)
+                              for id, row in self._products.items()}
+
+    @staticmethod
+    def _new_indexes() -> tuple:
+        return IdIndex(), PriceIndex(), ContentIndex(), SearchIndex(), PriceStats(config.STATS_PRICE_EDGES)
+
+    def _set_indexes(self, indexes: tuple) -> None:
+        # Every index, kept up to date with the cached catalog.
+        self.id_index, self.price_index, self.content_index, self.search_index, self.price_stats = indexes
+        self._indexes = indexes
+
+    def load_catalog(self) -> Dict[int, ProductRow]:
+        """
+        Return the cached catalog, reloading it from the wrapped backend only when it has changed.
+        Parameters:
+            Nothing
+        Returns:
+            Dict[int, ProductRow]: The rows of the products keyed by ID, in store order.
+        """
+        with self._lock:
+            self._refresh()
+            return self._products
+
+    def _bump(self) -> None:
+        # Start a new catalog version. Called with the lock held, before the products it covers are added.
+        self.version += 1
+        self.modified = time.time()
+
+    def catalog_version(self) -> Tuple[str, float]:
+        """
+        Return the version of the catalog, reloading it first if it was changed elsewhere.
+        Parameters:
+            Nothing
+        Returns:
+            Tuple[str, float]: A tag that changes with every change of the catalog, and the time of that change.
+        """
+        with self._lock:
+            self._refresh()
+            return f"{self.epoch}-{self.version}", self.modified
+
+    def product_version(self, id: int) -> Optional[Tuple[str, float]]:
+        """
+        Return the version of a product, reloading the catalog first if it was changed elsewhere.
+        Parameters:
+            id (int): The ID of the product.
+        Returns:
+            Tuple[str, float]: A tag that changes with every change of the product, and the time of that change,
+            or None if there is no such product.
+        """
+        with self._lock:
+            self._refresh()
+            version = self._versions.get(int(id))
+            return (f"{self.epoch}-{version[0]}", version[1]) if version is not None else None
+
+    def _is_fresh(self) -> bool:
+        return self._stamp is not None and self._stamp == self.stamp()
+
+    def _add(self, product: Product) -> None:
+        row = ProductRow.from_product(product)
+        self._products[row.id] = row
+        self._versions[row.id] = (self.version, self.modified)
+        for index in self._indexes:
+            index.add(row)
+
+    def _remove(self, id: int) -> Optional[ProductRow]:
+        product = self._products.pop(id, None)
+        self._versions.pop(id, None)
+        if product is not None:
+            for index in self._indexes:
+                index.remove(product)
+        return product
+
+    def _wrote(self, fresh: bool, changed: bool) -> None:
+        # Signal a change to the other processes, then adopt the store's new stamp after
+        # a write that was applied to the cache, or drop the cache if it was already stale
+        # before the write. Under the write lock, so that no other write slips in between.
+        with self.lock():
+            if changed:
+                self.signal.bump()
+            self._stamp = self.stamp() if fresh else None
+
+    def check(self) -> None:
+        self.backend.check()
+
+    def lock(self):
+        return self.backend.lock()
+
+    def stamp(self) -> Hashable:
+        # The wrapped store's stamp, plus the change signal of the processes sharing it.
+        return self.backend.stamp(), self.signal.value()
+
+    def read_rows(self) -> List[ProductRow]:
+        with self._lock:
+            self._refresh()
+            return list(self._products.values())
+
+    def sort_rows_by_price(self, descending: bool = True) -> List[ProductRow]:
+        """
+        Retrieve the rows of all products sorted by price, from the price index.
+        Parameters:
+            descending (bool, optional): Whether to list the most expensive products first.
+        Returns:
+            List[ProductRow]: The rows, with ties in ascending ID order.
+        """
+        with self._lock:
+            self._refresh()
+            return [self._products[id] for id in self.price_index.iter_ids(descending=descending)]
+
+    def read_rows_page(self, limit: int, after: int = None) -> List[ProductRow]:
+        """
+        Retrieve the rows of one page of products in ID order.
+        Parameters:
+            limit (int): The maximum number of rows to return.
+            after (int, optional): The ID of the last product of the previous page.
+        Returns:
+            List[ProductRow]: The rows of the page.
+        """
+        with self._lock:
+            self._refresh()
+            return [self._products[id] for id in self.id_index.page(limit, after)]
+
+    def sort_rows_page(self, limit: int, after: Tuple[float, int] = None,
+                       descending: bool = True) -> List[ProductRow]:
+        """
+        Retrieve the rows of one page of products sorted by price.
+        Parameters:
+            limit (int): The maximum number of rows to return.
+            after (Tuple[float, int], optional): The (price, id) of the last product of the previous page.
+            descending (bool, optional): Whether to list the most expensive products first.
+        Returns:
+            List[ProductRow]: The rows of the page.
+        """
+        with self._lock:
+            self._refresh()
+            return [self._products[id] for id in islice(self.price_index.iter_ids(after, descending), limit)]
+
+    def iter_rows(self) -> Iterator[ProductRow]:
+        """
+        Iterate over the rows of all products, from a copy of a warm cache, or streamed from the backend
+        when the cache is cold, as iter_products does.
+        Parameters:
+            Nothing
+        Returns:
+            Iterator[ProductRow]: The rows, in ID order.
+        """
+        with self._lock:
+            if self._is_fresh():
+                return iter(list(self._products.values()))
+        return (ProductRow.from_product(product) for product in self.backend.iter_products())
+
+    def iter_rows_by_price(self, descending: bool = True) -> Iterator[ProductRow]:
+        """
+        Iterate over the rows of all products sorted by price, as iter_products_by_price does.
+        Parameters:
+            descending (bool, optional): Whether to list the most expensive products first.
+        Returns:
+            Iterator[ProductRow]: The rows, with ties in ascending ID order.
+        """
+        with self._lock:
+            if self._is_fresh():
+                return iter(self.sort_rows_by_price(descending))
+        return (ProductRow.from_product(product) for product in self.backend.iter_products_by_price(descending))
+
+    def read_products(self) -> List[Product]:
+        return [row.to_product() for row in self.read_rows()]
+
+    def iter_products(self) -> Iterator[Product]:
+        # A warm cache is iterated from a copy; a cold one is streamed from the
+        # backend instead of being loaded, so memory stays bounded.
+        with self._lock:
+            if self._is_fresh():
+                return (row.to_product() for row in list(self._products.values()))
+        return self.backend.iter_products()
+
+    def iter_products_by_price(self, descending: bool = True) -> Iterator[Product]:
+        with self._lock:
+            if self._is_fresh():
+                return (row.to_product() for row in self.sort_rows_by_price(descending))
+        return self.backend.iter_products_by_price(descending)
+
+    def get_product_by_id(self, id: int) -> Optional[Product]:
+        with self._lock:
+            self._refresh()
+            row = self._products.get(int(id))
+            return row.to_product() if row is not None else None
+
+    def sort_products_by_price(self, descending: bool = True) -> List[Product]:
+        return [row.to_product() for row in self.sort_rows_by_price(descending)]
+
+    def read_products_page(self, limit: int, after: int = None) -> List[Product]:
+        return [row.to_product() for row in self.read_rows_page(limit, after)]
+
+    def sort_products_page(self, limit: int, after: Tuple[float, int] = None, descending: bool = True) -> List[Product]:
+        return [row.to_product() for row in self.sort_rows_page(limit, after, descending)]
+
+    def range_products_by_price(self, low: float, high: float, limit: int,
+                                after: Tuple[float, int] = None) -> List[Product]:
+        with self._lock:
+            self._refresh()
+            return [self._products[id].to_product() for id in self.price_index.range_ids(low, high, limit, after)]
+
+    def price_histogram(self, edges: List[float]) -> List[int]:
+        with self._lock:
+            self._refresh()
+            return self.price_index.histogram(edges)
+
+    def price_bounds(self) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            self._refresh()
+            return self.price_index.bounds()
+
+    def catalog_stats(self) -> CatalogStats:
+        with self._lock:
+            self._refresh()
+            return self.price_stats.summary(self.price_index.bounds())
+
+    def verify_stats(self) -> Tuple[CatalogStats, CatalogStats]:
+        """
+        Check the running aggregates against aggregates recomputed from the wrapped backend.
+        No write is committed meanwhile. If they differ, the cache is reloaded on its next use.
+        Parameters:
+            Nothing
+        Returns:
+            Tuple[CatalogStats, CatalogStats]: The running aggregates and the recomputed ones.
+        """
+        with self.lock(), self._lock:
+            stats = self.catalog_stats()
+            expected = self.backend.catalog_stats()
+            if not same_stats(stats, expected):
+                self._stamp = None
+            return stats, expected
+
+    def search_products(self, query: str, limit: int) -> List[Product]:
+        with self._lock:
+            self._refresh()
+            return [self._products[id].to_product() for id in self.search_index.search(query, limit)]
+
+    def find_duplicate(self, product: Product) -> Optional[Product]:
+        """
+        Find a product with the same name, description and price as the given one.
+        Parameters:
+            product (Product): The product to look for. Its ID is ignored.
+        Returns:
+            Product: The existing product, or None if there is none.
+        """
+        with self._lock:
+            self._refresh()
+            id = self.content_index.find(product)
+            return self._products[id].to_product() if id is not None else None
+
+    def write_unique_products(self, products: List[Product]) -> List[Optional[int]]:
+        with self._lock:
+            self._refresh()
+            seen = set()
+            unique = []
+            for index, product in enumerate(products):
+                key = content_key(product)
+                if key not in seen and self.content_index.find(product) is None:
+                    seen.add(key)
+                    unique.append(index)
+            results = [None] * len(products)
+            for index, new_id in zip(unique, self.write_products([products[index] for index in unique])):
+                results[index] = new_id
+            return results
+
+    def write_products(self, products: List[Product]) -> List[int]:
+        with self._lock:
+            fresh = self._is_fresh()
+            new_ids = self.backend.write_products(products)
+            if fresh and new_ids:
+                self._bump()
+                for new_id, product in zip(new_ids, products):
+                    self._add(Product(id=new_id, name=product.name, description=product.description, price=product.price))
+            self._wrote(fresh, bool(new_ids))
+            return new_ids
+
+    def uptodate_products(self, updates: List[ProductUpdate]) -> List[bool]:
+        with self._lock:
+            fresh = self._is_fresh()
+            found = self.backend.uptodate_products(updates)
+            if fresh and any(found):
+                self._bump()
+            for update, exists in zip(updates, found):
+                old = self._remove(update.id) if exists and fresh else None
+                if old is not None:
+                    self._add(apply_update(old, update))
+                elif exists:
+                    fresh = False
+            self._wrote(fresh, any(found))
+            return found
+
+    def delete_products(self, ids: List[int]) -> List[bool]:
+        with self._lock:
+            fresh = self._is_fresh()
+            found = self.backend.delete_products(ids)
+            if fresh and any(found):
+                self._bump()
+                for id, exists in zip(ids, found):
+                    if exists:
+                        self._remove(int(id))
+            self._wrote(fresh, any(found))
+            return found
+
+    def stage_catalog(self, rows: List[ProductRow]) -> StagedCatalog:
+        return self.backend.stage_catalog(rows)
+
+    def commit_catalog(self, staged: StagedCatalog) -> None:
+        # The cache is reloaded on its next use, so that its indexes are not rebuilt under the writer lock.
+        with self._lock:
+            self.backend.commit_catalog(staged)
+            self._wrote(False, True)
+
+    def discard_catalog(self, staged: StagedCatalog) -> None:
+        self.backend.discard_catalog(staged)
+
+    def truncate_db(self) -> int:
+        with self._lock:
+            fresh = self._is_fresh()
+            count = self.backend.truncate_db()
+            if fresh and count:
+                self._bump()
+                self._products = {}
+                self._versions = {}
+                for index in self._indexes:
+                    index.clear()
+            self._wrote(fresh, count > 0)
+            return count
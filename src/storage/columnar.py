@@ -0,0 +1,266 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Optional, Tuple
+from src import metrics
+from src.rows import ProductRow
+
+# Layout of a columnar file, in native little-endian order:
+#   header         magic, row count, count of distinct IDs (u), stamp of the HTML file it was built from
+#   ids            int64[n]      product IDs, in table order
+#   prices         float64[n]    prices, in table order
+#   offsets        uint64[2n+1]  bounds of the names and descriptions in the heap: row i has its name
+#                                at heap[offsets[2i]:offsets[2i+1]] and its description up to offsets[2i+2]
+#   sorted_ids     int64[u]      the distinct IDs in ascending order, for binary search
+#   by_id          uint32[u]     the row of each ID of sorted_ids (the first row of a duplicated ID)
+#   by_price       uint32[n]     the rows in ascending (price, id) order
+#   by_price_desc  uint32[n]     the rows in descending price order, ties in ascending ID order
+#   heap           UTF-8 names and descriptions
+MAGIC = b"EMPCOLS1"
+HEADER = struct.Struct("<8sQQQqqQ")
+
+# Stamp of the HTML file a columnar file was built from: size, mtime, ctime and inode.
+# The ctime cannot be set back, so a rewritten file never passes for the one it was built from.
+SourceStamp = Tuple[int, int, int, int]
+
+
+def columns_path(path: str) -> str:
+    """
+    Return the path of the columnar file of a database file.
+    Parameters:
+        path (str): The path of the database file.
+    Returns:
+        str: The path of its columnar file.
+    """
+    return path + ".cols"
+
+
+def source_stamp(path: str) -> SourceStamp:
+    """
+    Return the stamp of a database file that its columnar file must match to be used.
+    Parameters:
+        path (str): The path of the database file.
+    Returns:
+        SourceStamp: The size, mtime, ctime and inode of the file.
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino
+
+
+def write_columns(path: str, rows: List[ProductRow], stamp: SourceStamp) -> None:
+    """
+    Write the columnar file of a database file, replacing the previous one atomically.
+    Parameters:
+        path (str): The path of the database file.
+        rows (List[ProductRow]): The rows of the file, in table order.
+        stamp (SourceStamp): The stamp of the file, taken before it was read.
+    Returns:
+        Nothing
+    """
+    if sys.byteorder != "little":
+        return
+    count = len(rows)
+    ids = array("q", (row.id for row in rows))
+    prices = array("d", (row.price for row in rows))
+    heap = bytearray()
+    offsets = array("Q", [0])
+    for row in rows:
+        heap += row.name.encode("utf-8")
+        offsets.append(len(heap))
+        heap += row.description.encode("utf-8")
+        offsets.append(len(heap))
+    by_id = sorted(range(count), key=lambda i: (ids[i], i))
+    # Keep the first row of each ID, as the catalog cache does.
+    by_id = array("I", (i for k, i in enumerate(by_id) if k == 0 or ids[i] != ids[by_id[k - 1]]))
+    sorted_ids = array("q", (ids[i] for i in by_id))
+    by_price = array("I", sorted(range(count), key=lambda i: (prices[i], ids[i])))
+    by_price_desc = array("I", sorted(range(count), key=lambda i: (-prices[i], ids[i])))
+    tmp_path = f"{columns_path(path)}.{os.getpid()}.tmp"
+    with metrics.stage("write_file"), open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, count, len(sorted_ids), *stamp))
+        for column in (ids, prices, offsets, sorted_ids, by_id, by_price, by_price_desc):
+            f.write(column.tobytes())
+        f.write(heap)
+        size = f.tell()
+    os.replace(tmp_path, columns_path(path))
+    metrics.BYTES_WRITTEN.inc(size)
+
+
+def rename_with_columns(source: str, path: str) -> None:
+    """
+    Rename a database file over another one, carrying its columnar file along. The renamed file gets
+    a new ctime, so the columnar file is restamped for it, provided it was up to date before the rename.
+    Parameters:
+        source (str): The path of the database file to rename.
+        path (str): Its new path. The columnar file of the file it replaces must have been dropped.
+    Returns:
+        Nothing
+    """
+    stamp = source_stamp(source)
+    os.replace(source, path)
+    try:
+        f = open(columns_path(source), "r+b")
+    except FileNotFoundError:
+        return
+    with f:
+        header = HEADER.unpack(f.read(HEADER.size))
+        current = header[0] == MAGIC and header[3:] == stamp
+        if current:
+            f.seek(0)
+            f.write(HEADER.pack(*header[:3], *source_stamp(path)))
+    if current:
+        os.replace(columns_path(source), columns_path(path))
+    else:
+        os.remove(columns_path(source))
+
+
+class _Keys:
+    # The (sign * price, id) keys of the rows in a price order, as a sequence for bisect.
+    def __init__(self, columns: "Columns", order: memoryview, sign: int):
+        self.columns, self.order, self.sign = columns, order, sign
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __getitem__(self, k: int) -> Tuple[float, int]:
+        i = self.order[k]
+        return self.sign * self.columns.prices[i], self.columns.ids[i]
+
+
+class Columns:
+    """
+    A memory-mapped columnar copy of a database file. Rows are decoded on demand, so an ID lookup
+    or a page of a sorted read only touches the pages of the file it needs.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count, distinct, *stamp = HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError(f"'{path}' is not a columnar file")
+            self.stamp: SourceStamp = tuple(stamp)
+            view = memoryview(self._map)
+            position = HEADER.size
+
+            def column(fmt: str, length: int, width: int) -> memoryview:
+                nonlocal position
+                section = view[position:position + length * width].cast(fmt)
+                position += length * width
+                return section
+
+            self.ids = column("q", count, 8)
+            self.prices = column("d", count, 8)
+            self.offsets = column("Q", 2 * count + 1, 8)
+            self.sorted_ids = column("q", distinct, 8)
+            self.by_id = column("I", distinct, 4)
+            self.by_price = column("I", count, 4)
+            self.by_price_desc = column("I", count, 4)
+            self._heap = position
+            if self._heap + self.offsets[-1] > len(self._map):
+                raise ValueError(f"'{path}' is truncated")
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row(self, i: int) -> ProductRow:
+        """
+        Decode one row.
+        Parameters:
+            i (int): The position of the row in the table.
+        Returns:
+            ProductRow: The row.
+        """
+        heap, offsets = self._heap, self.offsets
+        return ProductRow(self.ids[i], str(self._map[heap + offsets[2 * i]:heap + offsets[2 * i + 1]], "utf-8"),
+                          str(self._map[heap + offsets[2 * i + 1]:heap + offsets[2 * i + 2]], "utf-8"),
+                          self.prices[i])
+
+    def rows(self) -> List[ProductRow]:
+        """
+        Decode every row.
+        Parameters:
+            Nothing
+        Returns:
+            List[ProductRow]: The rows, in table order.
+        """
+        with metrics.stage("build_models"):
+            rows = [self.row(i) for i in range(len(self.ids))]
+        metrics.ROWS_SCANNED.inc(len(rows))
+        return rows
+
+    def find(self, id: int) -> Optional[ProductRow]:
+        """
+        Find a row by ID with a binary search.
+        Parameters:
+            id (int): The ID of the product.
+        Returns:
+            ProductRow: The row, or None if there is no such product.
+        """
+        k = bisect_left(self.sorted_ids, id)
+        if k < len(self.sorted_ids) and self.sorted_ids[k] == id:
+            return self.row(self.by_id[k])
+        return None
+
+    def iter_by_price(self, descending: bool = True, after: Tuple[float, int] = None) -> Iterator[ProductRow]:
+        """
+        Iterate over the rows by price, ties in ascending ID order.
+        Parameters:
+            descending (bool, optional): Whether to list the most expensive products first.
+            after (Tuple[float, int], optional): The (price, id) of the last product of the previous page.
+        Returns:
+            Iterator[ProductRow]: The rows.
+        """
+        order, sign = (self.by_price_desc, -1) if descending else (self.by_price, 1)
+        start = 0 if after is None else bisect_right(_Keys(self, order, sign), (sign * after[0], after[1]))
+        return (self.row(order[k]) for k in range(start, len(order)))
+
+    def close(self) -> None:
+        """
+        Unmap the file. Columns that are simply dropped are unmapped when garbage collected.
+        Parameters:
+            Nothing
+        Returns:
+            Nothing
+        """
+        for name in ("ids", "prices", "offsets", "sorted_ids", "by_id", "by_price", "by_price_desc"):
+            section = self.__dict__.pop(name, None)
+            if section is not None:
+                section.release()
+        self._map.close()
+
+    def __enter__(self) -> "Columns":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def open_columns(path: str) -> Optional[Columns]:
+    """
+    Open the columnar file of a database file, if it is up to date with the file.
+    Parameters:
+        path (str): The path of the database file.
+    Returns:
+        Columns: The columns, or None if there are none or if the file changed since it was built.
+    """
+    if sys.byteorder != "little":
+        return None
+    try:
+        columns = Columns(columns_path(path))
+    except (OSError, ValueError, TypeError):
+        return None
+    try:
+        if columns.stamp == source_stamp(path):
+            return columns
+    except OSError:
+        pass
+    columns.close()
+    return None
@@ -0,0 +1,531 @@
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+from html import escape
+from html.parser import HTMLParser
+from itertools import islice, takewhile
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from src import config, metrics
+from src.executors import get_parse_pool
+from src.rows import ProductRow
+from src.schemas import Product, ProductUpdate
+from src.storage.base import StagedCatalog, StorageBackend, apply_update, staging_path
+from src.storage.columnar import Columns, columns_path, open_columns, rename_with_columns, source_stamp, \
+    write_columns
+from src.storage.row_index import RowIndex, squeeze
+
+if TYPE_CHECKING:
+    # Only the legacy write path takes a parsed document; bs4 is slow to import.
+    from bs4 import BeautifulSoup
+
+# Markup of an empty database file.
+EMPTY_TABLE = "<table><tr><th>ID</th><th>Name</th><th>Description</th><th>Price</th></tr></table>"
+
+# Start tag of a table element, looked for in the bytes of a database file.
+TABLE_TAG = re.compile(rb"<table[\s>/]", re.IGNORECASE)
+
+# Encoding of the database files.
+ENCODING = "utf-8"
+
+# Number of characters fed to the row scanner at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Bumped by write_html so that writes made by this process always change the
+# stamp, even when the file's mtime and size do not change. Keyed by absolute path.
+_write_versions: Dict[str, int] = {}
+
+
+def read_html(path: str) -> str:
+    """
+    Read the HTML content of a database file.
+    Parameters:
+        path (str): The path of the database file.
+    Returns:
+        str: The HTML content of the database file.
+    """
+    with metrics.stage("read_file"), open(path, "r", encoding=ENCODING) as f:
+        content = f.read()
+    metrics.BYTES_READ.inc(len(content))
+    return content
+
+
+def write_html(path: str, soup: "BeautifulSoup") -> None:
+    """
+    Write a BeautifulSoup object to a database file.
+    Parameters:
+        path (str): The path of the database file.
+        soup (BeautifulSoup): The BeautifulSoup object to write to the database file.
+    Returns:
+        Nothing
+    """
+    with metrics.stage("serialize"):
+        content = str(soup)
+    _drop_columns(path)
+    with metrics.stage("write_file"), open(path, "w", encoding=ENCODING) as f:
+        f.write(content)
+    metrics.BYTES_WRITTEN.inc(len(content))
+    _wrote(path)
+
+
+def has_table(path: str) -> bool:
+    """
+    Tell whether a database file contains a table, by scanning its bytes instead of parsing it.
+    Parameters:
+        path (str): The path of the database file.
+    Returns:
+        bool: True if the file has a table start tag.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return TABLE_TAG.search(content) is not None
+
+
+def _drop_columns(path: str) -> None:
+    # Called before the file changes: a change of the same size within the
+    # timestamp granularity would keep the stamp of the columnar copy valid.
+    try:
+        os.remove(columns_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def _wrote(path: str) -> None:
+    key = os.path.abspath(path)
+    _write_versions[key] = _write_versions.get(key, 0) + 1
+
+
+class RowScanner(HTMLParser):
+    """
+    Collects the cell texts of the table rows fed to it, without building a DOM.
+    Completed rows are appended to `rows`; rows without <td> cells (the header) are skipped.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: List[List[str]] = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag == "td" and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == "td" and self._cell is not None:
+            self._row.append("".join(self._cell))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if self._row:
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _to_row(cells: List[str]) -> ProductRow:
+    return ProductRow(int(cells[0]), cells[1], cells[2], float(cells[3]))
+
+
+def iter_rows(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[ProductRow]:
+    """
+    Scan a database file and yield its rows one at a time.
+    Only one chunk of the file and the rows completed in it are held in memory.
+    Parameters:
+        path (str): The path of the database file.
+        chunk_size (int, optional): The number of characters read at a time.
+    Returns:
+        Iterator[ProductRow]: The rows in table order.
+    """
+    scanner = RowScanner()
+    with open(path, "r", encoding=ENCODING) as f:
+        while True:
+            with metrics.stage("read_file"):
+                chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            metrics.BYTES_READ.inc(len(chunk))
+            with metrics.stage("parse"):
+                scanner.feed(chunk)
+            rows, scanner.rows = scanner.rows, []
+            yield from _to_rows(rows)
+    scanner.close()
+    yield from _to_rows(scanner.rows)
+
+
+def _parse_row(row: bytes) -> ProductRow:
+    # Parse the markup of a single table row.
+    scanner = RowScanner()
+    scanner.feed(row.decode(ENCODING))
+    scanner.close()
+    return _to_row(scanner.rows[0])
+
+
+def _to_rows(cells: List[List[str]]) -> List[ProductRow]:
+    # Build the rows scanned in one go, timed as a single stage.
+    with metrics.stage("build_models"):
+        rows = [_to_row(row) for row in cells]
+    metrics.ROWS_SCANNED.inc(len(rows))
+    return rows
+
+
+def iter_products(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Product]:
+    """
+    Scan a database file and yield its products one row at a time.
+    Only one chunk of the file and the rows completed in it are held in memory.
+    Parameters:
+        path (str): The path of the database file.
+        chunk_size (int, optional): The number of characters read at a time.
+    Returns:
+        Iterator[Product]: The products in table order.
+    """
+    return (row.to_product() for row in iter_rows(path, chunk_size))
+
+
+def _load_rows(path: str) -> List[ProductRow]:
+    return list(iter_rows(path))
+
+
+def load_rows(path: str, in_pool: bool = True) -> List[ProductRow]:
+    """
+    Load all rows of a database file. They are read from its columnar copy when it is up to date;
+    otherwise the file is parsed, in the parsing process pool if one is configured, and its columnar
+    copy is rebuilt for the next load.
+    Parameters:
+        path (str): The path of the database file.
+        in_pool (bool, optional): Whether the file may be parsed in the parsing pool, False in the pool's workers.
+    Returns:
+        List[ProductRow]: The rows in table order.
+    """
+    if config.COLUMNAR_SNAPSHOT:
+        columns = open_columns(path)
+        if columns is not None:
+            with columns:
+                return columns.rows()
+        # Stamped before parsing: if the file changes meanwhile, the copy is simply stale.
+        stamp = source_stamp(path)
+    pool = get_parse_pool() if in_pool else None
+    rows = _load_rows(path) if pool is None else pool.submit(_load_rows, path).result()
+    if config.COLUMNAR_SNAPSHOT:
+        try:
+            write_columns(path, rows, stamp)
+        except OSError:
+            pass
+    return rows
+
+
+def load_products(path: str) -> List[Product]:
+    """
+    Parse all products of a database file, in the parsing process pool if one is configured.
+    Parameters:
+        path (str): The path of the database file.
+    Returns:
+        List[Product]: The products in table order.
+    """
+    return [row.to_product() for row in load_rows(path)]
+
+
+def parse_products(content: str) -> List[Product]:
+    """
+    Parse the products out of the HTML content of a database file.
+    Parameters:
+        content (str): The HTML content of the database file.
+    Returns:
+        List[Product]: The products in table order.
+    """
+    scanner = RowScanner()
+    with metrics.stage("parse"):
+        scanner.feed(content)
+        scanner.close()
+    return [row.to_product() for row in _to_rows(scanner.rows)]
+
+
+def render_row(product: Product) -> str:
+    """
+    Render a product as a table row.
+    Parameters:
+        product (Product): The product to render.
+    Returns:
+        str: The <tr> markup of the product.
+    """
+    cells = (product.id, product.name, product.description, product.price)
+    return "<tr>" + "".join(f"<td>{escape(str(cell), quote=False)}</td>" for cell in cells) + "</tr>"
+
+
+def render_html(products: List[Product]) -> str:
+    """
+    Render a whole database file from a list of products.
+    Parameters:
+        products (List[Product]): The products, in table order.
+    Returns:
+        str: The HTML content of the database file.
+    """
+    with metrics.stage("serialize"):
+        return EMPTY_TABLE[:-len("</table>")] + "".join(render_row(p) for p in products) + "</table>"
+
+
+class HTMLTableBackend(StorageBackend):
+    """Stores the catalog as the rows of a single HTML <table>."""
+
+    name = "html"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._columns = None
+        # Index of the rows of the file, for in-place changes, and the lock guarding it.
+        self._rows = None
+        self._rows_lock = threading.RLock()
+        # Row indexes of the catalogs staged for a restore, by staged path.
+        self._staged: Dict[str, RowIndex] = {}
+
+    def check(self) -> None:
+        # Check if the database file exists
+        if os.path.exists(self.path):
+            print(f"db '{self.path}' already exists")
+            if self.columns() is not None:
+                # The columnar copy is up to date, so the file was read as a table already.
+                return
+            if not has_table(self.path):
+                # If the file does not contain a table element, add one to the file
+                with open(self.path, "w") as f:
+                    f.write(EMPTY_TABLE)
+        else:
+            # If the file does not exist, create it and add a table element to it
+            with open(self.path, "w") as f:
+                f.write(EMPTY_TABLE)
+            print(f"db '{self.path}' created")
+        if config.COLUMNAR_SNAPSHOT and not config.WARMUP:
+            # Build the columnar copy now, so that the first load maps it instead of parsing the file.
+            # With warm-up, the server builds it in the background while it already accepts connections.
+            load_rows(self.path)
+
+    def columns(self) -> Optional[Columns]:
+        """
+        Return the columnar copy of the database file, mapped once per version of the file.
+        Parameters:
+            Nothing
+        Returns:
+            Columns: The columns, or None if they are disabled, missing or out of date.
+        """
+        if not config.COLUMNAR_SNAPSHOT:
+            return None
+        columns = self._columns
+        try:
+            if columns is not None and columns.stamp == source_stamp(self.path):
+                return columns
+        except OSError:
+            return None
+        # The previous mapping is left to the garbage collector, as other threads may still be reading it.
+        self._columns = columns = open_columns(self.path)
+        return columns
+
+    def stamp(self) -> Tuple[int, int, int]:
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size, _write_versions.get(os.path.abspath(self.path), 0)
+
+    def _row_index(self) -> RowIndex:
+        # The row index of the file, rescanned when the file changed since it was last indexed.
+        index = self._rows
+        if index is None or index.stamp != source_stamp(self.path):
+            index = self._rows = RowIndex.scan(self.path)
+        return index
+
+    def _read_rows(self, f, ids: List[int]) -> Dict[int, ProductRow]:
+        # Read the first row of each product, rescanning once if a row is not where it was indexed.
+        try:
+            rows = {id: self._rows.read(f, id) for id in ids}
+        except LookupError:
+            self._rows = RowIndex.scan(self.path)
+            rows = {id: self._rows.read(f, id) for id in ids}
+        return {id: _parse_row(row) for id, row in rows.items() if row is not None}
+
+    @contextmanager
+    def _patch(self) -> Iterator[Tuple[RowIndex, BinaryIO]]:
+        # Open the file for in-place changes through its row index. Called with the lock held.
+        index = self._row_index()
+        if index.end is None:
+            # No table to patch, as in a file replaced by hand: write its rows back as a table first.
+            # The rows are read before the file is replaced, and the file is replaced atomically.
+            _drop_columns(self.path)
+            self._replace(render_html(parse_products(read_html(self.path))).encode(ENCODING))
+            index = self._rows = RowIndex.scan(self.path)
+        writes = index.writes
+        with open(self.path, "r+b") as f:
+            yield index, f
+        if index.writes == writes:
+            return
+        _wrote(self.path)
+        if index.padding > config.HTML_PADDING_RATIO * index.size:
+            with open(self.path, "rb") as f:
+                content = squeeze(f.read())
+            self._replace(content)
+            self._rows = RowIndex(content, source_stamp(self.path))
+        else:
+            index.stamp = source_stamp(self.path)
+
+    def _replace(self, content: bytes) -> None:
+        # Replace the whole file through a temporary file, so it is never seen half written. Called with the lock held.
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with metrics.stage("write_file"), open(tmp_path, "wb") as f:
+            f.write(content)
+        metrics.BYTES_WRITTEN.inc(len(content))
+        os.replace(tmp_path, self.path)
+
+    def read_products(self) -> List[Product]:
+        return load_products(self.path)
+
+    def read_rows(self) -> List[ProductRow]:
+        return load_rows(self.path)
+
+    def iter_products(self) -> Iterator[Product]:
+        return iter_products(self.path)
+
+    def write_products(self, products: List[Product]) -> List[int]:
+        if not products:
+            return []
+        with self._rows_lock, self._patch() as (index, f):
+            next_id = max(index.spans, default=0) + 1
+            new_ids = list(range(next_id, next_id + len(products)))
+            self._insert(index, f, [ProductRow(new_id, product.name, product.description, product.price)
+                                    for new_id, product in zip(new_ids, products)])
+        return new_ids
+
+    def insert_rows(self, rows: List[ProductRow]) -> None:
+        """
+        Add rows at the end of the table under the IDs they carry, for stores that hand out the IDs themselves.
+        Parameters:
+            rows (List[ProductRow]): The rows to add.
+        Returns:
+            Nothing
+        """
+        if not rows:
+            return
+        with self._rows_lock, self._patch() as (index, f):
+            self._insert(index, f, rows)
+
+    def _insert(self, index: RowIndex, f: BinaryIO, rows: List[ProductRow]) -> None:
+        with metrics.stage("serialize"):
+            markup = [(row.id, render_row(row).encode(ENCODING)) for row in rows]
+        _drop_columns(self.path)
+        index.append(f, markup)
+
+    def max_id(self) -> int:
+        """
+        Return the highest product ID of the table, from the row index.
+        Parameters:
+            Nothing
+        Returns:
+            int: The highest ID, or 0 if the table is empty.
+        """
+        with self._rows_lock:
+            return max(self._row_index().spans, default=0)
+
+    def get_product_by_id(self, id: int) -> Optional[Product]:
+        columns = self.columns()
+        if columns is not None:
+            row = columns.find(int(id))
+            return row.to_product() if row is not None else None
+        with self._rows_lock:
+            self._row_index()
+            with open(self.path, "rb") as f:
+                row = self._read_rows(f, [int(id)]).get(int(id))
+        return row.to_product() if row is not None else None
+
+    def sort_products_by_price(self, descending: bool = True) -> List[Product]:
+        columns = self.columns()
+        if columns is None:
+            return super().sort_products_by_price(descending)
+        return [row.to_product() for row in columns.iter_by_price(descending)]
+
+    def iter_products_by_price(self, descending: bool = True) -> Iterator[Product]:
+        columns = self.columns()
+        if columns is None:
+            return super().iter_products_by_price(descending)
+        return (row.to_product() for row in columns.iter_by_price(descending))
+
+    def sort_products_page(self, limit: int, after: Tuple[float, int] = None, descending: bool = True) -> List[Product]:
+        columns = self.columns()
+        if columns is None:
+            return super().sort_products_page(limit, after, descending)
+        return [row.to_product() for row in islice(columns.iter_by_price(descending, after), limit)]
+
+    def range_products_by_price(self, low: float, high: float, limit: int,
+                                after: Tuple[float, int] = None) -> List[Product]:
+        columns = self.columns()
+        if columns is None:
+            return super().range_products_by_price(low, high, limit, after)
+        start = (low, float("-inf"))
+        if after is not None:
+            start = max(start, tuple(after))
+        rows = takewhile(lambda row: row.price <= high, columns.iter_by_price(False, start))
+        return [row.to_product() for row in islice(rows, limit)]
+
+    def uptodate_products(self, updates: List[ProductUpdate]) -> List[bool]:
+        with self._rows_lock, self._patch() as (index, f):
+            rows = self._read_rows(f, list({update.id for update in updates}))
+            found = [update.id in rows for update in updates]
+            for update, exists in zip(updates, found):
+                if exists:
+                    rows[update.id] = apply_update(rows[update.id], update)
+            if not rows:
+                return found
+            _drop_columns(self.path)
+            moved = []
+            for id, product in rows.items():
+                row = render_row(product).encode(ENCODING)
+                if not index.replace(f, id, row):
+                    # The row grew: it moves to the end of the table.
+                    index.blank(f, id)
+                    moved.append((id, row))
+            index.append(f, moved)
+        return found
+
+    def delete_products(self, ids: List[int]) -> List[bool]:
+        with self._rows_lock, self._patch() as (index, f):
+            rows = self._read_rows(f, list(set(map(int, ids))))
+            found = []
+            for id in map(int, ids):
+                found.append(rows.pop(id, None) is not None)
+            if any(found):
+                _drop_columns(self.path)
+                for id, exists in zip(map(int, ids), found):
+                    if exists:
+                        index.blank(f, id)
+        return found
+
+    def stage_catalog(self, rows: List[ProductRow]) -> StagedCatalog:
+        content = render_html(rows).encode(ENCODING)
+        staged_path = staging_path(self.path)
+        with metrics.stage("write_file"), open(staged_path, "wb") as f:
+            f.write(content)
+        metrics.BYTES_WRITTEN.inc(len(content))
+        # The columnar copy and the row index are built now, so that the commit only renames files.
+        if config.COLUMNAR_SNAPSHOT:
+            write_columns(staged_path, rows, source_stamp(staged_path))
+        with self._rows_lock:
+            self._staged[staged_path] = RowIndex(content, None)
+        return StagedCatalog(rows, [(staged_path, self.path)])
+
+    def commit_catalog(self, staged: StagedCatalog) -> None:
+        with self._rows_lock:
+            _drop_columns(self.path)
+            for staged_path, path in staged.files:
+                rename_with_columns(staged_path, path)
+            _wrote(self.path)
+            self._rows = self._staged.pop(staged.files[0][0], None)
+            if self._rows is not None:
+                self._rows.stamp = source_stamp(self.path)
+
+    def discard_catalog(self, staged: StagedCatalog) -> None:
+        super().discard_catalog(staged)
+        with self._rows_lock:
+            for staged_path, _ in staged.files:
+                self._staged.pop(staged_path, None)
+                _drop_columns(staged_path)
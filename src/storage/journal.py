@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+from src import config, metrics
+from src.rows import ProductRow
+from src.schemas import Product, ProductUpdate
+from src.storage.base import StagedCatalog, StorageBackend
+from src.storage.html_table import HTMLTableBackend, load_products, render_html
+
+# Fields an "add" entry carries and an "update" entry may carry.
+FIELDS = ("name", "description", "price")
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _encode(entry: dict) -> bytes:
+    return json.dumps(entry, separators=(",", ":")).encode() + b"\n"
+
+
+class JournaledHTMLBackend(HTMLTableBackend):
+    """
+    Keeps the HTML table as a snapshot and appends every change to a journal next to it.
+    Writes cost one small append regardless of the catalog size. Reads merge the snapshot
+    with the journal, replaying only the entries appended since the previous read. Once the
+    journal holds config.JOURNAL_COMPACT_THRESHOLD entries it is folded into a new snapshot
+    in a background thread, which is swapped in with an atomic rename.
+
+    The journal's first line records the (mtime, size) of the snapshot it applies to, so a
+    journal left behind after the snapshot was replaced by someone else is ignored.
+    """
+
+    name = "html-journal"
+
+    def __init__(self, path: str, compact_threshold: int = None):
+        super().__init__(path)
+        self.journal_path = path + ".journal"
+        self.compact_threshold = compact_threshold or config.JOURNAL_COMPACT_THRESHOLD
+        self._lock = threading.RLock()
+        self._compacting = False
+        # Snapshot + journal merged in memory, and how much of the journal it includes.
+        self._snapshot = None
+        self._offset = 0
+        self._entries = 0
+        self._products: Dict[int, Product] = {}
+        self._max_id = 0
+        self._version = 0
+
+    def stamp(self) -> Hashable:
+        return _file_stamp(self.path), _file_stamp(self.journal_path), self._version
+
+    def _load_snapshot(self, snapshot: Tuple[int, int]) -> None:
+        self._products = {}
+        for product in load_products(self.path):
+            self._products.setdefault(product.id, product)
+        self._max_id = max(self._products, default=0)
+        self._snapshot = snapshot
+        self._offset = 0
+        self._entries = 0
+
+    def _refresh(self) -> None:
+        # Bring the in-memory catalog up to date with the files. Called with the lock held.
+        snapshot = _file_stamp(self.path)
+        if snapshot != self._snapshot:
+            self._load_snapshot(snapshot)
+        try:
+            f = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            if self._offset:
+                # The journal was removed under us: start over from the snapshot alone.
+                self._load_snapshot(snapshot)
+            return
+        with f:
+            if self._offset == 0:
+                header = f.readline()
+                if not header.endswith(b"\n") or json.loads(header).get("snapshot") != list(snapshot):
+                    # Missing, partial or stale header: the journal does not apply to this snapshot.
+                    return
+                self._offset = len(header)
+            else:
+                f.seek(self._offset)
+            with metrics.stage("read_file"):
+                data = f.read()
+        metrics.BYTES_READ.inc(len(data))
+        # A line without its newline is still being appended and is picked up next time.
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        with metrics.stage("build_models"):
+            for line in complete.splitlines():
+                self._apply(json.loads(line))
+
+    def _apply(self, entry: dict) -> None:
+        op = entry["op"]
+        if op == "add":
+            self._products[entry["id"]] = Product(id=entry["id"], **{field: entry[field] for field in FIELDS})
+            if self._max_id is not None:
+                self._max_id = max(self._max_id, entry["id"])
+        elif op == "update":
+            product = self._products.get(entry["id"])
+            if product is not None:
+                self._products[entry["id"]] = product.copy(update={f: entry[f] for f in FIELDS if f in entry})
+        elif op == "delete":
+            self._products.pop(entry["id"], None)
+            if entry["id"] == self._max_id:
+                # Recomputed on the next add, so IDs are reused like generate_id does.
+                self._max_id = None
+        elif op == "truncate":
+            self._products.clear()
+            self._max_id = 0
+        self._entries += 1
+
+    def _append(self, entries: List[dict]) -> None:
+        # Append entries to the journal in one write and apply them. Called with the lock held, after _refresh.
+        if not entries:
+            return
+        data = b"".join(_encode(entry) for entry in entries)
+        if self._offset == 0:
+            # No journal for the current snapshot yet: start one.
+            header = _encode({"snapshot": list(self._snapshot)})
+            with metrics.stage("write_file"), open(self.journal_path, "wb") as f:
+                f.write(header + data)
+            self._offset = len(header) + len(data)
+        else:
+            with metrics.stage("write_file"), open(self.journal_path, "ab") as f:
+                f.write(data)
+            self._offset += len(data)
+        metrics.BYTES_WRITTEN.inc(len(data))
+        for entry in entries:
+            self._apply(entry)
+        self._version += 1
+        if self._entries >= self.compact_threshold and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def compact(self) -> None:
+        """
+        Fold the journal into a new snapshot of the HTML table.
+        The snapshot is rendered without holding the lock, so writers keep appending meanwhile;
+        entries appended during the render are carried over into the new journal.
+        Parameters:
+            Nothing
+        Returns:
+            Nothing
+        """
+        with self._lock:
+            self._refresh()
+            if not self._entries:
+                return
+            products = list(self._products.values())
+            snapshot, offset = self._snapshot, self._offset
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        content = render_html(products)
+        with metrics.stage("write_file"), open(tmp_path, "w") as f:
+            f.write(content)
+        metrics.BYTES_WRITTEN.inc(len(content))
+        # The swap takes the writer lock, so no other process appends to the old journal meanwhile.
+        with self.lock(), self._lock:
+            self._refresh()
+            if self._snapshot != snapshot:
+                # The snapshot was replaced while rendering, so this render is outdated.
+                os.remove(tmp_path)
+                return
+            with open(self.journal_path, "rb") as f:
+                f.seek(offset)
+                tail = f.read(self._offset - offset)
+            new_snapshot = _file_stamp(tmp_path)
+            header = _encode({"snapshot": list(new_snapshot)})
+            with open(f"{self.journal_path}.{os.getpid()}.tmp", "wb") as f:
+                f.write(header + tail)
+            os.replace(tmp_path, self.path)
+            os.replace(f"{self.journal_path}.{os.getpid()}.tmp", self.journal_path)
+            self._snapshot = new_snapshot
+            self._offset = len(header) + len(tail)
+            self._entries = len(tail.splitlines())
+            self._version += 1
+
+    def read_products(self) -> List[Product]:
+        with self._lock:
+            self._refresh()
+            return list(self._products.values())
+
+    def read_rows(self) -> List[ProductRow]:
+        # The snapshot alone is not the catalog: build the rows from the merged products.
+        return [ProductRow.from_product(product) for product in self.read_products()]
+
+    def iter_products(self) -> Iterator[Product]:
+        # The merged catalog is in memory already, so there is nothing to stream from disk.
+        return iter(self.read_products())
+
+    # The columnar copy holds the snapshot alone, so sorted reads go through the merged catalog.
+    sort_products_by_price = StorageBackend.sort_products_by_price
+    iter_products_by_price = StorageBackend.iter_products_by_price
+    sort_products_page = StorageBackend.sort_products_page
+    range_products_by_price = StorageBackend.range_products_by_price
+
+    def get_product_by_id(self, id: int) -> Optional[Product]:
+        with self._lock:
+            self._refresh()
+            return self._products.get(int(id))
+
+    def write_products(self, products: List[Product]) -> List[int]:
+        with self._lock:
+            self._refresh()
+            if self._max_id is None:
+                self._max_id = max(self._products, default=0)
+            new_ids = list(range(self._max_id + 1, self._max_id + 1 + len(products)))
+            self._append([{"op": "add", "id": new_id, "name": product.name,
+                           "description": product.description, "price": product.price}
+                          for new_id, product in zip(new_ids, products)])
+            return new_ids
+
+    def uptodate_products(self, updates: List[ProductUpdate]) -> List[bool]:
+        with self._lock:
+            self._refresh()
+            found = [update.id in self._products for update in updates]
+            self._append([{"op": "update", "id": update.id,
+                           **{field: getattr(update, field) for field in FIELDS if getattr(update, field)}}
+                          for update, exists in zip(updates, found) if exists])
+            return found
+
+    def delete_products(self, ids: List[int]) -> List[bool]:
+        with self._lock:
+            self._refresh()
+            remaining = set(self._products)
+            found = []
+            for id in map(int, ids):
+                found.append(id in remaining)
+                remaining.discard(id)
+            self._append([{"op": "delete", "id": id} for id, exists in zip(map(int, ids), found) if exists])
+            return found
+
+    def truncate_db(self) -> int:
+        with self._lock:
+            self._refresh()
+            count = len(self._products)
+            if count:
+                self._append([{"op": "truncate"}])
+            return count
+
+    def commit_catalog(self, staged: StagedCatalog) -> None:
+        with self._lock:
+            super().commit_catalog(staged)
+            # The journal applies to the previous snapshot: readers ignore it already, and it is dropped.
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            self._snapshot = None
+            self._version += 1
@@ -0,0 +1,169 @@
+import re
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from src import metrics
+from src.storage.columnar import SourceStamp, source_stamp
+
+# A table row, and the product ID in its first cell. Cell texts are escaped, so "</tr>" only ends rows.
+ROW = re.compile(rb"<tr\b[^>]*>.*?</tr>", re.S)
+ROW_ID = re.compile(rb"<tr\b[^>]*>\s*<td\b[^>]*>\s*(-?\d+)\s*</td>")
+
+TABLE_END = b"</table>"
+
+# Padding left between rows by in-place deletes and updates, and removed by compaction.
+PADDING = re.compile(rb"(?:(?<=</tr>)|(?<=<table>)) +(?=<tr\b|</table>)")
+
+# Byte offset and length of a row in the file.
+Span = Tuple[int, int]
+
+
+class RowIndex:
+    """
+    The byte spans of the data rows of a database file, by product ID, in table order.
+
+    Rows are patched in place: a deleted row is overwritten with spaces, an updated row is
+    rewritten over the old one and padded with spaces when it got shorter, or blanked and
+    appended at the end of the table when it got longer, and new rows are inserted before
+    "</table>". Each change costs about the size of the rows it touches instead of a rewrite
+    of the whole file; the padding is squeezed out once it makes up too much of the file.
+    """
+
+    def __init__(self, data: bytes, stamp: SourceStamp):
+        self.stamp = stamp
+        self.size = len(data)
+        self.spans: Dict[int, List[Span]] = {}
+        # Number of writes made through the index.
+        self.writes = 0
+        # Offset of the end of the table, where rows are appended, or None if the file has no table.
+        self.end = data.rfind(TABLE_END)
+        if self.end < 0:
+            self.end = None
+        with metrics.stage("parse"):
+            for match in ROW.finditer(data, 0, self.end if self.end is not None else len(data)):
+                row_id = ROW_ID.match(match.group())
+                if row_id is not None:
+                    id = int(row_id.group(1))
+                    self.spans.setdefault(id, []).append((match.start(), match.end() - match.start()))
+            # Bytes that compaction would remove.
+            self.padding = sum(match.end() - match.start() for match in PADDING.finditer(data))
+
+    @classmethod
+    def scan(cls, path: str) -> "RowIndex":
+        """
+        Index the rows of a database file.
+        Parameters:
+            path (str): The path of the database file.
+        Returns:
+            RowIndex: The index.
+        """
+        stamp = source_stamp(path)
+        with metrics.stage("read_file"), open(path, "rb") as f:
+            data = f.read()
+        metrics.BYTES_READ.inc(len(data))
+        return cls(data, stamp)
+
+    def find(self, id: int) -> Optional[Span]:
+        """
+        Return the span of the first row of a product.
+        Parameters:
+            id (int): The ID of the product.
+        Returns:
+            Span: The offset and length of the row, or None if there is no such product.
+        """
+        spans = self.spans.get(id)
+        return spans[0] if spans else None
+
+    def read(self, f: BinaryIO, id: int) -> Optional[bytes]:
+        """
+        Read the first row of a product, checking that the file still holds it where it was indexed.
+        Parameters:
+            f (BinaryIO): The database file, opened in binary mode.
+            id (int): The ID of the product.
+        Returns:
+            bytes: The markup of the row, or None if there is no such product.
+        Raises:
+            LookupError: If the row is not where it was indexed, when the file was changed by someone else.
+        """
+        span = self.find(id)
+        if span is None:
+            return None
+        f.seek(span[0])
+        with metrics.stage("read_file"):
+            row = f.read(span[1])
+        metrics.BYTES_READ.inc(len(row))
+        match = ROW_ID.match(row)
+        if match is None or int(match.group(1)) != id or not row.endswith(b"</tr>"):
+            raise LookupError(f"row {id} moved")
+        return row
+
+    def blank(self, f: BinaryIO, id: int) -> None:
+        """
+        Delete the first row of a product by overwriting it with spaces.
+        Parameters:
+            f (BinaryIO): The database file, opened for update in binary mode.
+            id (int): The ID of the product, which must be indexed.
+        Returns:
+            Nothing
+        """
+        offset, length = self.spans[id].pop(0)
+        if not self.spans[id]:
+            del self.spans[id]
+        self._write(f, offset, b" " * length)
+        self.padding += length
+
+    def replace(self, f: BinaryIO, id: int, row: bytes) -> bool:
+        """
+        Overwrite the first row of a product, if the new row is not longer than the old one.
+        Parameters:
+            f (BinaryIO): The database file, opened for update in binary mode.
+            id (int): The ID of the product, which must be indexed.
+            row (bytes): The markup of the new row.
+        Returns:
+            bool: False if the new row does not fit, in which case nothing is written.
+        """
+        offset, length = self.spans[id][0]
+        if len(row) > length:
+            return False
+        self._write(f, offset, row + b" " * (length - len(row)))
+        self.spans[id][0] = (offset, len(row))
+        self.padding += length - len(row)
+        return True
+
+    def append(self, f: BinaryIO, rows: List[Tuple[int, bytes]]) -> None:
+        """
+        Insert rows at the end of the table.
+        Parameters:
+            f (BinaryIO): The database file, opened for update in binary mode.
+            rows (List[Tuple[int, bytes]]): The IDs and markups of the rows.
+        Returns:
+            Nothing
+        """
+        if not rows:
+            return
+        f.seek(self.end)
+        tail = f.read()
+        offset = self.end
+        for id, row in rows:
+            self.spans.setdefault(id, []).append((offset, len(row)))
+            offset += len(row)
+        data = b"".join(row for _, row in rows)
+        self._write(f, self.end, data + tail)
+        self.end += len(data)
+        self.size += len(data)
+
+    def _write(self, f: BinaryIO, offset: int, data: bytes) -> None:
+        self.writes += 1
+        f.seek(offset)
+        with metrics.stage("write_file"):
+            f.write(data)
+        metrics.BYTES_WRITTEN.inc(len(data))
+
+
+def squeeze(data: bytes) -> bytes:
+    """
+    Remove the padding left between the rows of a database file by in-place changes.
+    Parameters:
+        data (bytes): The content of the database file.
+    Returns:
+        bytes: The content without padding.
+    """
+    return PADDING.sub(b"", data)
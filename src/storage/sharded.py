@@ -0,0 +1,238 @@
+import heapq
+import json
+import os
+from concurrent.futures import wait
+from itertools import islice
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+from src import config
+from src.executors import get_parse_pool, get_shard_executor
+from src.rows import ProductRow
+from src.schemas import Product, ProductUpdate
+from src.storage.base import StagedCatalog, StorageBackend, staging_path
+from src.storage.columnar import open_columns
+from src.storage.html_table import HTMLTableBackend, load_rows, render_html
+
+T = TypeVar("T")
+
+
+def _read_shard(path: str) -> List[ProductRow]:
+    # The rows of a shard in ID order. Runs in the parsing pool's workers, which must not submit to the pool.
+    rows = load_rows(path, in_pool=False)
+    rows.sort(key=lambda row: row.id)
+    return rows
+
+
+def _sort_shard(path: str, descending: bool, limit: Optional[int], after: Optional[Tuple[float, int]]) -> List[ProductRow]:
+    # Up to `limit` rows of a shard by price, after the (price, id) of the previous page.
+    columns = open_columns(path)
+    if columns is not None:
+        with columns:
+            return list(islice(columns.iter_by_price(descending, after), limit))
+    sign = -1 if descending else 1
+    rows = load_rows(path, in_pool=False)
+    if after is not None:
+        rows = [row for row in rows if (sign * row.price, row.id) > (sign * after[0], after[1])]
+    rows.sort(key=lambda row: (sign * row.price, row.id))
+    return rows[:limit]
+
+
+def _packed(fn: Callable, path: str, *args) -> tuple:
+    # Run a shard function in a pool worker and send its rows back as columns, which pickle faster than rows.
+    rows = fn(path, *args)
+    return [row.id for row in rows], [row.name for row in rows], [row.description for row in rows], \
+        [row.price for row in rows]
+
+
+class ShardedHTMLBackend(StorageBackend):
+    """
+    Partitions the catalog across several HTML table files, each one a "html" store of its own.
+    A product lives in shard `id % shards`, so an operation on one product touches one shard.
+    Full reads load the shards in parallel, in the parsing process pool when one is configured and
+    in the shard thread pool otherwise, and merge their sorted results. The shards touched by a batch
+    of writes are written in parallel too.
+
+    The manifest next to the path records the number of shards and the highest ID of each, so new
+    IDs are handed out without reading the shards. Like generate_id, the next ID is one more than
+    the highest ID in the catalog.
+    """
+
+    name = "html-sharded"
+
+    def __init__(self, path: str, shards: int = None):
+        super().__init__(path)
+        self.manifest_path = path + ".manifest.json"
+        self._shard_count = shards or config.DB_SHARDS
+        self._shards = None
+
+    @property
+    def shards(self) -> List[HTMLTableBackend]:
+        """The backends of the shards, in the number recorded in the manifest once there is one."""
+        if self._shards is None:
+            manifest = self._read_manifest()
+            count = manifest["shards"] if manifest else self._shard_count
+            self._shards = [HTMLTableBackend(f"{self.path}.shard{i}.html") for i in range(count)]
+        return self._shards
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, max_ids: List[int], path: str = None) -> None:
+        # Written to `path` instead when given, a staged file that is renamed over the manifest later.
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp" if path is None else path
+        with open(tmp_path, "w") as f:
+            json.dump({"shards": len(max_ids), "scheme": "id-modulo", "max_ids": max_ids}, f)
+        if path is None:
+            os.replace(tmp_path, self.manifest_path)
+
+    def _shard_of(self, id: int) -> int:
+        return int(id) % len(self.shards)
+
+    def _group(self, items: List[T], key: Callable[[T], int]) -> Dict[int, List[Tuple[int, T]]]:
+        # The items of a batch by shard, with their positions in the batch.
+        groups: Dict[int, List[Tuple[int, T]]] = {}
+        for position, item in enumerate(items):
+            groups.setdefault(self._shard_of(key(item)), []).append((position, item))
+        return groups
+
+    def _map(self, fn: Callable, *args) -> List[List[ProductRow]]:
+        # Run fn(shard path, *args) for every shard in parallel, in the parsing pool if one is configured.
+        paths = [shard.path for shard in self.shards]
+        pool = get_parse_pool()
+        if pool is None:
+            return list(get_shard_executor().map(lambda path: fn(path, *args), paths))
+        results = pool.map(_packed, [fn] * len(paths), paths, *([arg] * len(paths) for arg in args))
+        return [list(map(ProductRow, *columns)) for columns in results]
+
+    def _each(self, fn: Callable[[int, list], T], groups: Dict[int, list]) -> Dict[int, T]:
+        # Run fn(shard, items) for the groups of a batch, one shard per thread of the shard pool.
+        # Every shard is done before this returns, even when one of them fails.
+        if len(groups) <= 1:
+            return {shard: fn(shard, items) for shard, items in groups.items()}
+        futures = {shard: get_shard_executor().submit(fn, shard, items) for shard, items in groups.items()}
+        wait(futures.values())
+        return {shard: future.result() for shard, future in futures.items()}
+
+    def check(self) -> None:
+        if os.path.exists(self.manifest_path):
+            print(f"db '{self.path}' already exists in {len(self.shards)} shards")
+        else:
+            # Split an existing single-file catalog into the shards, or start empty.
+            rows = load_rows(self.path) if os.path.exists(self.path) else []
+            parts = self._split(rows)
+            for shard, part in zip(self.shards, parts):
+                with open(shard.path, "w", encoding="utf-8") as f:
+                    f.write(render_html(part))
+            self._write_manifest([max((row.id for row in part), default=0) for part in parts])
+            print(f"db '{self.path}' created in {len(self.shards)} shards")
+        for shard in self.shards:
+            shard.check()
+
+    def stamp(self) -> Hashable:
+        return tuple(shard.stamp() for shard in self.shards)
+
+    def read_rows(self) -> List[ProductRow]:
+        return list(heapq.merge(*self._map(_read_shard), key=lambda row: row.id))
+
+    def read_products(self) -> List[Product]:
+        return [row.to_product() for row in self.read_rows()]
+
+    def get_product_by_id(self, id: int) -> Optional[Product]:
+        return self.shards[self._shard_of(id)].get_product_by_id(id)
+
+    def sort_products_by_price(self, descending: bool = True) -> List[Product]:
+        return self.sort_products_page(None, None, descending)
+
+    def sort_products_page(self, limit: Optional[int], after: Tuple[float, int] = None,
+                           descending: bool = True) -> List[Product]:
+        # Each shard sends its own first page at most, and the pages are merged.
+        sign = -1 if descending else 1
+        pages = self._map(_sort_shard, descending, limit, after)
+        rows = heapq.merge(*pages, key=lambda row: (sign * row.price, row.id))
+        return [row.to_product() for row in islice(rows, limit)]
+
+    def write_products(self, products: List[Product]) -> List[int]:
+        if not products:
+            return []
+        with self.lock():
+            max_ids = self._read_manifest()["max_ids"]
+            next_id = max(max_ids) + 1
+            new_ids = list(range(next_id, next_id + len(products)))
+            groups = self._group(list(zip(new_ids, products)), key=lambda item: item[0])
+            self._each(lambda shard, items: self.shards[shard].insert_rows(
+                [ProductRow(id, product.name, product.description, product.price) for _, (id, product) in items]),
+                groups)
+            for shard, items in groups.items():
+                max_ids[shard] = max(max_ids[shard], items[-1][1][0])
+            self._write_manifest(max_ids)
+            return new_ids
+
+    def uptodate_products(self, updates: List[ProductUpdate]) -> List[bool]:
+        found = [False] * len(updates)
+        groups = self._group(updates, key=lambda update: update.id)
+        shard_results = self._each(lambda shard, items: self.shards[shard].uptodate_products(
+            [update for _, update in items]), groups)
+        for shard, items in groups.items():
+            for (position, _), exists in zip(items, shard_results[shard]):
+                found[position] = exists
+        return found
+
+    def delete_products(self, ids: List[int]) -> List[bool]:
+        found = [False] * len(ids)
+        with self.lock():
+            max_ids = None
+            groups = self._group(ids, key=int)
+            shard_results = self._each(lambda shard, items: self.shards[shard].delete_products(
+                [id for _, id in items]), groups)
+            for shard, items in groups.items():
+                results = shard_results[shard]
+                for (position, _), exists in zip(items, results):
+                    found[position] = exists
+                if any(results):
+                    max_ids = max_ids or self._read_manifest()["max_ids"]
+                    if max_ids[shard] in {int(id) for (_, id), exists in zip(items, results) if exists}:
+                        # The highest ID is gone: ask the shard's row index for the next one.
+                        max_ids[shard] = self.shards[shard].max_id()
+            if max_ids is not None:
+                self._write_manifest(max_ids)
+        return found
+
+    def _split(self, rows: List[ProductRow]) -> List[List[ProductRow]]:
+        parts = [[] for _ in self.shards]
+        for row in rows:
+            parts[self._shard_of(row.id)].append(row)
+        return parts
+
+    def stage_catalog(self, rows: List[ProductRow]) -> StagedCatalog:
+        files = []
+        parts = self._split(rows)
+        try:
+            for shard, part in zip(self.shards, parts):
+                files += shard.stage_catalog(part).files
+            staged_manifest = staging_path(self.manifest_path)
+            self._write_manifest([max((row.id for row in part), default=0) for part in parts], staged_manifest)
+            files.append((staged_manifest, self.manifest_path))
+        except BaseException:
+            self.discard_catalog(StagedCatalog(rows, files))
+            raise
+        return StagedCatalog(rows, files)
+
+    def commit_catalog(self, staged: StagedCatalog) -> None:
+        # The shards are swapped one by one, then the manifest, all under the writer lock.
+        for shard, part, files in zip(self.shards, self._split(staged.rows), staged.files):
+            shard.commit_catalog(StagedCatalog(part, [files]))
+        os.replace(*staged.files[-1])
+
+    def discard_catalog(self, staged: StagedCatalog) -> None:
+        for shard, files in zip(self.shards, staged.files):
+            shard.discard_catalog(StagedCatalog([], [files]))
+        super().discard_catalog(StagedCatalog([], staged.files[len(self.shards):]))
+
+    def truncate_db(self) -> int:
+        with self.lock():
+            count = sum(shard.truncate_db() for shard in self.shards)
+            self._write_manifest([0] * len(self.shards))
+            return count
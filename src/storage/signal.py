@@ -0,0 +1,66 @@
+import mmap
+import os
+import struct
+import threading
+
+# Layout of the signal file: one unsigned 64-bit counter.
+COUNTER = struct.Struct("<Q")
+
+
+class ChangeSignal:
+    """
+    A change counter shared by every process using the same store, kept in a small
+    memory-mapped file next to it. Writers bump it after each change, while holding
+    the store's write lock; readers compare it with the value they last saw, which
+    costs a memory read instead of a system call.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self) -> mmap.mmap:
+        # Map the file on first use, creating it if needed.
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    try:
+                        if os.fstat(fd).st_size < COUNTER.size:
+                            # Extending with zeros keeps a counter written concurrently by another process.
+                            os.ftruncate(fd, COUNTER.size)
+                        self._map = mmap.mmap(fd, COUNTER.size)
+                    finally:
+                        os.close(fd)
+        return self._map
+
+    def value(self) -> int:
+        """
+        Return the current value of the counter.
+        Parameters:
+            Nothing
+        Returns:
+            int: The number of changes signalled so far.
+        """
+        return COUNTER.unpack_from(self._open())[0]
+
+    def bump(self) -> int:
+        """
+        Signal a change to every process. The caller holds the store's write lock,
+        so that increments from different processes are not lost.
+        Parameters:
+            Nothing
+        Returns:
+            int: The new value of the counter.
+        """
+        mapping = self._open()
+        value = COUNTER.unpack_from(mapping)[0] + 1
+        COUNTER.pack_into(mapping, 0, value)
+        return value
+
+    def close(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
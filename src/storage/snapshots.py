@@ -0,0 +1,137 @@
+import json
+import os
+import re
+import secrets
+import time
+from typing import List, Optional
+from src import config, metrics
+from src.rows import ProductRow
+from src.schemas import SnapshotInfo
+from src.storage.columnar import columns_path, source_stamp, write_columns
+from src.storage.html_table import ENCODING, load_rows, render_html
+
+# Names snapshots may be given: they become file names.
+NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,63}")
+
+
+class SnapshotStore:
+    """
+    Point-in-time copies of the catalog, kept in a directory next to the store whatever its backend.
+
+    A snapshot is an HTML table file, `<name>.html`, with its columnar copy so that it loads without
+    being parsed, and `<name>.json`, which describes it. The description is written last: a snapshot
+    without one is incomplete and is not listed. Snapshots are never changed once written.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, name: str, suffix: str) -> str:
+        if not NAME.fullmatch(name):
+            raise ValueError(f"Invalid snapshot name '{name}': expected up to 64 letters, digits, '.', '_' or '-'.")
+        return os.path.join(self.directory, name + suffix)
+
+    def create(self, rows: List[ProductRow], name: str = None) -> SnapshotInfo:
+        """
+        Write a snapshot of a catalog.
+        Parameters:
+            rows (List[ProductRow]): The rows of the catalog, as of one point in time.
+            name (str, optional): The name of the snapshot, by default its UTC creation time and a random suffix.
+        Returns:
+            SnapshotInfo: The description of the snapshot.
+        Raises:
+            ValueError: If the name is not valid.
+            FileExistsError: If a snapshot already has this name.
+        """
+        created = time.time()
+        name = name or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(created)) + "-" + secrets.token_hex(3)
+        path, info_path = self._path(name, ".html"), self._path(name, ".json")
+        os.makedirs(self.directory, exist_ok=True)
+        # Claims the name, even against another process creating the same snapshot.
+        open(path, "x").close()
+        try:
+            content = render_html(rows).encode(ENCODING)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with metrics.stage("write_file"), open(tmp_path, "wb") as f:
+                f.write(content)
+            metrics.BYTES_WRITTEN.inc(len(content))
+            os.replace(tmp_path, path)
+            if config.COLUMNAR_SNAPSHOT:
+                write_columns(path, rows, source_stamp(path))
+            info = SnapshotInfo(name=name, created=created, count=len(rows), size=len(content))
+            with open(f"{info_path}.{os.getpid()}.tmp", "w") as f:
+                f.write(info.json())
+            os.replace(f"{info_path}.{os.getpid()}.tmp", info_path)
+        except BaseException:
+            self._remove(name)
+            raise
+        return info
+
+    def get(self, name: str) -> Optional[SnapshotInfo]:
+        """
+        Return the description of a snapshot.
+        Parameters:
+            name (str): The name of the snapshot.
+        Returns:
+            SnapshotInfo: The description, or None if there is no such snapshot.
+        Raises:
+            ValueError: If the name is not valid.
+        """
+        try:
+            with open(self._path(name, ".json"), "r") as f:
+                return SnapshotInfo(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def list(self) -> List[SnapshotInfo]:
+        """
+        Return the descriptions of all snapshots.
+        Parameters:
+            Nothing
+        Returns:
+            List[SnapshotInfo]: The descriptions, oldest first.
+        """
+        try:
+            names = [entry[:-len(".json")] for entry in os.listdir(self.directory) if entry.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        snapshots = [self.get(name) for name in names if NAME.fullmatch(name)]
+        return sorted((info for info in snapshots if info is not None), key=lambda info: (info.created, info.name))
+
+    def load(self, name: str) -> Optional[List[ProductRow]]:
+        """
+        Read the rows of a snapshot.
+        Parameters:
+            name (str): The name of the snapshot.
+        Returns:
+            List[ProductRow]: The rows, or None if there is no such snapshot.
+        Raises:
+            ValueError: If the name is not valid.
+        """
+        if self.get(name) is None:
+            return None
+        return load_rows(self._path(name, ".html"))
+
+    def delete(self, name: str) -> bool:
+        """
+        Delete a snapshot.
+        Parameters:
+            name (str): The name of the snapshot.
+        Returns:
+            bool: True if the snapshot existed.
+        Raises:
+            ValueError: If the name is not valid.
+        """
+        if self.get(name) is None:
+            return False
+        self._remove(name)
+        return True
+
+    def _remove(self, name: str) -> None:
+        # The description goes first, so that the snapshot stops being listed before its files go.
+        path = self._path(name, ".html")
+        for file in (self._path(name, ".json"), columns_path(path), path):
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,226 @@
+import os
+import sys
+import sqlite3
+import threading
+from typing import Iterator, List, Optional, Tuple
+from src import metrics
+from src.rows import ProductRow
+from src.schemas import Product, ProductUpdate
+from src.storage.base import StagedCatalog, StorageBackend, staging_path
+from src.storage.html_table import parse_products, read_html
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS products ("
+    " id INTEGER PRIMARY KEY,"
+    " name TEXT NOT NULL,"
+    " description TEXT NOT NULL,"
+    " price REAL NOT NULL)",
+    # Matches the ORDER BY of sort_products_by_price, so sorted reads need no sort step.
+    "CREATE INDEX IF NOT EXISTS products_price ON products (price DESC, id)",
+    "CREATE INDEX IF NOT EXISTS products_price_asc ON products (price, id)",
+)
+
+COLUMNS = "id, name, description, price"
+
+
+def _to_product(row) -> Product:
+    return Product.construct(id=row[0], name=row[1], description=row[2], price=row[3])
+
+
+class SQLiteBackend(StorageBackend):
+    """Stores the catalog in an SQLite database running in WAL mode."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        # sqlite3 connections may not be shared between threads, and the API
+        # runs sync handlers in a threadpool, so each thread gets its own.
+        self._local = threading.local()
+        # A connection that never writes: its data_version changes whenever any
+        # other connection, in this process or another one, commits a change.
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def check(self) -> None:
+        created = not os.path.exists(self.path)
+        conn = self._connect()
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+        if created:
+            print(f"db '{self.path}' created")
+        else:
+            print(f"db '{self.path}' already exists")
+
+    def stamp(self) -> int:
+        with self._watcher_lock:
+            if self._watcher is None:
+                self._watcher = sqlite3.connect(self.path, check_same_thread=False)
+            return self._watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def read_products(self) -> List[Product]:
+        return [row.to_product() for row in self.read_rows()]
+
+    def read_rows(self) -> List[ProductRow]:
+        with metrics.stage("read_file"):
+            rows = self._connect().execute(f"SELECT {COLUMNS} FROM products ORDER BY id").fetchall()
+        with metrics.stage("build_models"):
+            rows = [ProductRow(*row) for row in rows]
+        metrics.ROWS_SCANNED.inc(len(rows))
+        return rows
+
+    def _stream(self, query: str) -> Iterator[Product]:
+        # Streamed responses are consumed from whichever threadpool thread is
+        # free, so the cursor gets a connection of its own that may change threads.
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            for row in conn.execute(query):
+                yield _to_product(row)
+        finally:
+            conn.close()
+
+    def iter_products(self) -> Iterator[Product]:
+        return self._stream(f"SELECT {COLUMNS} FROM products ORDER BY id")
+
+    def get_product_by_id(self, id: int) -> Optional[Product]:
+        row = self._connect().execute(f"SELECT {COLUMNS} FROM products WHERE id = ?", (int(id),)).fetchone()
+        return _to_product(row) if row else None
+
+    def write_products(self, products: List[Product]) -> List[int]:
+        conn = self._connect()
+        with conn:
+            # Without AUTOINCREMENT an INTEGER PRIMARY KEY is max(id) + 1, like generate_id.
+            return [conn.execute(
+                "INSERT INTO products (name, description, price) VALUES (?, ?, ?)",
+                (product.name, product.description, product.price)
+            ).lastrowid for product in products]
+
+    def uptodate_products(self, updates: List[ProductUpdate]) -> List[bool]:
+        conn = self._connect()
+        with conn:
+            # Falsy fields are passed as NULL and left unchanged by COALESCE.
+            return [conn.execute(
+                "UPDATE products SET name = COALESCE(?, name), description = COALESCE(?, description),"
+                " price = COALESCE(?, price) WHERE id = ?",
+                (update.name or None, update.description or None, update.price or None, update.id)
+            ).rowcount > 0 for update in updates]
+
+    def delete_products(self, ids: List[int]) -> List[bool]:
+        conn = self._connect()
+        with conn:
+            return [conn.execute("DELETE FROM products WHERE id = ?", (int(id),)).rowcount > 0 for id in ids]
+
+    def truncate_db(self) -> int:
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute("DELETE FROM products")
+        return cursor.rowcount
+
+    def stage_catalog(self, rows: List[ProductRow]) -> StagedCatalog:
+        staged_path = staging_path(self.path)
+        staged = StagedCatalog(rows, [(staged_path, self.path)])
+        conn = sqlite3.connect(staged_path)
+        try:
+            # In WAL mode like the store, which takes the journal mode of the database copied into it.
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                conn.executemany(f"INSERT INTO products ({COLUMNS}) VALUES (?, ?, ?, ?)",
+                                 [(row.id, row.name, row.description, row.price) for row in rows])
+        finally:
+            conn.close()
+        return staged
+
+    def commit_catalog(self, staged: StagedCatalog) -> None:
+        # Other connections, in this process or others, keep the database file open, so it is not
+        # renamed over: the online backup API copies the staged database into it in one transaction.
+        staged_path, _ = staged.files[0]
+        source = sqlite3.connect(staged_path)
+        try:
+            source.backup(self._connect())
+        finally:
+            source.close()
+        self.discard_catalog(staged)
+
+    def discard_catalog(self, staged: StagedCatalog) -> None:
+        for staged_path, _ in staged.files:
+            for path in (staged_path, staged_path + "-wal", staged_path + "-shm"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def sort_products_by_price(self, descending: bool = True) -> List[Product]:
+        direction = "DESC" if descending else "ASC"
+        rows = self._connect().execute(f"SELECT {COLUMNS} FROM products ORDER BY price {direction}, id")
+        return [_to_product(row) for row in rows]
+
+    def iter_products_by_price(self, descending: bool = True) -> Iterator[Product]:
+        direction = "DESC" if descending else "ASC"
+        return self._stream(f"SELECT {COLUMNS} FROM products ORDER BY price {direction}, id")
+
+    def read_products_page(self, limit: int, after: int = None) -> List[Product]:
+        rows = self._connect().execute(
+            f"SELECT {COLUMNS} FROM products WHERE id > ? ORDER BY id LIMIT ?",
+            (0 if after is None else after, limit)
+        )
+        return [_to_product(row) for row in rows]
+
+    def sort_products_page(self, limit: int, after: Tuple[float, int] = None, descending: bool = True) -> List[Product]:
+        direction, beyond = ("DESC", "<") if descending else ("ASC", ">")
+        query = f"SELECT {COLUMNS} FROM products"
+        params = ()
+        if after is not None:
+            query += f" WHERE price {beyond} ? OR (price = ? AND id > ?)"
+            params = (after[0], after[0], after[1])
+        query += f" ORDER BY price {direction}, id LIMIT ?"
+        return [_to_product(row) for row in self._connect().execute(query, params + (limit,))]
+
+    def insert_products(self, products: List[Product]) -> int:
+        """
+        Insert products keeping their IDs, replacing existing products with the same ID.
+        Parameters:
+            products (List[Product]): The products to insert.
+        Returns:
+            int: The number of inserted products.
+        """
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO products ({COLUMNS}) VALUES (?, ?, ?, ?)",
+                [(p.id, p.name, p.description, p.price) for p in products]
+            )
+        return len(products)
+
+
+def import_html(html_path: str, sqlite_path: str) -> int:
+    """
+    Copy the catalog of an HTML database file into an SQLite database, keeping the product IDs.
+    Parameters:
+        html_path (str): The path of the HTML database file.
+        sqlite_path (str): The path of the SQLite database, created if it does not exist.
+    Returns:
+        int: The number of imported products.
+    """
+    backend = SQLiteBackend(sqlite_path)
+    backend.check()
+    return backend.insert_products(parse_products(read_html(html_path)))
+
+
+if __name__ == '__main__':
+    # Usage: python -m src.storage.sqlite [index.html] [catalog.db]
+    from src.config import DB_PATH, SQLITE_PATH
+    source = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    target = sys.argv[2] if len(sys.argv) > 2 else SQLITE_PATH
+    print(f"{import_html(source, target)} products imported from '{source}' into '{target}'")
@@ -0,0 +1,157 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List, Optional
+from src.changes import ChangeFeed
+from src.storage import StorageBackend
+
+# Backend method committing each kind of mutation, for a whole group at once.
+COMMITTERS = {
+    "add": "write_products",
+    "add_unique": "write_unique_products",
+    "update": "uptodate_products",
+    "delete": "delete_products",
+}
+
+
+class WriteQueue:
+    """
+    Funnels every mutation of this process through a single writer thread.
+
+    Mutations submitted while the writer is busy, or within `window` seconds of
+    the first one of a group, are committed together: consecutive mutations of the
+    same kind become one backend call, i.e. one read-modify-write of the store. If that
+    call fails, the mutations are committed again one at a time, so that a bad item only
+    fails the submission it came with. Each
+    commit holds the store's file lock, so writers in other processes sharing the
+    store are serialized too and IDs are never handed out twice. The changes of
+    each commit are published to the change feed, if any, under the same lock.
+    """
+
+    def __init__(self, backend: StorageBackend, window: float = 0.0, feed: Optional[ChangeFeed] = None):
+        self.backend = backend
+        self.window = window
+        self.feed = feed
+        self._pending = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, kind: str, items: List[Any] = None) -> Future:
+        """
+        Queue a mutation for the writer thread.
+        Parameters:
+            kind (str): "add", "add_unique", "update", "delete" or "truncate".
+            items (List[Any], optional): The products, updates or IDs of the mutation.
+        Returns:
+            Future: Resolves to the backend's per-item results, or to the number of deleted products for "truncate".
+        """
+        if kind != "truncate" and kind not in COMMITTERS:
+            raise ValueError(f"Unknown mutation '{kind}'.")
+        future = Future()
+        self._ensure_writer()
+        self._pending.put((kind, list(items or []), future))
+        return future
+
+    def _ensure_writer(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+                    self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stop the writer thread once the mutations queued so far are committed.
+        Parameters:
+            Nothing
+        Returns:
+            Nothing
+        """
+        if self._thread is not None:
+            self._pending.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _collect(self) -> list:
+        # Block for the first mutation, then take whatever else arrives within the window.
+        # A None entry asks the writer to stop after this group.
+        group = [self._pending.get()]
+        deadline = time.monotonic() + self.window
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                group.append(self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait())
+            except queue.Empty:
+                return group
+
+    def _run(self) -> None:
+        while True:
+            group = self._collect()
+            stop = None in group
+            group = [mutation for mutation in group if mutation is not None]
+            start = 0
+            while start < len(group):
+                # A run of consecutive mutations of the same kind is committed as one.
+                kind = group[start][0]
+                end = start + 1
+                while end < len(group) and group[end][0] == kind and kind != "truncate":
+                    end += 1
+                self._commit(kind, group[start:end])
+                start = end
+            if stop:
+                return
+
+    def _commit(self, kind: str, run: list, futures: set = None) -> None:
+        if futures is None:
+            futures = {future for _, _, future in run if future.set_running_or_notify_cancel()}
+        try:
+            with self.backend.lock():
+                if kind == "truncate":
+                    items, results = [], [self.backend.truncate_db()]
+                else:
+                    items = [item for _, mutation_items, _ in run for item in mutation_items]
+                    try:
+                        results = getattr(self.backend, COMMITTERS[kind])(items)
+                    except Exception:
+                        if len(run) == 1:
+                            raise
+                        # Nothing of the run was written: it is committed again one mutation
+                        # at a time below, so that a bad item only fails its own submission.
+                        results = None
+                if results is not None and self.feed is not None:
+                    self.feed.publish(self._changes(kind, items, results))
+        except BaseException as e:
+            for _, _, future in run:
+                if future in futures:
+                    future.set_exception(e)
+            return
+        if results is None:
+            for mutation in run:
+                self._commit(kind, [mutation], futures)
+            return
+        offset = 0
+        for _, items, future in run:
+            size = len(items) if kind != "truncate" else 1
+            if future in futures:
+                future.set_result(results[offset:offset + size] if kind != "truncate" else results[0])
+            offset += size
+
+    def _changes(self, kind: str, items: List[Any], results: List[Any]) -> List[dict]:
+        # The change events of a committed run of mutations, in commit order.
+        if kind == "truncate":
+            return [{"op": "truncate", "count": results[0]}] if results[0] else []
+        if kind in ("add", "add_unique"):
+            return [{"op": "add", "id": new_id, "product": {"id": new_id, "name": product.name,
+                                                             "description": product.description,
+                                                             "price": product.price}}
+                    for product, new_id in zip(items, results) if new_id is not None]
+        if kind == "update":
+            events = []
+            # Several updates of a product in one run are published as its final state.
+            for id in dict.fromkeys(update.id for update, found in zip(items, results) if found):
+                product = self.backend.get_product_by_id(id)
+                if product is not None:
+                    events.append({"op": "update", "id": id, "product": product.dict()})
+            return events
+        return [{"op": "delete", "id": int(id)} for id, found in zip(items, results) if found]
@@ -0,0 +1,426 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+from src.schemas import Product, ProductUpdate
+from src.storage.html_table import EMPTY_TABLE, render_row
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak RSS is not reported.
+    resource = None
+
+# Usage: PYTHONPATH=. python test/benchmark.py [--sizes 1000 10000] [--repeat 20] [--backend html]
+#                                              [--output bench_results.json] [--compare baseline.json]
+#
+# Times every crud function and every API endpoint against synthetic catalogs of growing size.
+# Each size runs in a fresh process on its own copy of the catalog, so that caches and the
+# peak RSS of one size do not leak into the next. The API is called in-process through
+# FastAPI's TestClient, no server needs to be running.
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+ADJECTIVES = ["Cotton", "Denim", "Leather", "Wool", "Linen", "Silk", "Classic", "Vintage", "Slim", "Cozy"]
+NOUNS = ["Shirt", "Jeans", "Sneakers", "Dress", "Jacket", "Shorts", "Sweater", "Skirt", "Blouse", "Coat"]
+
+# Streamed lists, by the endpoint building the same list in one response without the body cache, and
+# the largest accepted ratio between their p50 latencies: streaming bounds memory and must not cost much more.
+STREAMED = {"POST /product/all?stream=ndjson": "POST /product/all (uncached)",
+            "GET /product/all/sorted?stream=ndjson": "GET /product/all/sorted (uncached)"}
+STREAM_MAX_RATIO = 2.0
+
+# Above this size, write_html_db is not timed: it needs a BeautifulSoup tree of the whole file.
+SOUP_MAX_SIZE = 100000
+
+
+def generate_catalog(path: str, size: int, seed: int = 0) -> None:
+    """
+    Write a synthetic catalog directly in the index.html format.
+    Parameters:
+        path (str): The path of the database file to create.
+        size (int): The number of products, with IDs 1 to size.
+        seed (int, optional): The seed of the random names and prices, so that runs are comparable.
+    Returns:
+        Nothing
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        f.write(EMPTY_TABLE[:-len("</table>")])
+        for id in range(1, size + 1):
+            adjective, noun = rng.choice(ADJECTIVES), rng.choice(NOUNS)
+            f.write(render_row(Product(id=id, name=f"{adjective} {noun} {id}",
+                                       description=f"A {adjective.lower()} {noun.lower()} for every day",
+                                       price=round(rng.uniform(1, 500), 2))))
+        f.write("</table>")
+
+
+def summarize(latencies: List[float], errors: int = 0) -> Dict[str, float]:
+    """
+    Summarize the latencies of the runs of an operation.
+    Parameters:
+        latencies (List[float]): The duration of each run, in seconds.
+        errors (int, optional): The number of runs that failed.
+    Returns:
+        Dict[str, float]: The number of runs, the p50/p95/p99 and mean latencies in milliseconds,
+        the throughput in operations per second and the number of errors.
+    """
+    ordered = sorted(latencies)
+
+    def percentile(q: float) -> float:
+        # Nearest-rank percentile.
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)] * 1000
+
+    total = sum(ordered)
+    return {
+        "runs": len(ordered),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "mean_ms": total / len(ordered) * 1000,
+        "ops_per_s": len(ordered) / total if total else float("inf"),
+        "errors": errors,
+    }
+
+
+def measure(fn: Callable, repeat: int, setup: Callable[[int], tuple] = None,
+            failed: Callable[[object], bool] = None) -> Dict[str, float]:
+    """
+    Time the runs of an operation.
+    Parameters:
+        fn (Callable): The operation.
+        repeat (int): The number of runs.
+        setup (Callable[[int], tuple], optional): Builds the arguments of each run from its number, untimed.
+        failed (Callable[[object], bool], optional): Tells from the result of a run whether it failed.
+    Returns:
+        Dict[str, float]: The summary of the runs.
+    """
+    latencies, errors = [], 0
+    for i in range(repeat):
+        args = setup(i) if setup else ()
+        start = time.perf_counter()
+        result = fn(*args)
+        latencies.append(time.perf_counter() - start)
+        if failed is not None and failed(result):
+            errors += 1
+    return summarize(latencies, errors)
+
+
+def new_products(count: int, tag: str) -> List[Product]:
+    # Products that do not exist in the catalog yet, so that duplicate checks let them through.
+    return [Product(name=f"Benchmark {tag} {i}", description="Added by the benchmark", price=10.0 + i)
+            for i in range(count)]
+
+
+def bench_crud(size: int, repeat: int, cold_repeat: int, rng: random.Random) -> Dict[str, Dict[str, float]]:
+    """
+    Time every function of src.crud against the current catalog, which is left with the same products.
+    Parameters:
+        size (int): The number of products of the catalog.
+        repeat (int): The number of runs of each function.
+        cold_repeat (int): The number of full loads of the catalog into a fresh cache.
+        rng (random.Random): Picks the products to read and update.
+    Returns:
+        Dict[str, Dict[str, float]]: The summary of each function.
+    """
+    from bs4 import BeautifulSoup
+    from src import config, crud
+    from src.storage import create_backend
+
+    def random_id(i: int = 0) -> tuple:
+        return (rng.randint(1, size),)
+
+    def reset() -> tuple:
+        crud.set_backend(create_backend(config.DB_BACKEND))
+        return ()
+
+    results = {"read_products (cold)": measure(crud.read_products, cold_repeat, lambda i: reset())}
+    products = crud.read_products()
+    results.update({
+        "read_products": measure(crud.read_products, repeat),
+        "iter_products": measure(lambda: sum(1 for _ in crud.iter_products()), repeat),
+        "get_product_by_id": measure(crud.get_product_by_id, repeat, random_id),
+        "read_products_page": measure(lambda after: crud.read_products_page(100, after), repeat, random_id),
+        "sort_products_by_price": measure(crud.sort_products_by_price, repeat),
+        "iter_products_by_price": measure(lambda: sum(1 for _ in crud.iter_products_by_price()), repeat),
+        "sort_products_page": measure(lambda: crud.sort_products_page(100, None, False), repeat),
+        "range_products_by_price": measure(lambda: crud.range_products_by_price(100.0, 200.0, 100), repeat),
+        "top_products_by_price": measure(lambda: crud.top_products_by_price(10), repeat),
+        "price_histogram": measure(lambda: crud.price_histogram(20), repeat),
+        "search_products": measure(lambda: crud.search_products("cotton sh"), repeat),
+        "find_duplicate": measure(lambda id: crud.find_duplicate(products[id - 1]), repeat, random_id),
+        "catalog_version": measure(crud.catalog_version, repeat),
+        "product_version": measure(crud.product_version, repeat, random_id),
+        "generate_id": measure(lambda: crud.generate_id(products), repeat),
+        "read_html_db": measure(crud.read_html_db, repeat),
+    })
+    if size <= SOUP_MAX_SIZE and config.DB_BACKEND == "html":
+        soup = BeautifulSoup(crud.read_html_db(), "html.parser")
+        results["write_html_db"] = measure(lambda: crud.write_html_db(soup), repeat)
+    del products
+
+    added = []
+    results["write_product"] = measure(lambda product: added.append(crud.write_product(product)), repeat,
+                                       lambda i: (new_products(1, f"single {i}")[0],))
+    results["write_products"] = measure(lambda batch: added.extend(crud.write_products(batch)), repeat,
+                                        lambda i: (new_products(10, f"batch {i}"),))
+    results["write_unique_products"] = measure(lambda batch: added.extend(crud.write_unique_products(batch)), repeat,
+                                               lambda i: (new_products(10, f"unique {i}"),))
+    results["uptodate_product"] = measure(lambda id: crud.uptodate_product(id, price=rng.uniform(1, 500)),
+                                          repeat, random_id)
+    results["uptodate_products"] = measure(
+        crud.uptodate_products, repeat,
+        lambda i: ([ProductUpdate(id=rng.randint(1, size), price=rng.uniform(1, 500)) for _ in range(10)],))
+    results["delete_product"] = measure(crud.delete_product, repeat, lambda i: (added.pop(),))
+    results["delete_products"] = measure(crud.delete_products, repeat,
+                                         lambda i: ([added.pop() for _ in range(min(10, len(added)))],))
+    crud.delete_products(added)
+    return results
+
+
+def bench_api(size: int, repeat: int, rng: random.Random) -> Dict[str, Dict[str, float]]:
+    """
+    Time every endpoint of apis.app against the current catalog, in-process through TestClient.
+    Parameters:
+        size (int): The number of products of the catalog.
+        repeat (int): The number of calls of each endpoint.
+        rng (random.Random): Picks the products to read and update.
+    Returns:
+        Dict[str, Dict[str, float]]: The summary of each endpoint, keyed by method and route.
+        A call answered with a 4xx or 5xx status counts as an error.
+    """
+    from fastapi.testclient import TestClient
+    from apis import app
+    from src import crud
+
+    def failed(response) -> bool:
+        return response.status_code >= 400
+
+    def random_id(i: int = 0) -> tuple:
+        return (rng.randint(1, size),)
+
+    results = {}
+    with TestClient(app) as client:
+        def call(name: str, method: str, url: str, setup: Callable[[int], tuple] = None, **kwargs) -> None:
+            # url is formatted with the arguments built by setup; kwargs are passed to the request.
+            def request(*args):
+                options = {key: value(*args) if callable(value) else value for key, value in kwargs.items()}
+                return client.request(method, url.format(*args), **options)
+            results[name] = measure(request, repeat, setup, failed)
+
+        etag = client.get("/product/1").headers.get("ETag", "")
+        call("GET /", "GET", "/")
+        call("GET /product/{product_id}", "GET", "/product/{}", random_id)
+        call("GET /product/{product_id} (304)", "GET", "/product/1", headers={"If-None-Match": etag})
+        call("GET /product/search", "GET", "/product/search", params={"q": "cotton sh"})
+        call("POST /product/all", "POST", "/product/all")
+        # A query parameter the endpoint ignores keys a new body cache entry, so that every run builds the body.
+        call("POST /product/all (uncached)", "POST", "/product/all", lambda i: (i,), params=lambda i: {"run": i})
+        call("POST /product/all?stream=ndjson", "POST", "/product/all", params={"stream": "ndjson"})
+        call("POST /product/all?limit=100", "POST", "/product/all", random_id,
+             params=lambda after: {"limit": 100, "cursor": after})
+        call("GET /product/all/sorted", "GET", "/product/all/sorted")
+        call("GET /product/all/sorted (uncached)", "GET", "/product/all/sorted", lambda i: (i,),
+             params=lambda i: {"run": i})
+        call("GET /product/all/sorted?stream=ndjson", "GET", "/product/all/sorted", params={"stream": "ndjson"})
+        call("GET /product/all/sorted?limit=100", "GET", "/product/all/sorted", params={"limit": 100, "order": "asc"})
+        call("GET /product/price/range", "GET", "/product/price/range", params={"min": 100, "max": 200})
+        call("GET /product/price/top", "GET", "/product/price/top", params={"k": 10})
+        call("GET /product/price/histogram", "GET", "/product/price/histogram", params={"buckets": 20})
+        call("POST /product/add", "POST", "/product/add", lambda i: (i,),
+             json=lambda i: new_products(1, f"api {i}")[0].dict(exclude={"id"}))
+        call("PUT /product/update/{product_id}", "PUT", "/product/update/{}", random_id,
+             json=lambda id: {"name": f"Updated {id}", "description": "Updated by the benchmark", "price": 42.0})
+        call("POST /product/bulk", "POST", "/product/bulk", lambda i: (i,),
+             json=lambda i: [p.dict(exclude={"id"}) for p in new_products(10, f"api bulk {i}")])
+        call("PUT /product/bulk", "PUT", "/product/bulk", random_id,
+             json=lambda id: [{"id": id, "price": 43.0}])
+        added = [p.id for p in crud.read_products()[size:]]
+        call("DELETE /product/remove/{product_id}", "DELETE", "/product/remove/{}", lambda i: (added.pop(),))
+        call("DELETE /product/bulk", "DELETE", "/product/bulk", lambda i: ([added.pop() for _ in range(10)],),
+             json=lambda ids: ids)
+        crud.delete_products(added)
+        # Last, since it empties the catalog.
+        results["DELETE /product/flush"] = measure(lambda: client.delete("/product/flush"), 1, failed=failed)
+    return results
+
+
+def peak_rss_mb() -> Optional[float]:
+    # The peak resident set size of this process.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_size(size: int, options: dict) -> dict:
+    """
+    Benchmark one catalog size, in a temporary copy of the database.
+    Parameters:
+        size (int): The number of products of the catalog.
+        options (dict): The command line options.
+    Returns:
+        dict: The size, the catalog generation time and file size, the summaries of the crud
+        functions and of the endpoints, and the peak RSS of the run.
+    """
+    from src import config
+    tmp_dir = tempfile.mkdtemp(prefix="emperia-bench-")
+    try:
+        config.DB_PATH = os.path.join(tmp_dir, "index.html")
+        config.SQLITE_PATH = os.path.join(tmp_dir, "catalog.db")
+        config.DB_BACKEND = options["backend"]
+        start = time.perf_counter()
+        generate_catalog(config.DB_PATH, size, options["seed"])
+        file_bytes = os.path.getsize(config.DB_PATH)
+        if config.DB_BACKEND == "sqlite":
+            from src.storage.sqlite import import_html
+            import_html(config.DB_PATH, config.SQLITE_PATH)
+        generated = time.perf_counter() - start
+        rng = random.Random(options["seed"])
+        # The crud functions print their outcome, which would flood the report.
+        with contextlib.redirect_stdout(io.StringIO()):
+            crud_results = bench_crud(size, options["repeat"], options["cold_repeat"], rng)
+            api_results = bench_api(size, options["repeat"], rng)
+        return {
+            "size": size,
+            "generate_s": generated,
+            "file_bytes": file_bytes,
+            "crud": crud_results,
+            "api": api_results,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def compare(results: dict, baseline: dict, threshold: float, floor_ms: float = 0.0) -> List[str]:
+    """
+    Find the operations whose median latency grew beyond a threshold since a baseline run.
+    Parameters:
+        results (dict): The current results.
+        baseline (dict): The results of the baseline run, as saved by this module.
+        threshold (float): The largest accepted ratio between the current and the baseline p50.
+        floor_ms (float, optional): Operations whose current p50 is below this many milliseconds are
+            too fast for their ratio to be meaningful, and are never reported.
+    Returns:
+        List[str]: A description of each regression.
+    """
+    regressions = []
+    previous = {run["size"]: run for run in baseline["results"]}
+    for run in results["results"]:
+        if run["size"] not in previous:
+            continue
+        for kind in ("crud", "api"):
+            for name, summary in run[kind].items():
+                old = previous[run["size"]][kind].get(name)
+                if not old or old["p50_ms"] <= 0 or summary["p50_ms"] < floor_ms:
+                    continue
+                if summary["p50_ms"] / old["p50_ms"] > threshold:
+                    regressions.append(f"{run['size']:>8} {kind:<4} {name}: p50 {old['p50_ms']:.3f} ms "
+                                       f"-> {summary['p50_ms']:.3f} ms (x{summary['p50_ms'] / old['p50_ms']:.2f})")
+    return regressions
+
+
+def slow_streams(results: dict, ratio: float = STREAM_MAX_RATIO) -> List[str]:
+    """
+    Find the streamed lists that are much slower than the same lists built in one response.
+    Parameters:
+        results (dict): The results of a run.
+        ratio (float, optional): The largest accepted ratio between the streamed and the unstreamed p50.
+    Returns:
+        List[str]: A description of each slow stream.
+    """
+    slow = []
+    for run in results["results"]:
+        for streamed, whole in STREAMED.items():
+            stream, single = run["api"].get(streamed), run["api"].get(whole)
+            if stream and single and single["p50_ms"] > 0 and stream["p50_ms"] / single["p50_ms"] > ratio:
+                slow.append(f"{run['size']:>8} {streamed}: p50 {stream['p50_ms']:.3f} ms against "
+                            f"{single['p50_ms']:.3f} ms unstreamed (x{stream['p50_ms'] / single['p50_ms']:.2f})")
+    return slow
+
+
+def print_run(run: dict) -> None:
+    print(f"\n== {run['size']} products ({run['file_bytes'] / 1e6:.1f} MB, generated in {run['generate_s']:.1f} s, "
+          f"peak RSS {run['peak_rss_mb'] or 0:.0f} MB)")
+    print(f"{'operation':<44}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'errors':>8}")
+    for kind in ("crud", "api"):
+        for name, summary in run[kind].items():
+            print(f"{name:<44}{summary['p50_ms']:>10.3f}{summary['p95_ms']:>10.3f}{summary['p99_ms']:>10.3f}"
+                  f"{summary['ops_per_s']:>12.1f}{summary['errors']:>8}")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: List[str] = None) -> int:
+    from src.storage import BACKENDS
+    parser = argparse.ArgumentParser(description="Benchmark the crud functions and the API endpoints.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="catalog sizes to run")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of each operation")
+    parser.add_argument("--cold-repeat", type=int, default=3, help="full loads of the catalog into a fresh cache")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="html", help="storage backend")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic catalogs")
+    parser.add_argument("--output", default="bench_results.json", help="file the results are saved to")
+    parser.add_argument("--compare", help="results of a previous run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="largest accepted p50 ratio against the --compare run")
+    parser.add_argument("--floor-ms", type=float, default=0.1,
+                        help="p50 below which an operation is not checked against the --compare run")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            **{key: value for key, value in vars(args).items() if key in ("sizes", "repeat", "cold_repeat", "backend", "seed")},
+        },
+        "results": [],
+    }
+    for size in sorted(args.sizes):
+        # A fresh interpreter for each size, so that the peak RSS is that of the size alone.
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            run = pool.submit(run_size, size, vars(args)).result()
+        print_run(run)
+        results["results"].append(run)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    slow = slow_streams(results)
+    print(f"\n{len(slow)} streamed list(s) slower than x{STREAM_MAX_RATIO} the unstreamed one")
+    for stream in slow:
+        print("  " + stream)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.floor_ms)
+        print(f"\n{len(regressions)} regression(s) against {args.compare}")
+        for regression in regressions:
+            print("  " + regression)
+        return 1 if regressions or slow else 0
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+import httpx
+from benchmark import generate_catalog, summarize
+
+# Usage: PYTHONPATH=. python test/load_generator.py [--size 10000] [--concurrency 32 | --rate 500]
+#                                                   [--duration 10] [--mix add=10,get=50,...] [--workers 1]
+#                                                   [--url http://127.0.0.1:8000] [--output load_results.json]
+#
+# Drives the API with a mix of concurrent requests over pooled keep-alive connections and reports
+# the throughput, the latency percentiles and the status codes of each kind of request. Without
+# --url, a server is started with run.py on a fresh synthetic catalog of --size products.
+#
+# Once the load stops, the writes are checked through the change feed and the final catalog:
+# an add given an ID that another live product already had, or an ID listed twice in the catalog,
+# is an ID collision; an acknowledged add missing from the feed, or a catalog that differs from
+# the replay of the feed, is a lost write.
+
+DEFAULT_MIX = {"add": 10, "get": 50, "list": 2, "sorted": 3, "update": 25, "delete": 10}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    """
+    Parse a traffic mix such as "add=10,get=50".
+    Parameters:
+        text (str): Comma-separated operation=weight pairs.
+    Returns:
+        Dict[str, int]: The weight of each operation.
+    Raises:
+        argparse.ArgumentTypeError: If an operation is unknown or a weight is not a positive integer.
+    """
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"expected operation=weight with an operation of {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("at least one weight must be positive")
+    return mix
+
+
+class LoadGenerator:
+    """
+    Sends the requests of a traffic mix and records their outcome.
+    Targets of gets, updates and deletes are drawn from the IDs known to exist, which deletes remove,
+    so 404s only come from requests racing with a delete of the same product and are counted as such.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, int], ids: List[int], seed: int):
+        self.client = client
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.rng = random.Random(seed)
+        self.live = ids
+        self.tag = f"{os.getpid()}-{seed}"
+        self.added = 0
+        # The names of the products whose add was acknowledged.
+        self.acknowledged: Set[str] = set()
+        self.latencies: Dict[str, List[float]] = {name: [] for name in self.operations}
+        self.statuses: Dict[str, Counter] = {name: Counter() for name in self.operations}
+
+    def _target(self) -> Optional[int]:
+        return self.rng.choice(self.live) if self.live else None
+
+    async def _request(self, operation: str) -> Tuple[int, Optional[object]]:
+        # Send one request of the operation. Returns its status code and what to do once it succeeded.
+        if operation == "add":
+            self.added += 1
+            name = f"Load {self.tag} {self.added}"
+            response = await self.client.post("/product/add", json={
+                "name": name, "description": "Added by the load generator", "price": round(self.rng.uniform(1, 500), 2)})
+            return response.status_code, name
+        id = self._target()
+        if id is None:
+            operation = "list"
+        if operation == "get":
+            response = await self.client.get(f"/product/{id}")
+        elif operation == "list":
+            response = await self.client.post("/product/all")
+        elif operation == "sorted":
+            response = await self.client.get("/product/all/sorted", params={"limit": 50})
+        elif operation == "update":
+            response = await self.client.put(f"/product/update/{id}", json={
+                "name": f"Updated {id}", "description": "Updated by the load generator",
+                "price": round(self.rng.uniform(1, 500), 2)})
+        else:
+            # Taken out of the targets first, so that concurrent requests do not pick it.
+            self.live.remove(id)
+            response = await self.client.delete(f"/product/remove/{id}")
+        return response.status_code, id
+
+    async def run_one(self, scheduled: float = None) -> None:
+        """
+        Send one request, chosen by the weights of the mix, and record its latency and status.
+        Parameters:
+            scheduled (float, optional): The time the request was due to start, when sending at a fixed
+                rate, so that time spent waiting for a free connection counts in its latency.
+        Returns:
+            Nothing
+        """
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        start = time.perf_counter() if scheduled is None else scheduled
+        try:
+            status, subject = await self._request(operation)
+        except httpx.HTTPError as e:
+            status, subject = type(e).__name__, None
+        self.latencies[operation].append(time.perf_counter() - start)
+        self.statuses[operation][status] += 1
+        if status == 200 and operation == "add":
+            self.acknowledged.add(subject)
+
+    def report(self, elapsed: float) -> dict:
+        """
+        Summarize the requests sent so far.
+        Parameters:
+            elapsed (float): The duration of the load, in seconds.
+        Returns:
+            dict: Per operation, the latency summary and the count of each status; overall, the
+            number of requests, the throughput and the number of errors, conflicts and overloads.
+        """
+        operations = {}
+        for name in self.operations:
+            if not self.latencies[name]:
+                continue
+            statuses = self.statuses[name]
+            errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 500)
+            summary = summarize(self.latencies[name], errors)
+            summary["ops_per_s"] = len(self.latencies[name]) / elapsed
+            summary["statuses"] = {str(status): count for status, count in sorted(statuses.items(), key=str)}
+            operations[name] = summary
+        totals = Counter()
+        for statuses in self.statuses.values():
+            totals.update(statuses)
+        requests = sum(totals.values())
+        return {
+            "requests": requests,
+            "elapsed_s": elapsed,
+            "requests_per_s": requests / elapsed if elapsed else 0.0,
+            "errors": sum(count for status, count in totals.items() if not isinstance(status, int) or status >= 500),
+            "overloaded": totals[503],
+            "conflicts": totals[409],
+            "not_found": totals[404],
+            "operations": operations,
+        }
+
+
+async def closed_loop(generator: LoadGenerator, concurrency: int, duration: float) -> None:
+    # `concurrency` clients, each sending its next request as soon as the previous one is answered.
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await generator.run_one()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+
+
+async def open_loop(generator: LoadGenerator, rate: float, concurrency: int, duration: float) -> None:
+    # Requests started at a fixed rate whatever the response times, with at most `concurrency` in flight.
+    slots = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    tasks = []
+
+    async def send(scheduled: float):
+        async with slots:
+            await generator.run_one(scheduled)
+
+    for i in range(int(rate * duration)):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(scheduled)))
+    await asyncio.gather(*tasks)
+
+
+async def read_feed(client: httpx.AsyncClient, after: int) -> Optional[List[dict]]:
+    """
+    Read every change published after a sequence number.
+    Parameters:
+        client (httpx.AsyncClient): The client of the server.
+        after (int): The sequence number to read after.
+    Returns:
+        List[dict]: The events, or None if some were already dropped from the feed.
+    """
+    events = []
+    while True:
+        response = await client.get("/product/changes", params={"after": after, "limit": 1000})
+        if response.status_code == 410:
+            return None
+        page = response.json()["events"]
+        if not page:
+            return events
+        events.extend(page)
+        after = page[-1]["seq"]
+
+
+async def catalog_ids(client: httpx.AsyncClient) -> List[int]:
+    response = await client.post("/product/all")
+    return [product["id"] for product in response.json()] if response.status_code == 200 else []
+
+
+def check_writes(initial: List[int], events: Optional[List[dict]], final: List[int],
+                 acknowledged: Set[str]) -> dict:
+    """
+    Check the writes made during the load for ID collisions and lost writes.
+    Parameters:
+        initial (List[int]): The IDs of the catalog before the load.
+        events (List[dict]): The changes published during the load, or None if the feed dropped some.
+        final (List[int]): The IDs of the catalog after the load.
+        acknowledged (Set[str]): The names of the products whose add was acknowledged.
+    Returns:
+        dict: The number of ID collisions and lost writes, and whether the change feed could be checked.
+    """
+    collisions = sum(count - 1 for count in Counter(final).values())
+    result = {"id_collisions": collisions, "lost_writes": 0, "feed_checked": events is not None}
+    if events is None:
+        return result
+    live = set(initial)
+    published = set()
+    for event in events:
+        if event["op"] == "add":
+            if event["id"] in live:
+                result["id_collisions"] += 1
+            live.add(event["id"])
+            published.add(event["product"]["name"])
+        elif event["op"] == "delete":
+            live.discard(event["id"])
+        elif event["op"] == "truncate":
+            live.clear()
+    result["lost_writes"] = len(acknowledged - published) + len(live.symmetric_difference(final))
+    return result
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(directory: str, port: int, workers: int, backend: str) -> subprocess.Popen:
+    """
+    Start run.py in a directory holding the catalog, and wait until it answers.
+    Parameters:
+        directory (str): The working directory of the server, where its index.html (and catalog.db) is.
+        port (int): The port to bind.
+        workers (int): The number of server processes.
+        backend (str): The storage backend.
+    Returns:
+        subprocess.Popen: The server process.
+    Raises:
+        RuntimeError: If the server does not answer within 30 seconds.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT, EMPERIA_SQLITE_PATH=os.path.join(directory, "catalog.db"))
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "run.py"), "--host", "127.0.0.1",
+                               "--port", str(port), "--workers", str(workers), "--backend", backend],
+                              cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The server did not start.")
+
+
+async def run_load(url: str, options: argparse.Namespace) -> dict:
+    """
+    Apply the load to a server and check its writes.
+    Parameters:
+        url (str): The base URL of the server.
+        options (argparse.Namespace): The command line options.
+    Returns:
+        dict: The report of the load and of the checks.
+    """
+    limits = httpx.Limits(max_connections=options.concurrency, max_keepalive_connections=options.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=options.timeout) as client:
+        start_seq = (await client.get("/product/changes")).json()["last_seq"]
+        initial = await catalog_ids(client)
+        generator = LoadGenerator(client, options.mix, list(initial), options.seed)
+        start = time.perf_counter()
+        if options.rate:
+            await open_loop(generator, options.rate, options.concurrency, options.duration)
+        else:
+            await closed_loop(generator, options.concurrency, options.duration)
+        report = generator.report(time.perf_counter() - start)
+        events = await read_feed(client, start_seq)
+        report.update(check_writes(initial, events, await catalog_ids(client), generator.acknowledged))
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['requests']} requests in {report['elapsed_s']:.1f}s: {report['requests_per_s']:.0f} req/s, "
+          f"{report['errors']} errors, {report['overloaded']} overloaded (503), {report['conflicts']} conflicts (409), "
+          f"{report['not_found']} not found (404)")
+    print(f"  {'operation':<8} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for name, summary in report["operations"].items():
+        statuses = " ".join(f"{status}:{count}" for status, count in summary["statuses"].items())
+        print(f"  {name:<8} {summary['runs']:>7} {summary['ops_per_s']:>8.1f} {summary['p50_ms']:>8.2f} "
+              f"{summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f}  {statuses}")
+    feed = "" if report["feed_checked"] else " (change feed not checked: events were dropped)"
+    print(f"ID collisions: {report['id_collisions']}, lost writes: {report['lost_writes']}{feed}")
+
+
+def main(argv: List[str] = None) -> int:
+    from src.storage import BACKENDS
+    parser = argparse.ArgumentParser(description="Apply a concurrent mix of requests to the API.")
+    parser.add_argument("--url", help="server to load, by default one is started on a synthetic catalog")
+    parser.add_argument("--size", type=int, default=10000, help="products of the synthetic catalog")
+    parser.add_argument("--workers", type=int, default=1, help="processes of the started server")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="html", help="backend of the started server")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight, and pooled connections")
+    parser.add_argument("--rate", type=float, help="requests started per second, instead of a closed loop")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="weights of the operations, e.g. add=10,get=50,list=2,sorted=3,update=25,delete=10")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a request fails")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the catalog and of the traffic")
+    parser.add_argument("--output", help="file the report is saved to, as JSON")
+    args = parser.parse_args(argv)
+
+    tmp_dir = server = None
+    url = args.url
+    try:
+        if url is None:
+            tmp_dir = tempfile.mkdtemp(prefix="emperia-load-")
+            generate_catalog(os.path.join(tmp_dir, "index.html"), args.size, args.seed)
+            if args.backend == "sqlite":
+                from src.storage.sqlite import import_html
+                import_html(os.path.join(tmp_dir, "index.html"), os.path.join(tmp_dir, "catalog.db"))
+            port = free_port()
+            server = start_server(tmp_dir, port, args.workers, args.backend)
+            url = f"http://127.0.0.1:{port}"
+        report = asyncio.run(run_load(url, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"options": {key: value for key, value in vars(args).items()}, "report": report}, f, indent=2)
+    return 1 if report["id_collisions"] or report["lost_writes"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
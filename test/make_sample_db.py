@@ -74,9 +74,15 @@ def add_product_db(data):
     return response
 
 
+def add_products_db(data):
+    url = "http://127.0.0.1:8000" + "/product/bulk"
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    response = requests.post(url, headers=headers, data=json.dumps(data))
+    return response
+
+
 if __name__ == '__main__':
     check_db()
-    # Add each product in the sample data to the database
-    for product in sample_products:
-        add_product_db(product)
+    # Add all the products in the sample data to the database in one request
+    add_products_db(sample_products)
     print("Data added successfully")
@@ -2,26 +2,24 @@ import requests
 import json
 import unittest
 from src.crud import (
-    read_html_db,
-    DB_PATH,
     truncate_db
 )
 BASE_URL = "http://127.0.0.1:8000"
 
 
 class TestAPI(unittest.TestCase):
-    db_content = 0
+    snapshot = None
 
     def setUp(self):
-        # This method is called before each test method, it reads the contents of the database
-        # into memory and clears the database for testing purposes
-        self.db_content = read_html_db()
+        # This method is called before each test method, it saves a snapshot of the database
+        # through the server and clears the database for testing purposes
+        self.snapshot = requests.post(BASE_URL + "/admin/snapshots").json()["name"]
         truncate_db()
 
     def tearDown(self):
-        # This method is called after each test method, it writes the original contents of the database back to the file
-        with open(DB_PATH, "w") as f:
-            f.write(self.db_content)
+        # This method is called after each test method, it restores the snapshot of the original database
+        requests.post(BASE_URL + "/admin/snapshots/%s/restore" % self.snapshot)
+        requests.delete(BASE_URL + "/admin/snapshots/%s" % self.snapshot)
 
     def test_home(self):
         # Test the home route of the API
@@ -31,6 +29,12 @@ class TestAPI(unittest.TestCase):
         assert response.status_code == 200
         assert response.json() == {"message": "Welcome to Emperia."}
 
+    def test_ready(self):
+        # Test that the server reports ready once its catalog is loaded
+        response = requests.get(BASE_URL + "/ready")
+        assert response.status_code == 200
+        assert response.json() == {"ready": True}
+
     def test_add_product(self):
         # Test adding a new product to the database
         url = BASE_URL + "/product/add"
@@ -40,6 +44,14 @@ class TestAPI(unittest.TestCase):
         assert response.status_code == 200
         assert response.json() == {"message": "Product added successfully."}
 
+    def test_add_duplicate_product(self):
+        # Test that adding a product with the same name, description and price again is rejected
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        data = {"name": "New Product", "description": "A new product", "price": 10.0}
+        assert requests.post(BASE_URL + "/product/add", headers=headers, data=json.dumps(data)).status_code == 200
+        response = requests.post(BASE_URL + "/product/add", headers=headers, data=json.dumps(dict(data, id=7)))
+        assert response.status_code == 409
+
     def test_product(self):
         # Test getting a single product from the database
         requests.post(BASE_URL + "/product/add", headers={"Content-Type": "application/json", "Accept": "application/json"}, data=json.dumps({"name": "New Product", "description": "A new product", "price": 10.0}))
@@ -56,6 +68,124 @@ class TestAPI(unittest.TestCase):
         response = requests.post(url, headers=headers)
         assert response.status_code == 200
 
+    def test_stream_all_products(self):
+        # Test streaming all products as a JSON array and as NDJSON
+        for name in ("First", "Second"):
+            requests.post(BASE_URL + "/product/add", headers={"Content-Type": "application/json", "Accept": "application/json"}, data=json.dumps({"name": name, "description": "A new product", "price": 10.0}))
+        response = requests.post(BASE_URL + "/product/all?stream=json", stream=True)
+        assert response.status_code == 200
+        assert [p["name"] for p in response.json()] == ["First", "Second"]
+        response = requests.get(BASE_URL + "/product/all/sorted?stream=ndjson", stream=True)
+        assert response.status_code == 200
+        assert [json.loads(line)["name"] for line in response.iter_lines()] == ["First", "Second"]
+
+    def test_paginate_sorted_products(self):
+        # Test walking the sorted products page by page with the cursor header
+        for price in (5.0, 15.0, 10.0):
+            requests.post(BASE_URL + "/product/add", headers={"Content-Type": "application/json", "Accept": "application/json"}, data=json.dumps({"name": "Product %s" % price, "description": "A new product", "price": price}))
+        response = requests.get(BASE_URL + "/product/all/sorted", params={"limit": 2, "order": "asc"})
+        assert response.status_code == 200
+        assert [p["price"] for p in response.json()] == [5.0, 10.0]
+        response = requests.get(BASE_URL + "/product/all/sorted", params={"limit": 2, "order": "asc", "cursor": response.headers["X-Next-Cursor"]})
+        assert [p["price"] for p in response.json()] == [15.0]
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_price_cursor_is_url_safe(self):
+        # Test that a cursor holding a price such as 1e+20 can be pasted into a query string unencoded
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        data = [{"name": "Product %s" % price, "description": "A new product", "price": price} for price in (1e20, 2e20)]
+        requests.post(BASE_URL + "/product/bulk", headers=headers, data=json.dumps(data))
+        response = requests.get(BASE_URL + "/product/all/sorted", params={"limit": 1, "order": "asc"})
+        cursor = response.headers["X-Next-Cursor"]
+        response = requests.get(BASE_URL + "/product/all/sorted?limit=1&order=asc&cursor=" + cursor)
+        assert [p["price"] for p in response.json()] == [2e20]
+        assert requests.get(BASE_URL + "/product/all/sorted", params={"limit": 1, "cursor": "1e+20:1"}).status_code == 400
+
+    def test_price_queries(self):
+        # Test the price range, top-k and histogram endpoints
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        data = [{"name": "Product %s" % price, "description": "A new product", "price": price} for price in (5.0, 15.0, 10.0, 20.0)]
+        requests.post(BASE_URL + "/product/bulk", headers=headers, data=json.dumps(data))
+        response = requests.get(BASE_URL + "/product/price/range", params={"min": 10, "max": 20, "limit": 2})
+        assert [p["price"] for p in response.json()] == [10.0, 15.0]
+        response = requests.get(BASE_URL + "/product/price/range", params={"min": 10, "max": 20, "limit": 2, "cursor": response.headers["X-Next-Cursor"]})
+        assert [p["price"] for p in response.json()] == [20.0]
+        assert requests.get(BASE_URL + "/product/price/range", params={"min": 30}).status_code == 404
+        assert requests.get(BASE_URL + "/product/price/range", params={"min": 20, "max": 10}).status_code == 400
+        response = requests.get(BASE_URL + "/product/price/top", params={"k": 2, "order": "asc"})
+        assert [p["price"] for p in response.json()] == [5.0, 10.0]
+        response = requests.get(BASE_URL + "/product/price/histogram", params={"buckets": 3})
+        assert [b["count"] for b in response.json()] == [1, 1, 2]
+        response = requests.get(BASE_URL + "/product/price/histogram", params={"edges": "0,10,100"})
+        assert response.json() == [{"min": 0.0, "max": 10.0, "count": 1}, {"min": 10.0, "max": 100.0, "count": 3}]
+
+    def test_product_stats(self):
+        # Test the catalog statistics endpoint and its verification mode
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        assert requests.get(BASE_URL + "/product/stats").json()["count"] == 0
+        data = [{"name": "Product %s" % price, "description": "A new product", "price": price} for price in (5.0, 15.0, 40.0)]
+        requests.post(BASE_URL + "/product/bulk", headers=headers, data=json.dumps(data))
+        response = requests.get(BASE_URL + "/product/stats")
+        stats = response.json()
+        assert (stats["count"], stats["min_price"], stats["max_price"], stats["avg_price"]) == (3, 5.0, 40.0, 20.0)
+        assert [b["count"] for b in stats["buckets"]][:4] == [1, 1, 1, 0]
+        assert requests.get(BASE_URL + "/product/stats", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+        response = requests.get(BASE_URL + "/product/stats", params={"verify": "true"})
+        assert response.json()["consistent"] is True
+        assert response.json()["recomputed"] == stats
+
+    def test_snapshots(self):
+        # Test saving, listing and restoring snapshots through the admin endpoints
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        requests.post(BASE_URL + "/product/add", headers=headers, data=json.dumps({"name": "Saved", "description": "Kept", "price": 10.0}))
+        response = requests.post(BASE_URL + "/admin/snapshots", params={"name": "test-saved"})
+        assert response.status_code == 201 and response.json()["count"] == 1
+        assert requests.post(BASE_URL + "/admin/snapshots", params={"name": "test-saved"}).status_code == 409
+        assert "test-saved" in [s["name"] for s in requests.get(BASE_URL + "/admin/snapshots").json()]
+        requests.post(BASE_URL + "/product/add", headers=headers, data=json.dumps({"name": "Lost", "description": "Dropped", "price": 5.0}))
+        after = requests.get(BASE_URL + "/product/changes").json()["last_seq"]
+        assert requests.post(BASE_URL + "/admin/snapshots/test-saved/restore").status_code == 200
+        assert [p["name"] for p in requests.post(BASE_URL + "/product/all").json()] == ["Saved"]
+        assert requests.get(BASE_URL + "/product/changes", params={"after": after}).json()["events"][0]["op"] == "restore"
+        assert requests.delete(BASE_URL + "/admin/snapshots/test-saved").status_code == 200
+        assert requests.post(BASE_URL + "/admin/snapshots/test-saved/restore").status_code == 404
+
+    def test_conditional_get(self):
+        # Test that unchanged products and lists are answered with 304 until they change
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        data = [{"name": "Product %s" % price, "description": "A new product", "price": price} for price in (5.0, 15.0)]
+        ids = [r["id"] for r in requests.post(BASE_URL + "/product/bulk", headers=headers, data=json.dumps(data)).json()]
+        product = requests.get(BASE_URL + "/product/%d" % ids[0])
+        products = requests.post(BASE_URL + "/product/all")
+        assert product.headers["ETag"] and products.headers["Last-Modified"]
+        response = requests.get(BASE_URL + "/product/%d" % ids[0], headers={"If-None-Match": product.headers["ETag"]})
+        assert response.status_code == 304
+        response = requests.post(BASE_URL + "/product/all", headers={"If-None-Match": products.headers["ETag"]})
+        assert response.status_code == 304
+        response = requests.post(BASE_URL + "/product/all", headers={"If-Modified-Since": products.headers["Last-Modified"]})
+        assert response.status_code == 304
+        requests.put(BASE_URL + "/product/update/%d" % ids[1], headers=headers, data=json.dumps({"name": "Updated", "description": "Updated", "price": 25.0}))
+        response = requests.post(BASE_URL + "/product/all", headers={"If-None-Match": products.headers["ETag"]})
+        assert response.status_code == 200
+        assert [p["name"] for p in response.json()] == ["Product 5.0", "Updated"]
+        response = requests.get(BASE_URL + "/product/%d" % ids[0], headers={"If-None-Match": product.headers["ETag"]})
+        assert response.status_code == 304
+        response = requests.get(BASE_URL + "/product/all/sorted", params={"limit": 1})
+        assert response.json()[0]["name"] == "Updated" and "X-Next-Cursor" in response.headers
+        cached = requests.get(BASE_URL + "/product/all/sorted", params={"limit": 1})
+        assert cached.content == response.content and cached.headers["X-Next-Cursor"] == response.headers["X-Next-Cursor"]
+
+    def test_search_products(self):
+        # Test searching the products by words of their name and description
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        data = [{"name": "Cotton Sweater", "description": "Soft and cozy", "price": 59.99},
+                {"name": "Coat", "description": "Warm cotton lining", "price": 89.99}]
+        requests.post(BASE_URL + "/product/bulk", headers=headers, data=json.dumps(data))
+        response = requests.get(BASE_URL + "/product/search", params={"q": "cott"})
+        assert response.status_code == 200
+        assert [p["name"] for p in response.json()] == ["Cotton Sweater", "Coat"]
+        assert requests.get(BASE_URL + "/product/search", params={"q": "jeans"}).status_code == 404
+
     def test_update_product(self):
         # Test updating a product in the database
         requests.post(BASE_URL + "/product/add", headers={"Content-Type": "application/json", "Accept": "application/json"}, data=json.dumps({"name": "New Product", "description": "A new product", "price": 10.0}))
@@ -65,6 +195,52 @@ class TestAPI(unittest.TestCase):
         response = requests.put(url, headers=headers, data=json.dumps(data))
         assert response.status_code == 200
         assert response.json() == {"message": "Product updated successfully."}
+        for price in (float("nan"), float("inf"), -1.0):
+            data = {"name": "Invalid Product", "description": "An invalid product", "price": price}
+            response = requests.put(url, headers=headers, data=json.dumps(data))
+            assert response.status_code == 422
+        response = requests.get(BASE_URL + "/product/1", headers=headers)
+        assert response.json()["price"] == 15.0
+
+    def test_bulk_products(self):
+        # Test adding, updating and removing several products in one request each
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        data = [{"name": "First", "description": "A new product", "price": 10.0},
+                {"name": "Invalid", "description": "A new product", "price": -1.0},
+                {"name": "Second", "description": "A new product", "price": 20.0},
+                {"name": "Not a number", "description": "A new product", "price": float("nan")}]
+        response = requests.post(BASE_URL + "/product/bulk", headers=headers, data=json.dumps(data))
+        assert response.status_code == 200
+        assert [(r["status"], r["id"]) for r in response.json()] == [(200, 1), (422, None), (200, 2), (422, None)]
+        data = [{"id": 2, "price": 25.0}, {"id": 5, "name": "Missing"}]
+        response = requests.put(BASE_URL + "/product/bulk", headers=headers, data=json.dumps(data))
+        assert [r["status"] for r in response.json()] == [200, 404]
+        response = requests.delete(BASE_URL + "/product/bulk", headers=headers, data=json.dumps([1, 5]))
+        assert [r["status"] for r in response.json()] == [200, 404]
+        response = requests.post(BASE_URL + "/product/all", headers=headers)
+        assert response.json() == [{"id": 2, "name": "Second", "description": "A new product", "price": 25.0}]
+
+    def test_change_feed(self):
+        # Test that writes are published to the change feed, readable by long-polling and as an event stream
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        last_seq = requests.get(BASE_URL + "/product/changes").json()["last_seq"]
+        requests.post(BASE_URL + "/product/add", headers=headers, data=json.dumps({"name": "New Product", "description": "A new product", "price": 10.0}))
+        requests.put(BASE_URL + "/product/update/1", headers=headers, data=json.dumps({"name": "Renamed", "description": "A new product", "price": 10.0}))
+        requests.delete(BASE_URL + "/product/remove/1", headers=headers)
+        response = requests.get(BASE_URL + "/product/changes", params={"after": last_seq})
+        assert response.status_code == 200
+        body = response.json()
+        assert [event["op"] for event in body["events"]] == ["add", "update", "delete"]
+        assert [event["seq"] for event in body["events"]] == [last_seq + 1, last_seq + 2, last_seq + 3]
+        assert body["events"][1]["product"]["name"] == "Renamed"
+        assert body["last_seq"] == last_seq + 3
+        response = requests.get(BASE_URL + "/product/changes", params={"after": last_seq + 3, "wait": 0.2})
+        assert response.json() == {"last_seq": last_seq + 3, "events": []}
+        response = requests.get(BASE_URL + "/product/changes", params={"stream": "sse", "wait": 0.2},
+                                headers={"Last-Event-ID": str(last_seq + 1)})
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert [line for line in response.text.splitlines() if line.startswith("id: ")] == \
+            [f"id: {last_seq + 2}", f"id: {last_seq + 3}"]
 
     def test_remove_product(self):
         # Test removing a product from the database
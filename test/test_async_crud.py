@@ -0,0 +1,169 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from fastapi.testclient import TestClient
+import apis
+from src import async_crud, config, executors
+from src.async_crud import Overloaded, RequestScope, run, single_flight
+from src.schemas import Product
+from src.storage import HTMLTableBackend
+from src.storage.html_table import load_products
+
+
+class TestAsyncCrud(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = config.CRUD_MAX_PENDING, config.PARSE_EXECUTOR, config.PARSE_WORKERS, config.WARMUP
+
+    def tearDown(self):
+        config.CRUD_MAX_PENDING, config.PARSE_EXECUTOR, config.PARSE_WORKERS, config.WARMUP = self.settings
+        executors.shutdown()
+
+    def test_run_offloads(self):
+        # Test that blocking calls run outside the event loop thread and return their result.
+        async def main():
+            return await run(lambda: os.getpid()), await run(sum, [1, 2, 3])
+        self.assertEqual(asyncio.run(main()), (os.getpid(), 6))
+
+    def test_admission_control(self):
+        # Test that operations beyond the pending limit are rejected instead of queued.
+        config.CRUD_MAX_PENDING = 2
+
+        async def main():
+            return await asyncio.gather(*(run(time.sleep, 0.05) for _ in range(3)), return_exceptions=True)
+        results = asyncio.run(main())
+        self.assertEqual(sum(isinstance(result, Overloaded) for result in results), 1)
+
+    def test_single_flight(self):
+        # Test that concurrent identical reads share one run, unless a write completed since it started.
+        calls = []
+
+        def read(key):
+            calls.append(key)
+            time.sleep(0.05)
+            return [key]
+
+        write = async_crud._mutation(lambda: None)
+
+        async def main():
+            shared = await asyncio.gather(*(single_flight(read, 1) for _ in range(5)), single_flight(read, 2))
+            first = asyncio.ensure_future(single_flight(read, 1))
+            await asyncio.sleep(0.01)
+            await write()
+            return shared, await single_flight(read, 1), await first
+        shared, after_write, before_write = asyncio.run(main())
+        self.assertEqual(shared, [[1]] * 5 + [[2]])
+        self.assertIs(shared[0], shared[4])
+        self.assertIsNot(after_write, before_write)
+        self.assertEqual(calls, [1, 2, 1, 1])
+
+    def test_request_scope(self):
+        # Test that a request reads the same data once until it writes, and that scopes are not shared.
+        calls = []
+        lock = threading.Lock()
+
+        def read(key):
+            with lock:
+                calls.append(key)
+            return key
+
+        cached, write = async_crud._memoized(read), async_crud._mutation(lambda: None)
+
+        async def handler(scope, receive, send):
+            self.assertEqual([await cached(1), await cached(1), await cached(2)], [1, 1, 2])
+            await write()
+            await cached(1)
+
+        async def main():
+            app = RequestScope(handler)
+            await app({"type": "http"}, None, None)
+            await app({"type": "http"}, None, None)
+        asyncio.run(main())
+        self.assertEqual(calls, [1, 2, 1] * 2)
+
+    def test_warm_up_readiness(self):
+        # Test that /ready answers 503 until the background warm-up succeeds, and that a failed attempt is retried.
+        attempts = []
+        loaded = threading.Event()
+
+        async def warm_up():
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise OSError("store unavailable")
+            while not loaded.is_set():
+                await asyncio.sleep(0.01)
+            return 3
+
+        def wait_for(condition):
+            deadline = time.monotonic() + 5
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(condition())
+
+        original, apis.warm_up = apis.warm_up, warm_up
+        config.WARMUP = True
+        try:
+            with TestClient(apis.app) as client:
+                wait_for(lambda: len(attempts) == 2)
+                response = client.get("/ready")
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.json(), {"ready": False, "detail": "OSError: store unavailable"})
+                self.assertEqual(response.headers["Retry-After"], "1")
+                loaded.set()
+                wait_for(lambda: client.get("/ready").status_code == 200)
+                self.assertEqual(client.get("/ready").json(), {"ready": True})
+        finally:
+            apis.warm_up = original
+            apis.warm_up_task = None
+
+    def test_warm_up_failure_is_not_ready(self):
+        # Test that /ready keeps answering 503 when the warm-up task was cancelled or died without retrying.
+        async def cancelled():
+            await asyncio.sleep(10)
+
+        class Crash(BaseException):
+            pass
+
+        async def crashed():
+            raise Crash("warm-up thread died")
+
+        original = apis.warm_up
+        config.WARMUP = True
+        try:
+            for warm_up, detail in ((cancelled, "The catalog load was cancelled."), (crashed, "Crash: warm-up thread died")):
+                with self.subTest(detail=detail):
+                    apis.warm_up = warm_up
+                    with TestClient(apis.app) as client:
+                        if warm_up is cancelled:
+                            client.portal.call(apis.stop_warm_up)
+                        deadline = time.monotonic() + 5
+                        while not apis.warm_up_task.done() and time.monotonic() < deadline:
+                            time.sleep(0.01)
+                        response = client.get("/ready")
+                        self.assertEqual(response.status_code, 503)
+                        self.assertEqual(response.json(), {"ready": False, "detail": detail})
+        finally:
+            apis.warm_up = original
+            apis.warm_up_task = None
+
+    def test_parse_in_process_pool(self):
+        # Test that parsing in the process pool gives the same products as parsing in the calling thread.
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            backend = HTMLTableBackend(os.path.join(tmp_dir, "index.html"))
+            backend.check()
+            backend.write_products([Product(name=f'P{i}', description='Pooled', price=i + 1.0) for i in range(50)])
+            expected = load_products(backend.path)
+            config.PARSE_EXECUTOR, config.PARSE_WORKERS = "process", 1
+            self.assertIsNotNone(executors.get_parse_pool())
+            self.assertEqual(load_products(backend.path), expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
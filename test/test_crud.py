@@ -3,29 +3,32 @@ from src.schemas import Product
 from src.config import check_db
 from src.crud import (
     DB_PATH,
-    read_html_db,
+    create_snapshot,
+    restore_snapshot,
+    delete_snapshot,
     write_product,
     read_products,
     uptodate_product,
     delete_product,
     get_product_by_id,
     sort_products_by_price,
-    truncate_db
+    truncate_db,
+    warm_up
 )
 
 
 class TestCRUDFunctions(unittest.TestCase):
-    db_content = 0
+    snapshot = None
 
     def setUp(self):
-        # Set up the test by reading the database and truncating it to an empty state.
-        self.db_content = read_html_db()
+        # Set up the test by saving a snapshot of the database and truncating it to an empty state.
+        self.snapshot = create_snapshot().name
         truncate_db()
 
     def tearDown(self):
-        # Tear down the test by writing the original database content back to the file.
-        with open(DB_PATH, "w") as f:
-            f.write(self.db_content)
+        # Tear down the test by restoring the snapshot of the original database.
+        restore_snapshot(self.snapshot)
+        delete_snapshot(self.snapshot)
 
     def test_write_and_read_products(self):
         # Test that a product can be written to the database and then read from it.
@@ -34,6 +37,11 @@ class TestCRUDFunctions(unittest.TestCase):
         products = read_products()
         self.assertIn(product, products)
 
+    def test_warm_up(self):
+        # Test that warming up loads the whole catalog.
+        write_product(Product(name='Warm', description='Loaded ahead of requests.', price=1.5))
+        self.assertEqual(warm_up(), len(read_products()))
+
     def test_get_product_by_id(self):
         # Test that a product can be retrieved from the database by its ID.
         product = Product(id=1, name='Test Product', description='This is a test product.', price=9.99)
@@ -71,6 +79,16 @@ class TestCRUDFunctions(unittest.TestCase):
         self.assertEqual(sorted_products[1].price, 9.99)
         self.assertEqual(sorted_products[2].price, 4.99)
 
+    def test_cache_sees_external_changes(self):
+        # Test that the cached catalog is refreshed when the database file is rewritten by someone else.
+        write_product(Product(name='Test Product', description='This is a test product.', price=9.99))
+        self.assertEqual(len(read_products()), 1)
+        with open(DB_PATH, "w") as f:
+            f.write("<table><tr><th>ID</th><th>Name</th><th>Description</th><th>Price</th></tr>"
+                    "<tr><td>7</td><td>Other</td><td>Written elsewhere.</td><td>1.5</td></tr></table>")
+        self.assertIsNone(get_product_by_id(1))
+        self.assertEqual(get_product_by_id(7).name, 'Other')
+
 
 if __name__ == '__main__':
     check_db()
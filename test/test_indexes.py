@@ -0,0 +1,112 @@
+import random
+import unittest
+from src.indexes import ContentIndex, IdIndex, PriceIndex, PriceStats
+from src.schemas import Product
+
+
+def make_products(count, seed=0):
+    rng = random.Random(seed)
+    # Few distinct prices, so that many products share a price.
+    return [Product(id=i, name=f'P{i}', description='Indexed', price=rng.choice([1.5, 2.0, 9.99, 20.0]))
+            for i in range(1, count + 1)]
+
+
+class TestIndexes(unittest.TestCase):
+
+    def test_price_index_orders(self):
+        # Test that the price index lists prices in both directions with ties in ascending ID order.
+        products = make_products(50)
+        index = PriceIndex()
+        index.rebuild(products)
+        descending = [p.id for p in sorted(products, key=lambda p: (-p.price, p.id))]
+        ascending = [p.id for p in sorted(products, key=lambda p: (p.price, p.id))]
+        self.assertEqual(list(index.iter_ids()), descending)
+        self.assertEqual(list(index.iter_ids(descending=False)), ascending)
+
+    def test_price_index_cursor(self):
+        # Test that resuming after any (price, id) key continues exactly where the previous page stopped.
+        products = make_products(30)
+        by_id = {p.id: p for p in products}
+        index = PriceIndex()
+        index.rebuild(products)
+        for descending in (True, False):
+            order = list(index.iter_ids(descending=descending))
+            for i, id in enumerate(order):
+                after = (by_id[id].price, id)
+                self.assertEqual(list(index.iter_ids(after, descending)), order[i + 1:])
+
+    def test_price_range_and_histogram(self):
+        # Test that range pages and bucket counts match filtering the products one by one.
+        products = make_products(60, seed=2)
+        by_id = {p.id: p for p in products}
+        index = PriceIndex()
+        index.rebuild(products)
+        ascending = [p.id for p in sorted(products, key=lambda p: (p.price, p.id))]
+        self.assertEqual(index.range_ids(2.0, 9.99, 100), [id for id in ascending if 2.0 <= by_id[id].price <= 9.99])
+        self.assertEqual(index.range_ids(3.0, 9.0, 100), [])
+        pages, after = [], None
+        while True:
+            page = index.range_ids(1.5, 9.99, 7, after)
+            pages.extend(page)
+            if len(page) < 7:
+                break
+            after = (by_id[page[-1]].price, page[-1])
+        self.assertEqual(pages, [id for id in ascending if by_id[id].price <= 9.99])
+        edges = [1.5, 2.0, 10.0, 20.0]
+        expected = [sum(1 for p in products if edges[i] <= p.price < edges[i + 1]) for i in range(3)]
+        expected[-1] += sum(1 for p in products if p.price == 20.0)
+        self.assertEqual(index.histogram(edges), expected)
+        self.assertEqual(sum(index.histogram(edges)), len(products))
+        self.assertEqual(index.bounds(), (1.5, 20.0))
+        self.assertIsNone(PriceIndex().bounds())
+
+    def test_incremental_maintenance(self):
+        # Test that adding and removing products keeps the indexes equal to a rebuild.
+        products = make_products(40, seed=1)
+        price_index, id_index = PriceIndex(), IdIndex()
+        for product in products:
+            price_index.add(product)
+            id_index.add(product)
+        for product in products[::3]:
+            price_index.remove(product)
+            id_index.remove(product)
+        remaining = [p for p in products if p not in products[::3]]
+        expected = PriceIndex()
+        expected.rebuild(remaining)
+        self.assertEqual(list(price_index.iter_ids()), list(expected.iter_ids()))
+        self.assertEqual(id_index.page(100), [p.id for p in remaining])
+        self.assertEqual(id_index.page(2, after=remaining[0].id), [p.id for p in remaining[1:3]])
+
+    def test_price_stats(self):
+        # Test that adding and removing prices keeps the aggregates equal to a rebuild, without the sum drifting.
+        products = [Product(id=i, name=f'P{i}', description='Counted', price=price)
+                    for i, price in enumerate([0.1, 0.2, 0.3, 1e8, 19.99, 25.0] * 50, 1)]
+        stats = PriceStats([1.0, 25.0])
+        for product in products:
+            stats.add(product)
+        for product in products[::2]:
+            stats.remove(product)
+        expected = PriceStats([1.0, 25.0])
+        expected.rebuild(products[1::2])
+        self.assertEqual(stats.summary((0.2, 1e8)), expected.summary((0.2, 1e8)))
+        self.assertEqual(stats.counts, [50, 0, 100])
+        for product in products[1::2]:
+            stats.remove(product)
+        self.assertEqual(stats.summary(None).total_price, 0.0)
+        self.assertIsNone(stats.summary(None).avg_price)
+
+    def test_content_index(self):
+        # Test that duplicates are found by name, description and price, whatever their ID.
+        index = ContentIndex()
+        index.rebuild([Product(id=3, name='A', description='Same', price=1.0),
+                       Product(id=5, name='A', description='Same', price=1.0)])
+        self.assertEqual(index.find(Product(name='A', description='Same', price=1.0)), 3)
+        self.assertIsNone(index.find(Product(name='A', description='Same', price=2.0)))
+        index.remove(Product(id=3, name='A', description='Same', price=1.0))
+        self.assertEqual(index.find(Product(id=99, name='A', description='Same', price=1.0)), 5)
+        index.remove(Product(id=5, name='A', description='Same', price=1.0))
+        self.assertEqual(index.ids, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
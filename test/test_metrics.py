@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+from apis import app
+from src import metrics
+from src.schemas import Product
+from src.storage import HTMLTableBackend
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.backend = HTMLTableBackend(os.path.join(self.tmp_dir, "index.html"))
+        self.backend.check()
+        self.was_enabled = metrics.enabled
+        metrics.reset()
+
+    def tearDown(self):
+        metrics.enable(self.was_enabled)
+        metrics.reset()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_disabled(self):
+        # Test that nothing is recorded while metrics are disabled.
+        metrics.enable(False)
+        self.backend.write_products([Product(name='A', description='First', price=1.0)])
+        self.backend.read_products()
+        self.assertEqual(metrics.STAGE_SECONDS.count("parse"), 0)
+        self.assertEqual(metrics.ROWS_SCANNED.value(), 0)
+        self.assertIn("emperia_rows_scanned_total 0", metrics.render())
+
+    def test_stages(self):
+        # Test that reads and writes record their stages, the bytes moved and the rows scanned.
+        metrics.enable()
+        size = os.path.getsize(self.backend.path)
+        self.backend.write_products([Product(name='A', description='First', price=1.0),
+                                     Product(name='B', description='Second', price=2.0)])
+        for stage in ("read_file", "parse", "serialize", "write_file"):
+            self.assertEqual(metrics.STAGE_SECONDS.count(stage), 1, stage)
+        # Only the new rows are written, followed by the end of the table they are inserted before.
+        self.assertEqual(metrics.BYTES_WRITTEN.value(), os.path.getsize(self.backend.path) - size + len("</table>"))
+        self.backend.read_products()
+        self.assertEqual(metrics.ROWS_SCANNED.value(), 2)
+        self.assertGreater(metrics.STAGE_SECONDS.count("build_models"), 0)
+        self.assertGreater(metrics.BYTES_READ.value(), os.path.getsize(self.backend.path))
+
+    def test_exposition(self):
+        # Test the Prometheus text format of histograms, counters and escaped label values.
+        metrics.enable()
+        histogram = metrics.Histogram("test_seconds", "A test histogram.", ("name",), buckets=(0.1, 1.0))
+        try:
+            histogram.observe(0.5, 'a "quoted" name')
+            histogram.observe(5.0, 'a "quoted" name')
+            lines = histogram.render()
+        finally:
+            metrics.REGISTRY.remove(histogram)
+        self.assertEqual(lines, [
+            '# HELP test_seconds A test histogram.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{name="a \\"quoted\\" name",le="0.1"} 0',
+            'test_seconds_bucket{name="a \\"quoted\\" name",le="1.0"} 1',
+            'test_seconds_bucket{name="a \\"quoted\\" name",le="+Inf"} 2',
+            'test_seconds_sum{name="a \\"quoted\\" name"} 5.5',
+            'test_seconds_count{name="a \\"quoted\\" name"} 2',
+        ])
+
+    def test_metrics_endpoint(self):
+        # Test that requests are recorded by route template and that /metrics exposes them.
+        with TestClient(app) as client:
+            metrics.enable(False)
+            self.assertEqual(client.get("/metrics").status_code, 404)
+            metrics.enable()
+            client.get("/")
+            client.get("/no/such/route")
+            response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn('emperia_request_seconds_count{method="GET",route="/",status="200"} 1', response.text)
+        self.assertIn('emperia_request_seconds_count{method="GET",route="unmatched",status="404"} 1', response.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import pickle
+import unittest
+from src.http_cache import render_json
+from src.rows import ProductRow, rows_json
+from src.schemas import Product
+
+
+class TestProductRow(unittest.TestCase):
+
+    def setUp(self):
+        self.products = [Product(id=1, name='T-shirt', description='100% cotton, "soft"', price=19.99),
+                         Product(id=2, name='Café crème', description='Mug\nwith a <b>tag</b>', price=5.0)]
+
+    def test_serialization_matches_fastapi(self):
+        # Test that rows serialize to the exact bytes FastAPI produces for the same products.
+        rows = [ProductRow.from_product(p) for p in self.products]
+        for product, row in zip(self.products, rows):
+            self.assertEqual(row.json(), render_json(product))
+        self.assertEqual(rows_json(rows), render_json(self.products))
+        self.assertEqual(rows_json([]), render_json([]))
+
+    def test_conversion(self):
+        # Test that rows convert back to equal products and survive pickling without their serialized form.
+        row = ProductRow.from_product(self.products[0])
+        self.assertEqual(row.to_product(), self.products[0])
+        row.json()
+        copy = pickle.loads(pickle.dumps(row))
+        self.assertEqual(copy, row)
+        self.assertIsNone(copy._json)
+        self.assertNotEqual(row, ProductRow.from_product(self.products[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from src.schemas import Product
+from src.search import SearchIndex, tokenize
+
+PRODUCTS = [
+    Product(id=1, name='T-shirt', description='A comfortable cotton t-shirt', price=19.99),
+    Product(id=2, name='Jeans', description='Classic denim jeans, cotton blend', price=49.99),
+    Product(id=3, name='Cotton Sweater', description='Soft and cozy sweater', price=59.99),
+    Product(id=4, name='Coat', description='Stylish coat for any occasion', price=89.99),
+]
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.rebuild(PRODUCTS)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Soft, COZY t-shirt'), ['soft', 'cozy', 't', 'shirt'])
+
+    def test_ranking(self):
+        # Test that a match in the name ranks above matches in the description only.
+        self.assertEqual(self.index.search('cotton', 10), [3, 1, 2])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.index.search('cotton sweater', 10), [3])
+        self.assertEqual(self.index.search('cotton coat', 10), [])
+
+    def test_prefix_matching(self):
+        # Test that a word also matches the longer words it starts, below whole-word matches.
+        self.assertEqual(self.index.search('co', 10), [4, 3, 1, 2])
+        self.assertEqual(self.index.search('swe', 10), [3])
+        self.assertEqual(self.index.search('cot', 1), [3])
+
+    def test_short_prefix_matches_every_expansion(self):
+        # Test that a short prefix finds a product whose only match sorts after many other expansions.
+        index = SearchIndex()
+        index.rebuild([Product(id=i, name=f'a{i:03d}', description='', price=1.0) for i in range(1, 201)])
+        self.assertEqual(len(index.search('a', 1000)), 200)
+        self.assertEqual(index.search('a', 5), [1, 2, 3, 4, 5])
+
+    def test_incremental_updates(self):
+        # Test that adding and removing products gives the same results as a rebuild.
+        self.index.remove(PRODUCTS[2])
+        self.index.add(Product(id=5, name='Wool coat', description='Warm wool', price=120.0))
+        expected = SearchIndex()
+        expected.rebuild([PRODUCTS[0], PRODUCTS[1], PRODUCTS[3],
+                          Product(id=5, name='Wool coat', description='Warm wool', price=120.0)])
+        for query in ('cotton', 'co', 'wool', 'sweater'):
+            self.assertEqual(self.index.search(query, 10), expected.search(query, 10))
+        self.assertEqual(self.index.terms, expected.terms)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,609 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from bs4 import BeautifulSoup
+from src import config
+from src.rows import ProductRow
+from src.schemas import Product, ProductUpdate
+from src.executors import shutdown
+from src.storage import CachedBackend, HTMLTableBackend, JournaledHTMLBackend, ShardedHTMLBackend, SQLiteBackend, \
+    StorageBackend, create_backend
+from src.storage.columnar import columns_path, open_columns, source_stamp
+from src.storage.html_table import EMPTY_TABLE, has_table, iter_products, iter_rows, load_rows, read_html, \
+    render_html
+from src.storage.signal import ChangeSignal
+from src.storage.snapshots import SnapshotStore
+from src.storage.sqlite import import_html
+
+
+def update_in_process(path, price):
+    # Write through a cache of another process, as another server worker does.
+    CachedBackend(HTMLTableBackend(path)).uptodate_products([ProductUpdate(id=1, price=price)])
+
+
+class TestStorageBackends(unittest.TestCase):
+
+    def setUp(self):
+        # Each test gets an empty HTML and SQLite store in a temporary directory.
+        self.tmp_dir = tempfile.mkdtemp()
+        self.backends = [
+            HTMLTableBackend(os.path.join(self.tmp_dir, "index.html")),
+            JournaledHTMLBackend(os.path.join(self.tmp_dir, "journaled.html")),
+            ShardedHTMLBackend(os.path.join(self.tmp_dir, "sharded.html"), shards=3),
+            SQLiteBackend(os.path.join(self.tmp_dir, "catalog.db")),
+        ]
+        for backend in self.backends:
+            backend.check()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_crud_surface(self):
+        # Test that every backend behaves the same for the operations used by src.crud.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                self.assertEqual(backend.write_product(Product(name='A', description='First', price=5.0)), 1)
+                self.assertEqual(backend.write_product(Product(name='B', description='Second', price=7.5)), 2)
+                self.assertTrue(backend.uptodate_product(1, price=9.0))
+                self.assertFalse(backend.uptodate_product(42, name='Missing'))
+                self.assertEqual(backend.get_product_by_id(1), Product(id=1, name='A', description='First', price=9.0))
+                self.assertEqual([p.id for p in backend.sort_products_by_price()], [1, 2])
+                self.assertTrue(backend.delete_product(2))
+                self.assertEqual([p.id for p in backend.read_products()], [1])
+                self.assertEqual(backend.truncate_db(), 1)
+                self.assertEqual(backend.read_products(), [])
+
+    def test_bulk_operations(self):
+        # Test that batches get consecutive IDs and per-item results, and are applied in a single write.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                products = [Product(name=f'P{i}', description='Bulk', price=i + 1.0) for i in range(4)]
+                self.assertEqual(backend.write_products(products), [1, 2, 3, 4])
+                stamp = backend.stamp()
+                self.assertEqual(backend.uptodate_products([ProductUpdate(id=2, name='Renamed'),
+                                                            ProductUpdate(id=9, price=1.0),
+                                                            ProductUpdate(id=3, price=30.0)]), [True, False, True])
+                self.assertEqual(backend.delete_products([4, 4, 8]), [True, False, False])
+                self.assertNotEqual(backend.stamp(), stamp)
+                self.assertEqual(backend.read_products(), [
+                    Product(id=1, name='P0', description='Bulk', price=1.0),
+                    Product(id=2, name='Renamed', description='Bulk', price=2.0),
+                    Product(id=3, name='P2', description='Bulk', price=30.0),
+                ])
+                self.assertEqual(backend.write_products([]), [])
+
+    def test_write_unique_products(self):
+        # Test that duplicates of stored products and within the batch are skipped, with and without the cache.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                backend.write_product(Product(name='A', description='Stored', price=1.0))
+                batch = [Product(name='A', description='Stored', price=1.0),
+                         Product(name='B', description='New', price=2.0),
+                         Product(name='B', description='New', price=2.0),
+                         Product(name='B', description='New', price=3.0)]
+                self.assertEqual(backend.write_unique_products(batch), [None, 2, None, 3])
+                cached = CachedBackend(backend)
+                self.assertEqual(cached.write_unique_products(batch + [Product(name='C', description='x', price=1.0)]),
+                                 [None, None, None, None, 4])
+                self.assertEqual(cached.find_duplicate(Product(id=9, name='C', description='x', price=1.0)).id, 4)
+
+    def test_iter_products(self):
+        # Test that the streaming readers return the same products as the list readers.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                for price in (3.0, 1.0, 2.0):
+                    backend.write_product(Product(name='A & B', description='<Streamed>', price=price))
+                self.assertEqual(list(backend.iter_products()), backend.read_products())
+                self.assertEqual(list(backend.iter_products_by_price()), backend.sort_products_by_price())
+
+    def test_pages(self):
+        # Test that walking the keyset pages visits every product once, in the same order as the full reads.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                for price in (3.0, 1.0, 2.0, 1.0, 3.0):
+                    backend.write_product(Product(name='Paged', description='Paged', price=price))
+                cached = CachedBackend(backend)
+                for reader in (backend, cached):
+                    pages, after = [], None
+                    while True:
+                        page = reader.read_products_page(2, after)
+                        pages.extend(p.id for p in page)
+                        if len(page) < 2:
+                            break
+                        after = page[-1].id
+                    self.assertEqual(pages, [1, 2, 3, 4, 5])
+                    for descending in (True, False):
+                        pages, after = [], None
+                        while True:
+                            page = reader.sort_products_page(2, after, descending)
+                            pages.extend(page)
+                            if len(page) < 2:
+                                break
+                            after = (page[-1].price, page[-1].id)
+                        self.assertEqual(pages, backend.sort_products_by_price(descending))
+                self.assertEqual([p.id for p in backend.sort_products_by_price()], [1, 5, 3, 2, 4])
+
+    def test_price_queries(self):
+        # Test that the price range, histogram and bounds of the cache wrapper match the plain backends.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                for price in (3.0, 1.0, 2.0, 1.0, 3.0):
+                    backend.write_product(Product(name='Priced', description='Priced', price=price))
+                cached = CachedBackend(backend)
+                for reader in (backend, cached):
+                    self.assertEqual([p.id for p in reader.range_products_by_price(1.0, 2.0, 10)], [2, 4, 3])
+                    self.assertEqual([p.id for p in reader.range_products_by_price(1.0, 3.0, 2, (1.0, 4))], [3, 1])
+                    self.assertEqual(reader.price_histogram([1.0, 2.0, 3.0]), [2, 3])
+                    self.assertEqual(reader.price_bounds(), (1.0, 3.0))
+
+    def test_row_scanner_chunks(self):
+        # Test that rows split across chunk boundaries are reassembled by the scanner.
+        backend = self.backends[0]
+        for i in range(20):
+            backend.write_product(Product(name=f'Product {i}', description='x &amp; y', price=i + 0.5))
+        self.assertEqual(list(iter_products(backend.path, chunk_size=7)), backend.read_products())
+
+    def test_cached_backend_tracks_writes(self):
+        # Test that the cache wrapper reloads after writes made through another handle on the same store.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                cached = CachedBackend(backend)
+                self.assertEqual(cached.read_products(), [])
+                other = type(backend)(backend.path)
+                other.write_product(Product(name='A', description='First', price=5.0))
+                self.assertEqual(cached.get_product_by_id(1).name, 'A')
+
+    def test_cached_backend_keeps_catalog_on_failed_reload(self):
+        # Test that a reload whose read fails keeps the previous catalog and is tried again on the next call.
+        backend = self.backends[0]
+        cached = CachedBackend(backend)
+        cached.write_products([Product(name=name, description='Kept', price=1.0) for name in 'AB'])
+        self.assertEqual(len(cached.load_catalog()), 2)
+        HTMLTableBackend(backend.path).write_product(Product(name='C', description='Elsewhere', price=2.0))
+        read_rows = backend.read_rows
+        backend.read_rows = lambda: iter([ProductRow.from_product(Product(id=9, name='X', description='Partial',
+                                                                          price=1.0)), None])
+        try:
+            with self.assertRaises(AttributeError):
+                cached.load_catalog()
+            self.assertEqual(list(cached._products), [1, 2])
+            self.assertEqual(cached.id_index.page(10, None), [1, 2])
+            self.assertFalse(cached._is_fresh())
+        finally:
+            backend.read_rows = read_rows
+        self.assertEqual(list(cached.load_catalog()), [1, 2, 3])
+        self.assertEqual(cached.get_product_by_id(3).name, 'C')
+
+    def test_cached_backend_patches_cache(self):
+        # Test that writes through the cache wrapper keep it equal to a fresh load.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                cached = CachedBackend(backend)
+                for price in (4.0, 2.0, 8.0):
+                    cached.write_product(Product(name='A', description='First', price=price))
+                cached.uptodate_product(2, price=16.0)
+                cached.delete_product(1)
+                self.assertEqual(cached.read_products(), backend.read_products())
+                self.assertEqual(cached.sort_products_by_price(), CachedBackend(backend).sort_products_by_price())
+
+    def test_cached_backend_versions(self):
+        # Test that the catalog version moves with every change and that products keep their version until they change.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                cached = CachedBackend(backend)
+                cached.write_products([Product(name=name, description='Versioned', price=1.0) for name in 'AB'])
+                catalog, a, b = cached.catalog_version(), cached.product_version(1), cached.product_version(2)
+                self.assertEqual(cached.catalog_version(), catalog)
+                cached.uptodate_product(2, price=2.0)
+                self.assertNotEqual(cached.catalog_version(), catalog)
+                self.assertEqual(cached.product_version(1), a)
+                self.assertNotEqual(cached.product_version(2), b)
+                catalog, b = cached.catalog_version(), cached.product_version(2)
+                cached.delete_products([5])
+                self.assertEqual(cached.catalog_version(), catalog)
+                # A change made elsewhere only moves the versions of the products it touched.
+                type(backend)(backend.path).uptodate_product(1, price=3.0)
+                self.assertNotEqual(cached.catalog_version(), catalog)
+                self.assertNotEqual(cached.product_version(1), a)
+                self.assertEqual(cached.product_version(2), b)
+                cached.delete_product(1)
+                self.assertIsNone(cached.product_version(1))
+                self.assertNotEqual(CachedBackend(backend).catalog_version()[0], cached.catalog_version()[0])
+
+    def test_cached_backend_stats(self):
+        # Test that the running aggregates follow the writes and match a recomputation from the store.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                cached = CachedBackend(backend)
+                self.assertEqual(cached.catalog_stats().count, 0)
+                cached.write_products([Product(name=name, description='Counted', price=price)
+                                       for name, price in zip('ABCD', (5.0, 30.0, 0.1, 2000.0))])
+                cached.uptodate_product(2, price=60.0)
+                cached.delete_product(3)
+                stats, expected = cached.verify_stats()
+                self.assertEqual(stats, expected)
+                self.assertEqual((stats.count, stats.min_price, stats.max_price, stats.total_price), (3, 5.0, 2000.0, 2065.0))
+                self.assertEqual([bucket.count for bucket in stats.buckets], [1, 0, 0, 1, 0, 0, 0, 1])
+                self.assertEqual((stats.buckets[0].min, stats.buckets[0].max, stats.buckets[-1].max), (None, 10.0, None))
+                # A change the cache missed is caught, and the cache is reloaded.
+                cached.price_stats.remove(Product(id=1, name='A', description='Counted', price=5.0))
+                stats, expected = cached.verify_stats()
+                self.assertNotEqual(stats.count, expected.count)
+                self.assertEqual(cached.catalog_stats(), expected)
+
+    def test_snapshot_restore(self):
+        # Test that a snapshot restores the catalog with its IDs, through a cache that stays coherent.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                cached = CachedBackend(backend)
+                cached.write_products([Product(name=name, description='Saved', price=1.0) for name in 'ABCD'])
+                cached.delete_product(2)
+                snapshots = SnapshotStore(os.path.join(self.tmp_dir, backend.name + ".snapshots"))
+                info = snapshots.create(cached.read_rows(), "before")
+                self.assertEqual((info.name, info.count), ("before", 3))
+                expected = cached.read_products()
+                cached.truncate_db()
+                cached.write_product(Product(name='After', description='Lost', price=2.0))
+                other = CachedBackend(type(backend)(backend.path))
+                self.assertEqual(len(other.read_products()), 1)
+                cached.commit_catalog(cached.stage_catalog(snapshots.load("before")))
+                # The columnar copies built while staging are carried over to the restored files.
+                tables = backend.shards if isinstance(backend, ShardedHTMLBackend) else \
+                    [backend] if isinstance(backend, HTMLTableBackend) else []
+                self.assertTrue(all(open_columns(table.path) is not None for table in tables))
+                self.assertEqual(cached.read_products(), expected)
+                self.assertEqual(type(backend)(backend.path).read_products(), expected)
+                self.assertEqual(other.read_products(), expected)
+                self.assertEqual(cached.write_product(Product(name='E', description='New', price=3.0)), 5)
+                self.assertEqual([p.id for p in type(backend)(backend.path).read_products()], [1, 3, 4, 5])
+                self.assertFalse([name for name in os.listdir(self.tmp_dir) if name.endswith(".restore")])
+
+    def test_concurrent_stagings(self):
+        # Test that catalogs staged at the same time by one process do not overwrite each other.
+        for backend in self.backends:
+            with self.subTest(backend=backend.name):
+                cached = CachedBackend(backend)
+                first = cached.stage_catalog([ProductRow(1, 'First', 'Staged', 1.0)])
+                second = cached.stage_catalog([ProductRow(2, 'Second', 'Staged', 2.0),
+                                               ProductRow(3, 'Third', 'Staged', 3.0)])
+                self.assertFalse(set(first.files) & set(second.files))
+                cached.commit_catalog(first)
+                self.assertEqual([p.name for p in type(backend)(backend.path).read_products()], ['First'])
+                cached.commit_catalog(second)
+                self.assertEqual([p.name for p in cached.read_products()], ['Second', 'Third'])
+                self.assertFalse([name for name in os.listdir(self.tmp_dir) if name.endswith(".restore")])
+
+    def test_snapshot_store(self):
+        # Test that snapshots are listed once complete, keep their names and can be deleted.
+        snapshots = SnapshotStore(os.path.join(self.tmp_dir, "snapshots"))
+        self.assertEqual(snapshots.list(), [])
+        first = snapshots.create([ProductRow(1, 'A', 'Saved', 1.0)])
+        second = snapshots.create([], "empty")
+        with self.assertRaises(FileExistsError):
+            snapshots.create([], "empty")
+        with self.assertRaises(ValueError):
+            snapshots.create([], "../escape")
+        self.assertEqual([info.name for info in snapshots.list()], [first.name, "empty"])
+        self.assertEqual(snapshots.get("empty"), second)
+        self.assertEqual([row.to_product() for row in snapshots.load(first.name)],
+                         [Product(id=1, name='A', description='Saved', price=1.0)])
+        self.assertTrue(snapshots.delete("empty"))
+        self.assertFalse(snapshots.delete("empty"))
+        self.assertIsNone(snapshots.load("empty"))
+        self.assertEqual(sorted(os.listdir(snapshots.directory)),
+                         [first.name + ".html", first.name + ".html.cols", first.name + ".json"])
+
+    def test_change_signal(self):
+        # Test that bumps are seen through every mapping of the signal file.
+        path = os.path.join(self.tmp_dir, "index.html.signal")
+        first, second = ChangeSignal(path), ChangeSignal(path)
+        self.assertEqual(first.value(), 0)
+        first.bump()
+        self.assertEqual(second.bump(), 2)
+        self.assertEqual(first.value(), 2)
+        first.close()
+        second.close()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork()")
+    def test_cache_coherence_across_processes(self):
+        # Test that a write made by another process is seen even when the file's size and mtime look unchanged.
+        backend = self.backends[0]
+        cached = CachedBackend(backend)
+        cached.write_product(Product(name='A', description='First', price=2.0))
+        self.assertEqual(cached.get_product_by_id(1).price, 2.0)
+        stat = os.stat(backend.path)
+        process = multiprocessing.get_context("fork").Process(target=update_in_process, args=(backend.path, 3.0))
+        process.start()
+        process.join()
+        self.assertEqual(os.path.getsize(backend.path), stat.st_size)
+        os.utime(backend.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(cached.get_product_by_id(1).price, 3.0)
+
+    def test_import_html(self):
+        # Test that the importer copies an HTML catalog into SQLite without renumbering products.
+        html = self.backends[0]
+        for name in ('A', 'B', 'C'):
+            html.write_product(Product(name=name, description='Imported', price=1.0))
+        html.delete_product(2)
+        sqlite_path = os.path.join(self.tmp_dir, "imported.db")
+        self.assertEqual(import_html(html.path, sqlite_path), 2)
+        self.assertEqual(SQLiteBackend(sqlite_path).read_products(), html.read_products())
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_backend("csv")
+
+
+class TestJournaledHTMLBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "index.html")
+        self.backend = JournaledHTMLBackend(self.path, compact_threshold=10 ** 6)
+        self.backend.check()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_writes_only_touch_the_journal(self):
+        # Test that mutations are appended to the journal and merged into reads without rewriting the snapshot.
+        snapshot = read_html(self.path)
+        self.backend.write_product(Product(name='A', description='First', price=5.0))
+        self.backend.uptodate_product(1, name='B')
+        self.assertEqual(read_html(self.path), snapshot)
+        self.assertTrue(os.path.exists(self.backend.journal_path))
+        self.assertEqual(JournaledHTMLBackend(self.path).get_product_by_id(1).name, 'B')
+
+    def test_compact(self):
+        # Test that compaction folds the journal into a new snapshot that a plain HTML backend can read.
+        for name in ('A', 'B', 'C'):
+            self.backend.write_product(Product(name=name, description='x < y & z', price=1.0))
+        self.backend.delete_product(2)
+        self.backend.compact()
+        expected = [Product(id=1, name='A', description='x < y & z', price=1.0),
+                    Product(id=3, name='C', description='x < y & z', price=1.0)]
+        self.assertEqual(HTMLTableBackend(self.path).read_products(), expected)
+        self.assertEqual(JournaledHTMLBackend(self.path).read_products(), expected)
+        self.assertEqual(self.backend.write_product(Product(name='D', description='Fourth', price=2.0)), 4)
+
+    def test_background_compaction(self):
+        # Test that reaching the threshold compacts the journal in the background.
+        backend = JournaledHTMLBackend(self.path, compact_threshold=3)
+        for name in ('A', 'B', 'C'):
+            backend.write_product(Product(name=name, description='Compacted', price=1.0))
+        for _ in range(100):
+            if not backend._compacting:
+                break
+            time.sleep(0.01)
+        self.assertEqual([p.name for p in HTMLTableBackend(self.path).read_products()], ['A', 'B', 'C'])
+
+    def test_stale_journal_is_ignored(self):
+        # Test that a journal is dropped once the snapshot it applies to is replaced by someone else.
+        self.backend.write_product(Product(name='A', description='First', price=5.0))
+        with open(self.path, "w") as f:
+            f.write(render_html([Product(id=7, name='Restored', description='Backup', price=1.0)]))
+        self.assertEqual([p.id for p in self.backend.read_products()], [7])
+        self.assertEqual(self.backend.write_product(Product(name='B', description='Second', price=2.0)), 8)
+        self.assertEqual([p.id for p in JournaledHTMLBackend(self.path).read_products()], [7, 8])
+
+
+class TestColumnarSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "index.html")
+        # Unordered IDs, a duplicated ID, ties on price and non-ASCII text.
+        self.products = [Product(id=4, name='Thé', description='x < y & z', price=2.5),
+                         Product(id=2, name='B', description='Second', price=9.0),
+                         Product(id=7, name='C', description='', price=2.5),
+                         Product(id=2, name='Shadowed', description='Duplicate', price=1.0),
+                         Product(id=1, name='€', description='Euro', price=0.5)]
+        with open(self.path, "w") as f:
+            f.write(render_html(self.products))
+        # Without warm-up, check() builds the columnar copy itself.
+        self.warmup = config.WARMUP
+        config.WARMUP = False
+        self.backend = HTMLTableBackend(self.path)
+        self.backend.check()
+
+    def tearDown(self):
+        config.WARMUP = self.warmup
+        shutil.rmtree(self.tmp_dir)
+
+    def test_check_scans_bytes(self):
+        # Test that check() finds a table by scanning the file, keeps a file with one and replaces a file without.
+        other = os.path.join(self.tmp_dir, "other.html")
+        for content, kept in (("<html><TABLE border=1></TABLE></html>", True), ("<tablet>", False), ("", False)):
+            with self.subTest(content=content):
+                with open(other, "w") as f:
+                    f.write(content)
+                self.assertEqual(has_table(other), kept)
+                HTMLTableBackend(other).check()
+                self.assertEqual(read_html(other), content if kept else EMPTY_TABLE)
+
+    def test_warm_up_builds_copy(self):
+        # Test that with warm-up, check() leaves the columnar copy to the first load of the catalog.
+        os.remove(columns_path(self.path))
+        config.WARMUP = True
+        self.backend.check()
+        self.assertFalse(os.path.exists(columns_path(self.path)))
+        self.assertEqual(CachedBackend(self.backend).load_catalog()[2].name, 'B')
+        self.assertTrue(os.path.exists(columns_path(self.path)))
+
+    def test_round_trip(self):
+        # Test that check() builds the columnar copy and that it holds the rows of the file.
+        self.assertTrue(os.path.exists(columns_path(self.path)))
+        with open_columns(self.path) as columns:
+            self.assertEqual(columns.rows(), list(iter_rows(self.path)))
+        self.assertEqual(self.backend.read_products(), self.products)
+
+    def test_reads_match_the_table(self):
+        # Test that lookups and sorted reads from the columns match a scan of the table.
+        self.assertIsNotNone(self.backend.columns())
+        for id in (1, 2, 3, 4, 7, 8):
+            self.assertEqual(self.backend.get_product_by_id(id), StorageBackend.get_product_by_id(self.backend, id))
+        self.assertEqual(self.backend.get_product_by_id(2).name, 'B')
+        for descending in (True, False):
+            expected = StorageBackend.sort_products_by_price(self.backend, descending)
+            self.assertEqual(self.backend.sort_products_by_price(descending), expected)
+            self.assertEqual(list(self.backend.iter_products_by_price(descending)), expected)
+            for after in (None, (2.5, 4), (2.5, 5), (9.0, 2), (100.0, 0)):
+                self.assertEqual(self.backend.sort_products_page(2, after, descending),
+                                 StorageBackend.sort_products_page(self.backend, 2, after, descending))
+        for low, high, after in ((1.0, 5.0, None), (2.5, 2.5, (2.5, 4)), (0.0, 100.0, (1.0, 2)), (3.0, 1.0, None)):
+            self.assertEqual(self.backend.range_products_by_price(low, high, 10, after),
+                             StorageBackend.range_products_by_price(self.backend, low, high, 10, after))
+
+    def test_stale_copy_is_rebuilt(self):
+        # Test that a columnar copy is not used once the file changes, even for a rewrite of the same size.
+        content = read_html(self.path)
+        with open(self.path, "w") as f:
+            f.write(content.replace("9.0", "8.0"))
+        self.assertIsNone(open_columns(self.path))
+        self.assertIsNone(self.backend.columns())
+        self.assertEqual(self.backend.get_product_by_id(2).price, 8.0)
+        self.assertEqual(load_rows(self.path)[1].price, 8.0)
+        self.assertEqual(self.backend.columns().find(2).price, 8.0)
+        self.backend.uptodate_product(2, price=7.0)
+        self.assertFalse(os.path.exists(columns_path(self.path)))
+        self.assertEqual(self.backend.sort_products_by_price()[0].price, 7.0)
+
+
+class TestRowIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "index.html")
+        self.backend = HTMLTableBackend(self.path)
+        self.backend.check()
+        self.backend.write_products([Product(name=name, description='Row', price=10.0) for name in 'ABCD'])
+        self.ratio = config.HTML_PADDING_RATIO
+
+    def tearDown(self):
+        config.HTML_PADDING_RATIO = self.ratio
+        shutil.rmtree(self.tmp_dir)
+
+    def test_in_place_changes(self):
+        # Test that deletes and updates that fit patch the rows where they are, keeping the file a valid table.
+        content = read_html(self.path)
+        size = os.path.getsize(self.path)
+        self.assertTrue(self.backend.delete_product(2))
+        self.assertFalse(self.backend.delete_product(2))
+        self.assertTrue(self.backend.uptodate_product(3, name='c', price=5.0))
+        self.assertEqual(os.path.getsize(self.path), size)
+        # The rows before the first change are untouched.
+        self.assertEqual(read_html(self.path)[:content.index('<tr><td>2<')], content[:content.index('<tr><td>2<')])
+        expected = [Product(id=1, name='A', description='Row', price=10.0),
+                    Product(id=3, name='c', description='Row', price=5.0),
+                    Product(id=4, name='D', description='Row', price=10.0)]
+        self.assertEqual(self.backend.read_products(), expected)
+        self.assertEqual(HTMLTableBackend(self.path).get_product_by_id(3), expected[1])
+        self.assertIsNone(HTMLTableBackend(self.path).get_product_by_id(2))
+        table = BeautifulSoup(read_html(self.path), "html.parser").find("table")
+        self.assertEqual(len(table.find_all("tr")), 4)
+
+    def test_grown_row_moves_to_the_end(self):
+        # Test that an update that no longer fits moves the row to the end of the table, and that IDs are reused.
+        self.assertTrue(self.backend.uptodate_product(1, description='A much longer description'))
+        self.assertEqual([p.id for p in self.backend.read_products()], [2, 3, 4, 1])
+        self.assertEqual(self.backend.get_product_by_id(1).description, 'A much longer description')
+        self.assertEqual(self.backend.delete_products([1, 4]), [True, True])
+        self.assertEqual(self.backend.write_product(Product(name='E', description='Row', price=1.0)), 4)
+        self.assertEqual([p.id for p in HTMLTableBackend(self.path).read_products()], [2, 3, 4])
+
+    def test_rows_without_table_are_kept(self):
+        # Test that a file holding rows but no table, as edited by hand, keeps its rows on the next write.
+        with open(self.path, "w") as f:
+            f.write("<tr><td>1</td><td>A</td><td>Row</td><td>10.0</td></tr>"
+                    "<tr><td>2</td><td>B</td><td>Row</td><td>20.0</td></tr>")
+        backend = HTMLTableBackend(self.path)
+        self.assertEqual(backend.write_products([Product(name='C', description='Row', price=30.0)]), [3])
+        self.assertEqual([(p.id, p.name) for p in HTMLTableBackend(self.path).read_products()],
+                         [(1, 'A'), (2, 'B'), (3, 'C')])
+
+    def test_compaction(self):
+        # Test that the padding is squeezed out once it makes up the configured share of the file.
+        config.HTML_PADDING_RATIO = 0.2
+        self.assertEqual(self.backend.delete_products([1, 2]), [True, True])
+        self.assertNotIn("  ", read_html(self.path))
+        self.assertEqual([p.id for p in self.backend.read_products()], [3, 4])
+        self.assertTrue(self.backend.uptodate_product(3, name='C'))
+        self.assertEqual(HTMLTableBackend(self.path).get_product_by_id(3).name, 'C')
+
+    def test_changes_by_another_instance(self):
+        # Test that the index is rescanned when another writer moved rows, even if the file's stamp looks unchanged.
+        self.assertEqual(self.backend.get_product_by_id(4).name, 'D')
+        other = HTMLTableBackend(self.path)
+        other.uptodate_product(1, description='A much longer description')
+        other.delete_product(3)
+        self.backend._rows.stamp = source_stamp(self.path)
+        self.assertIsNone(self.backend.get_product_by_id(3))
+        self.assertTrue(self.backend.uptodate_product(4, name='d'))
+        self.assertEqual([(p.id, p.name) for p in other.read_products()], [(2, 'B'), (4, 'd'), (1, 'A')])
+
+
+class TestShardedHTMLBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "index.html")
+        self.parse_executor = config.PARSE_EXECUTOR
+
+    def tearDown(self):
+        config.PARSE_EXECUTOR = self.parse_executor
+        shutdown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_split_existing_catalog(self):
+        # Test that check() splits a single-file catalog into shards by ID and keeps reads in ID order.
+        products = [Product(id=id, name=f'P{id}', description='Split', price=float(id % 4)) for id in (1, 2, 3, 5, 8)]
+        with open(self.path, "w") as f:
+            f.write(render_html(products))
+        backend = ShardedHTMLBackend(self.path, shards=2)
+        backend.check()
+        self.assertEqual([[p.id for p in shard.read_products()] for shard in backend.shards], [[2, 8], [1, 3, 5]])
+        self.assertEqual(backend.read_products(), products)
+        self.assertEqual(ShardedHTMLBackend(self.path, shards=5).shards[1].path, backend.shards[1].path)
+        self.assertEqual(backend.write_product(Product(name='New', description='Split', price=1.0)), 9)
+        self.assertEqual([p.id for p in backend.shards[1].read_products()], [1, 3, 5, 9])
+
+    def test_ids_and_point_operations(self):
+        # Test that IDs continue from the highest one, and that point operations only change their shard.
+        backend = ShardedHTMLBackend(self.path, shards=3)
+        backend.check()
+        self.assertEqual(backend.write_products([Product(name=f'P{i}', description='Row', price=1.0)
+                                                 for i in range(5)]), [1, 2, 3, 4, 5])
+        stamps = [shard.stamp() for shard in backend.shards]
+        self.assertEqual(backend.uptodate_products([ProductUpdate(id=4, name='Four'), ProductUpdate(id=9, name='No'),
+                                                    ProductUpdate(id=1, price=2.0)]), [True, False, True])
+        self.assertEqual([shard.stamp() == stamp for shard, stamp in zip(backend.shards, stamps)], [True, False, True])
+        self.assertEqual(backend.delete_products([5, 5, 4]), [True, False, True])
+        self.assertEqual(backend.write_product(Product(name='Reused', description='Row', price=1.0)), 4)
+        self.assertEqual(backend.get_product_by_id(1), Product(id=1, name='P0', description='Row', price=2.0))
+
+    def test_parallel_reads(self):
+        # Test that full and sorted reads fanned out to the shard threads or the parsing pool merge like a single table.
+        single = HTMLTableBackend(os.path.join(self.tmp_dir, "single.html"))
+        single.check()
+        single.write_products([Product(name=f'P{i}', description='Row', price=float(i * 7 % 5)) for i in range(20)])
+        for executor in ("thread", "process"):
+            with self.subTest(executor=executor):
+                config.PARSE_EXECUTOR = executor
+                backend = ShardedHTMLBackend(os.path.join(self.tmp_dir, f"{executor}.html"), shards=4)
+                backend.check()
+                backend.write_products([Product(name=f'P{i}', description='Row', price=float(i * 7 % 5))
+                                        for i in range(20)])
+                self.assertEqual(backend.read_products(), single.read_products())
+                for descending in (True, False):
+                    self.assertEqual(backend.sort_products_by_price(descending),
+                                     single.sort_products_by_price(descending))
+                    self.assertEqual(backend.sort_products_page(3, (2.0, 8), descending),
+                                     single.sort_products_page(3, (2.0, 8), descending))
+                self.assertEqual(backend.search_products('P1', 5), single.search_products('P1', 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import json
+import unittest
+from src.changes import ChangeFeed
+from src.schemas import Product, ProductUpdate
+from src.storage import CachedBackend, HTMLTableBackend, JournaledHTMLBackend
+from src.write_queue import WriteQueue
+
+
+class CountingBackend(HTMLTableBackend):
+    """An HTML backend that counts how many times the file is rewritten."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.commits = 0
+
+    def write_products(self, products):
+        self.commits += 1
+        return super().write_products(products)
+
+
+class RejectingBackend(HTMLTableBackend):
+    """An HTML backend that fails a whole write containing a product named 'Bad'."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.commits = 0
+
+    def write_products(self, products):
+        self.commits += 1
+        if any(product.name == 'Bad' for product in products):
+            raise ValueError("Bad product.")
+        return super().write_products(products)
+
+
+def write_in_process(path, count):
+    queue = WriteQueue(CachedBackend(JournaledHTMLBackend(path)))
+    for i in range(count):
+        queue.submit("add", [Product(name=f'P{os.getpid()}-{i}', description='Concurrent', price=1.0)]).result()
+    queue.close()
+
+
+class TestWriteQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "index.html")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_concurrent_writers_get_unique_ids(self):
+        # Test that writes from many threads are all kept, with distinct IDs, in fewer commits than writes.
+        backend = CountingBackend(self.path)
+        backend.check()
+        queue = WriteQueue(CachedBackend(backend), window=0.01)
+        ids = []
+
+        def writer(n):
+            for i in range(10):
+                ids.extend(queue.submit("add", [Product(name=f'T{n}-{i}', description='Threaded', price=1.0)]).result())
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queue.close()
+        self.assertEqual(sorted(ids), list(range(1, 81)))
+        self.assertEqual(len(backend.read_products()), 80)
+        self.assertLess(backend.commits, 80)
+
+    def test_mixed_mutations_keep_their_order(self):
+        # Test that a group with different kinds of mutations is applied in submission order.
+        backend = HTMLTableBackend(self.path)
+        backend.check()
+        queue = WriteQueue(CachedBackend(backend), window=0.05)
+        added = queue.submit("add", [Product(name='A', description='First', price=1.0)])
+        deleted = queue.submit("delete", [1])
+        truncated = queue.submit("truncate")
+        readded = queue.submit("add", [Product(name='B', description='Second', price=2.0)])
+        self.assertEqual(added.result(), [1])
+        self.assertEqual(deleted.result(), [True])
+        self.assertEqual(truncated.result(), 0)
+        self.assertEqual(readded.result(), [1])
+        queue.close()
+        self.assertEqual([p.name for p in backend.read_products()], ['B'])
+
+    def test_bad_item_fails_only_its_submission(self):
+        # Test that a group commit failing on one submission still commits the others merged with it.
+        backend = RejectingBackend(self.path)
+        backend.check()
+        queue = WriteQueue(CachedBackend(backend), window=0.05)
+        first = queue.submit("add", [Product(name='A', description='Good', price=1.0)])
+        bad = queue.submit("add", [Product(name='Bad', description='Rejected', price=1.0)])
+        last = queue.submit("add", [Product(name='B', description='Good', price=2.0)])
+        self.assertEqual(first.result(), [1])
+        with self.assertRaises(ValueError):
+            bad.result()
+        self.assertEqual(last.result(), [2])
+        queue.close()
+        self.assertEqual([p.name for p in backend.read_products()], ['A', 'B'])
+        self.assertEqual(backend.commits, 4)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork()")
+    def test_concurrent_processes(self):
+        # Test that processes sharing the store through the file lock never hand out the same ID twice.
+        JournaledHTMLBackend(self.path).check()
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=write_in_process, args=(self.path, 15)) for _ in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        products = JournaledHTMLBackend(self.path).read_products()
+        self.assertEqual(sorted(p.id for p in products), list(range(1, 46)))
+
+
+class TestChangeFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "index.html")
+        self.backend = CachedBackend(HTMLTableBackend(self.path))
+        self.backend.check()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_commits_are_published(self):
+        # Test that each committed mutation publishes its events, in order and numbered from 1.
+        feed = ChangeFeed(self.path + ".changes", retain=100)
+        queue = WriteQueue(self.backend, feed=feed)
+        queue.submit("add", [Product(name='A', description='First', price=1.0),
+                             Product(name='B', description='Second', price=2.0)]).result()
+        queue.submit("update", [ProductUpdate(id=1, price=3.0), ProductUpdate(id=1, name='a'),
+                                ProductUpdate(id=9, name='Missing')]).result()
+        queue.submit("delete", [2, 2]).result()
+        queue.submit("truncate").result()
+        queue.close()
+        changes, first = ChangeFeed(feed.path, retain=100).read(0, 10)
+        self.assertEqual(first, 1)
+        self.assertEqual([json.loads(event) for _, event in changes], [
+            {"seq": 1, "op": "add", "id": 1, "product": {"id": 1, "name": "A", "description": "First", "price": 1.0}},
+            {"seq": 2, "op": "add", "id": 2, "product": {"id": 2, "name": "B", "description": "Second", "price": 2.0}},
+            {"seq": 3, "op": "update", "id": 1, "product": {"id": 1, "name": "a", "description": "First", "price": 3.0}},
+            {"seq": 4, "op": "delete", "id": 2},
+            {"seq": 5, "op": "truncate", "count": 1},
+        ])
+        self.assertEqual([seq for seq, _ in feed.read(3, 1)[0]], [4])
+        self.assertEqual(feed.read(5, 10)[0], [])
+
+    def test_retention(self):
+        # Test that the oldest changes are dropped once twice the retained number accumulated, keeping the numbering.
+        feed = ChangeFeed(self.path + ".changes", retain=3)
+        for id in range(1, 8):
+            feed.publish([{"op": "delete", "id": id}])
+        changes, first = feed.read(0, 10)
+        self.assertEqual(first, 5)
+        self.assertEqual([seq for seq, _ in changes], [5, 6, 7])
+        self.assertEqual(ChangeFeed(feed.path, retain=3).last_seq(), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()